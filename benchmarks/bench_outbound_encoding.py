@@ -0,0 +1,73 @@
+"""Compares encoding of outbound payloads straight to bytes against the `jsons` path.
+
+Usage: `PYTHONPATH=src python benchmarks/bench_outbound_encoding.py`
+"""
+
+import json
+import timeit
+import tracemalloc
+from typing import Callable
+
+import jsons
+
+import format as fmt
+from storage import Question
+from telegram_client import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    SendMessagePayload,
+    encode_send_message,
+)
+
+QUESTION = Question(
+    "Which planet is known as the Red Planet?",
+    ["Venus", "Mars", "Jupiter", "Saturn"],
+    1,
+)
+
+
+def make_keyboard_uncached(question: Question) -> InlineKeyboardMarkup:
+    buttons = [
+        InlineKeyboardButton(chr(ord("a") + i), f"{chr(ord('a') + i)}")
+        for i in range(len(question.answers))
+    ]
+    return InlineKeyboardMarkup((tuple(buttons),))
+
+
+def send_with_jsons():
+    payload = SendMessagePayload(
+        1111111, fmt.make_question(QUESTION), make_keyboard_uncached(QUESTION)
+    )
+    return json.dumps(jsons.dump(payload, strip_nulls=True)).encode()
+
+
+def send_with_encoder():
+    payload = SendMessagePayload(
+        1111111, fmt.make_question(QUESTION), fmt.make_keyboard(QUESTION)
+    )
+    return encode_send_message(payload)
+
+
+def peak_memory(case: Callable) -> int:
+    """Peak number of bytes allocated while running `case` once."""
+
+    case()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    case()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main(number: int = 20000):
+    for name, case in [("jsons", send_with_jsons), ("encoder", send_with_encoder)]:
+        seconds = min(timeit.repeat(case, number=number, repeat=5))
+        print(
+            f"sendMessage / {name:10} {seconds / number * 1e6:8.2f} us/op "
+            f"{peak_memory(case):8} B peak"
+        )
+
+
+if __name__ == "__main__":
+    main()
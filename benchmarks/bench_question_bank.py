@@ -0,0 +1,68 @@
+"""Measures the memory taken by the questions as `Question` objects and as a
+`QuestionBank`, and the time to pick the questions of a game.
+
+Usage: `PYTHONPATH=src python benchmarks/bench_question_bank.py --count 1000000`
+
+The questions are synthetic: unique texts of ~80 characters and 4 answers each. A
+quarter of them are true/false questions and the rest of the answers come from a
+vocabulary of 100k strings, like the answers repeat in OpenTriviaDB.
+"""
+
+import gc
+import random
+import timeit
+import tracemalloc
+from typing import List
+
+import typer
+
+from question_bank import QuestionBankBuilder
+from storage import Question
+
+VOCABULARY_SIZE = 100_000
+
+
+def make_questions(count: int) -> List[Question]:
+    vocabulary = [f"answer {i}" for i in range(VOCABULARY_SIZE)]
+    questions = []
+    for i in range(count):
+        text = f"Question {i:>9}: which of these is the right answer to this question?"
+        if i % 4 == 0:
+            questions.append(Question(text, ["False", "True"], i % 2))
+        else:
+            # Answers are read from the DB, so equal answers are distinct objects.
+            answers = [a.encode().decode() for a in random.sample(vocabulary, 4)]
+            questions.append(Question(text, answers, i % 4))
+    return questions
+
+
+def measure_memory(make) -> tuple:
+    gc.collect()
+    tracemalloc.start()
+    result = make()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+
+def main(count: int = typer.Option(1_000_000, help="number of questions")):
+    questions, objects_size = measure_memory(lambda: make_questions(count))
+
+    def build():
+        builder = QuestionBankBuilder()
+        builder.add_all(questions)
+        return builder.build()
+
+    bank, bank_size = measure_memory(build)
+    print(f"{count} questions")
+    print(f"  as Question objects {objects_size / 2**20:8.1f} MiB")
+    print(f"  as QuestionBank     {bank_size / 2**20:8.1f} MiB")
+
+    number = 10000
+    seconds = min(timeit.repeat(lambda: bank.get_questions(5), number=number))
+    print(f"  5 random questions  {seconds / number * 1e6:8.2f} us")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,115 @@
+"""Compares picking the questions of a game with `ORDER BY random()` against
+`QuestionSampler` as the question bank grows.
+
+Usage: `PYTHONPATH=src python benchmarks/bench_question_sampling.py`
+
+The in-process sampling is always measured. The database part runs when the
+`POSTGRES_DB_*` variables are set. It creates scratch tables in a temporary schema
+with up to `--max-questions` questions, so it doesn't touch the bot tables.
+"""
+
+import os
+import random
+import timeit
+from typing import List
+
+import psycopg
+import typer
+
+from question_sampler import QuestionSampler
+
+SIZES = [10**3, 10**4, 10**5, 10**6, 10**7]
+GAME_QUESTIONS = 5
+
+RANDOM_ORDER_QUERY = """
+    SELECT id, question, text, is_correct FROM questions
+    INNER JOIN answers ON questions.id = answers.question_id
+    WHERE id IN (SELECT id FROM questions ORDER BY random() LIMIT (%s))
+    ORDER BY id, text;
+"""
+
+SAMPLED_QUERY = """
+    SELECT id, question, text, is_correct FROM questions
+    INNER JOIN answers ON questions.id = answers.question_id
+    WHERE id = ANY(%s)
+    ORDER BY id, text;
+"""
+
+
+def bench_in_process(sizes: List[int]):
+    print("In-process sampling of a game")
+    for size in sizes:
+        dense = QuestionSampler(range(1, size + 1))
+        sparse = QuestionSampler.from_ids(random.sample(range(1, 3 * size), size))
+        for name, sampler in (("dense", dense), ("sparse", sparse)):
+            number = 10000
+            seconds = min(
+                timeit.repeat(lambda: sampler.sample(GAME_QUESTIONS), number=number)
+            )
+            print(f"  {size:>10} questions {name:6} {seconds / number * 1e6:8.2f} us")
+
+
+def bench_database(sizes: List[int]):
+    conninfo = (
+        f"postgresql://{os.environ['POSTGRES_DB_USER']}:"
+        f"{os.environ['POSTGRES_DB_PASSWD']}@{os.environ['POSTGRES_DB_HOST']}:5432/"
+        f"{os.environ.get('POSTGRES_DB_NAME', 'postgres')}"
+    )
+    print("Database query of a game")
+    # pylint: disable = not-context-manager
+    with psycopg.connect(conninfo) as conn:
+        conn.execute(
+            "CREATE TEMPORARY TABLE questions (id integer PRIMARY KEY, question text)"
+        )
+        conn.execute(
+            "CREATE TEMPORARY TABLE answers "
+            "(question_id integer, text text, is_correct bool)"
+        )
+        conn.execute("CREATE INDEX ON answers (question_id)")
+        loaded = 0
+        for size in sizes:
+            conn.execute(
+                "INSERT INTO questions SELECT i, 'question ' || i "
+                "FROM generate_series(%s, %s) i",
+                (loaded + 1, size),
+            )
+            conn.execute(
+                "INSERT INTO answers SELECT i, 'answer ' || a, a = 0 "
+                "FROM generate_series(%s, %s) i, generate_series(0, 3) a",
+                (loaded + 1, size),
+            )
+            conn.execute("ANALYZE questions; ANALYZE answers")
+            loaded = size
+            sampler = QuestionSampler(range(1, size + 1))
+
+            def random_order():
+                conn.execute(RANDOM_ORDER_QUERY, (GAME_QUESTIONS,)).fetchall()
+
+            def sampled():
+                conn.execute(
+                    SAMPLED_QUERY, (sampler.sample(GAME_QUESTIONS),)
+                ).fetchall()
+
+            for name, case in (
+                ("ORDER BY random()", random_order),
+                ("sampler", sampled),
+            ):
+                number = 20
+                seconds = min(timeit.repeat(case, number=number, repeat=3))
+                print(
+                    f"  {size:>10} questions {name:18} {seconds / number * 1e3:8.2f} ms"
+                )
+
+
+def main(
+    max_questions: int = typer.Option(10**6, help="max question bank size in the DB")
+):
+    bench_in_process(SIZES)
+    if "POSTGRES_DB_USER" in os.environ:
+        bench_database([size for size in SIZES if size <= max_questions])
+    else:
+        print("POSTGRES_DB_USER is not set, the database part is skipped")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,124 @@
+"""Compares the chat handler snapshot codecs: snapshot size, encode and decode time.
+
+Usage: `PYTHONPATH=src python benchmarks/bench_snapshot_codecs.py`
+
+When the `POSTGRES_DB_*` variables are set, it also measures the WAL written by
+upserting the snapshots of a game into a scratch table.
+"""
+
+import asyncio
+import os
+import timeit
+from typing import Dict
+
+import psycopg
+import typer
+from run import NullTelegramClient
+
+from bot_state import BotStateFactory, GameState, ProtoGameState
+from chat_handler import ChatHandler
+from custom_codecs import BinarySnapshotCodec, JsonSnapshotCodec, SnapshotCodec
+from storage import InMemoryStorage, Question
+
+QUESTIONS = [
+    Question(
+        f"{i}. In which year did the first manned Moon landing take place?",
+        ["1965", "1969", "1972", "1959"],
+        1,
+    )
+    for i in range(5)
+]
+
+
+async def make_handlers(state_factory: BotStateFactory) -> Dict[str, ChatHandler]:
+    return {
+        "idle": await ChatHandler.create(
+            await state_factory.make_idle_state(), 123456789
+        ),
+        "game": await ChatHandler.create(await state_factory.make_game_state(), 1),
+        # The games stored before the questions were referred to by id.
+        "game inline": ChatHandler(
+            GameState(
+                state_factory.client,
+                state_factory,
+                ProtoGameState([], 0, 0, 1, QUESTIONS),
+                True,
+            ),
+            1,
+        ),
+    }
+
+
+def bench_codecs(codecs: Dict[str, SnapshotCodec], handlers: Dict[str, ChatHandler]):
+    number = 5000
+    print(f"{'':26}{'bytes':>8}{'encode us':>12}{'decode us':>12}")
+    for state, handler in handlers.items():
+        for name, codec in codecs.items():
+            snapshot = codec.encode(handler)
+            encode = min(timeit.repeat(lambda: codec.encode(handler), number=number))
+            decode = min(
+                timeit.repeat(
+                    lambda: codec.decode(snapshot, handler.chat_id), number=number
+                )
+            )
+            print(
+                f"{state + ' / ' + name:26}{len(snapshot):8}"
+                f"{encode / number * 1e6:12.2f}{decode / number * 1e6:12.2f}"
+            )
+
+
+def bench_wal(codecs: Dict[str, SnapshotCodec], handler: ChatHandler, rows: int):
+    conninfo = (
+        f"postgresql://{os.environ['POSTGRES_DB_USER']}:"
+        f"{os.environ['POSTGRES_DB_PASSWD']}@{os.environ['POSTGRES_DB_HOST']}:5432/"
+        f"{os.environ.get('POSTGRES_DB_NAME', 'postgres')}"
+    )
+    print(f"WAL written by {rows} upserts of a game snapshot")
+    # pylint: disable = not-context-manager
+    with psycopg.connect(conninfo, autocommit=True) as conn:
+        for name, codec in codecs.items():
+            conn.execute("DROP TABLE IF EXISTS snapshot_bench")
+            conn.execute(
+                "CREATE TABLE snapshot_bench (chat_id bigint PRIMARY KEY, s bytea)"
+            )
+            snapshot = codec.encode(handler)
+            start = _wal_lsn(conn)
+            for chat_id in range(rows):
+                conn.execute(
+                    "INSERT INTO snapshot_bench VALUES (%s, %s) "
+                    "ON CONFLICT (chat_id) DO UPDATE SET s = excluded.s",
+                    (chat_id % 100, snapshot),
+                )
+            wal = conn.execute(
+                "SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), %s)", (start,)
+            ).fetchone()
+            assert wal is not None
+            print(f"  {name:20} {wal[0] / rows:10.1f} bytes per upsert")
+        conn.execute("DROP TABLE snapshot_bench")
+
+
+def _wal_lsn(conn: psycopg.Connection) -> str:
+    row = conn.execute("SELECT pg_current_wal_lsn()::text").fetchone()
+    assert row is not None
+    return row[0]
+
+
+def main(rows: int = typer.Option(10000, help="upserts made for the WAL numbers")):
+    client = NullTelegramClient()
+    state_factory = BotStateFactory(client, InMemoryStorage(QUESTIONS))
+    handlers = asyncio.run(make_handlers(state_factory))
+    codecs: Dict[str, SnapshotCodec] = {
+        "json": JsonSnapshotCodec(client, state_factory),
+        "binary": BinarySnapshotCodec(client, state_factory, compress_min_size=None),
+        "binary+zlib": BinarySnapshotCodec(client, state_factory, compress_min_size=0),
+        "binary sparse": BinarySnapshotCodec(client, state_factory, sparse_idle=True),
+    }
+    bench_codecs(codecs, handlers)
+    if "POSTGRES_DB_USER" in os.environ:
+        bench_wal(codecs, handlers["game"], rows)
+    else:
+        print("POSTGRES_DB_USER is not set, the WAL part is skipped")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,52 @@
+"""Compares the hand-written Telegram decoders against the generic `jsons` path.
+
+Usage: `PYTHONPATH=src python benchmarks/bench_update_decoding.py`
+"""
+
+import json
+import timeit
+
+import jsons
+
+from telegram_client import GetUpdatesResponse, Update, load_object
+from utils import transform_keywords
+
+UPDATE = json.dumps(
+    {
+        "update_id": 10000,
+        "message": {
+            "message_id": 1365,
+            "from": {"id": 1111111, "is_bot": False, "first_name": "Ann"},
+            "chat": {"id": 1111111, "first_name": "Ann", "type": "private"},
+            "date": 1441645532,
+            "text": "b",
+        },
+    }
+).encode()
+
+BATCH = json.dumps(
+    {"ok": True, "result": [json.loads(UPDATE) | {"update_id": i} for i in range(100)]}
+).encode()
+
+
+def main(number: int = 20000):
+    cases = {
+        "Update / jsons": lambda: jsons.load(
+            json.loads(UPDATE), cls=Update, key_transformer=transform_keywords
+        ),
+        "Update / decoder": lambda: load_object(UPDATE, Update),
+        "getUpdates x100 / jsons": lambda: jsons.load(
+            json.loads(BATCH),
+            cls=GetUpdatesResponse,
+            key_transformer=transform_keywords,
+        ),
+        "getUpdates x100 / decoder": lambda: load_object(BATCH, GetUpdatesResponse),
+    }
+    for name, case in cases.items():
+        n = number if "x100" not in name else number // 100
+        seconds = min(timeit.repeat(case, number=n, repeat=5))
+        print(f"{name:28} {seconds / n * 1e6:10.2f} us/op")
+
+
+if __name__ == "__main__":
+    main()
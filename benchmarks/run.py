@@ -0,0 +1,272 @@
+"""Benchmarks of the bot hot paths with a check against the stored baseline.
+
+Usage:
+    PYTHONPATH=src python benchmarks/run.py                  # print the results
+    PYTHONPATH=src python benchmarks/run.py --check          # fail on regressions
+    PYTHONPATH=src python benchmarks/run.py --save-baseline  # update baseline.json
+
+The results are printed as JSON with the best time per operation in microseconds
+out of several repeats. A benchmark regresses if it is slower than the baseline by
+both the relative tolerance and the absolute floor, as a fraction of a microsecond
+is noise for the fastest ones. The baseline is machine specific, so it should be
+regenerated when the benchmarks are run on a different machine. Regenerate it in a
+commit of its own, not along with a change of the code, so that the numbers are
+reviewed.
+"""
+
+import asyncio
+import json
+import platform
+import sys
+import time
+import timeit
+from functools import partial
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import jsons
+import typer
+
+import format as fmt
+from bot_state import BotStateFactory
+from chat_handler import ChatHandler
+from custom_codecs import BinarySnapshotCodec, ChatHandlerDecoder, ChatHandlerEncoder
+from handler_cache import ChatHandlerCache
+from main import Bot
+from storage import (
+    InMemoryStorage,
+    PostgresQuestionRecord,
+    Question,
+    group_question_records,
+)
+from telegram_client import (
+    CallbackQuery,
+    Chat,
+    Message,
+    MessageEdit,
+    SendMessagePayload,
+    TelegramClient,
+    Update,
+    User,
+    load_object,
+)
+from utils import transform_keywords
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+
+QUESTIONS = [
+    Question(
+        f"{i}. Which planet is known as the Red Planet?",
+        ["Venus", "Mars", "Jupiter", "Saturn"],
+        1,
+    )
+    for i in range(5)
+]
+
+UPDATE = json.dumps(
+    {
+        "update_id": 10000,
+        "message": {
+            "message_id": 1365,
+            "from": {"id": 1111111, "is_bot": False, "first_name": "Ann"},
+            "chat": {"id": 1111111, "first_name": "Ann", "type": "private"},
+            "date": 1441645532,
+            "text": "b",
+        },
+    }
+).encode()
+
+
+class NullTelegramClient(TelegramClient):
+    """A client answering immediately without sending anything."""
+
+    async def get_updates(
+        self, offset: int = 0, timeout: int = 0, limit: Optional[int] = None
+    ) -> List[Update]:
+        return []
+
+    async def send_message(self, payload: SendMessagePayload) -> int:
+        return 1
+
+    async def edit_message_text(self, payload: MessageEdit) -> None:
+        pass
+
+
+def game_updates(chat_id: int) -> List[Update]:
+    """The updates of a chat playing a single game from the greeting."""
+
+    def message(text: str) -> Update:
+        return Update(0, Message(Chat(chat_id), text), None)
+
+    def answer(data: str) -> Update:
+        return Update(0, None, CallbackQuery(User(chat_id), data))
+
+    return [message("hi"), message("/startGame")] + [
+        answer(letter) for letter in "abcab"
+    ]
+
+
+def make_bot(cached: bool = False) -> Bot:
+    client = NullTelegramClient()
+    storage = InMemoryStorage(QUESTIONS)
+    state_factory = BotStateFactory(client, storage)
+    handler_cache = None
+    if cached:
+        handler_cache = ChatHandlerCache(
+            storage, BinarySnapshotCodec(client, state_factory)
+        )
+    # `handle_update` uses only the state factory and the storage.
+    return Bot(
+        client, state_factory, storage, handler_cache=handler_cache  # type: ignore
+    )
+
+
+async def make_game_handler(
+    client: TelegramClient, state_factory: BotStateFactory
+) -> ChatHandler:
+    return ChatHandler(await state_factory.make_game_state(), 1)
+
+
+async def play_games(bot: Bot, games: int) -> int:
+    """Plays `games` games in 100 chats taking turns and returns the number of
+    handled updates. Changed chats are written at the end, like on a timer."""
+
+    operations = 0
+    for game in range(games):
+        for update in game_updates(game % 100 + 1):
+            await bot.handle_update(update)
+            operations += 1
+    if bot.handler_cache is not None:
+        await bot.handler_cache.flush()
+    return operations
+
+
+def measure(case: Callable[[], object], number: int) -> float:
+    """Returns the best time of a call in microseconds."""
+
+    return min(timeit.repeat(case, number=number, repeat=5)) / number * 1e6
+
+
+def measure_async(
+    loop: asyncio.AbstractEventLoop, case: Callable[[int], Awaitable[int]], number: int
+) -> float:
+    """Returns the best time of an operation in microseconds. `case` runs the given
+    number of iterations and returns the number of operations made."""
+
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        operations = loop.run_until_complete(case(number))
+        best = min(best, (time.perf_counter() - start) / operations * 1e6)
+    return best
+
+
+def run_benchmarks(number: int) -> Dict[str, float]:
+    loop = asyncio.new_event_loop()
+    results: Dict[str, float] = {}
+
+    for name, bot in (
+        ("handle_update (per update)", make_bot()),
+        ("handle_update cached (per update)", make_bot(cached=True)),
+    ):
+        results[name] = measure_async(
+            loop, partial(play_games, bot), max(1, number // 50)
+        )
+
+    client = NullTelegramClient()
+    state_factory = BotStateFactory(client, InMemoryStorage(QUESTIONS))
+    handler = loop.run_until_complete(make_game_handler(client, state_factory))
+    snapshot = json.dumps(handler, cls=ChatHandlerEncoder)
+    decoder = ChatHandlerDecoder(client, state_factory)
+    results["ChatHandlerEncoder game state"] = measure(
+        lambda: json.dumps(handler, cls=ChatHandlerEncoder), number // 10
+    )
+    results["ChatHandlerDecoder game state"] = measure(
+        lambda: decoder.decode(json.loads(snapshot)), number // 10
+    )
+    codec = BinarySnapshotCodec(client, state_factory)
+    binary_snapshot = codec.encode(handler)
+    results["BinarySnapshotCodec encode game state"] = measure(
+        lambda: codec.encode(handler), number // 10
+    )
+    results["BinarySnapshotCodec decode game state"] = measure(
+        lambda: codec.decode(binary_snapshot), number // 10
+    )
+
+    results["Update / jsons"] = measure(
+        lambda: jsons.load(
+            json.loads(UPDATE), cls=Update, key_transformer=transform_keywords
+        ),
+        number // 10,
+    )
+    results["Update / decoder"] = measure(lambda: load_object(UPDATE, Update), number)
+
+    question = QUESTIONS[0]
+    results["format.make_question"] = measure(
+        lambda: fmt.make_question(question), number
+    )
+    results["format.make_answered_question"] = measure(
+        lambda: fmt.make_answered_question(2, question), number
+    )
+    results["format.make_keyboard"] = measure(
+        lambda: fmt.make_keyboard(question), number
+    )
+
+    records = [
+        PostgresQuestionRecord(i, q.text, answer, j == q.correct_answer)
+        for i, q in enumerate(QUESTIONS)
+        for j, answer in enumerate(q.answers)
+    ]
+    results["group_question_records x5"] = measure(
+        lambda: group_question_records(records), number // 10
+    )
+
+    loop.close()
+    return {name: round(us, 3) for name, us in results.items()}
+
+
+def compare(
+    results: Dict[str, float],
+    baseline: Dict[str, float],
+    tolerance: float,
+    floor: float = 0.0,
+) -> List[str]:
+    """Returns the descriptions of the benchmarks slower than the baseline by more
+    than `tolerance` (a fraction) and by more than `floor` microseconds."""
+
+    regressions = []
+    for name, us in results.items():
+        base = baseline.get(name)
+        if base is not None and us > max(base * (1 + tolerance), base + floor):
+            regressions.append(f"{name}: {us:.3f} us/op vs {base:.3f} us/op baseline")
+    return regressions
+
+
+def main(
+    number: int = typer.Option(20000, help="iterations of the fastest benchmarks"),
+    check: bool = typer.Option(False, help="fail if slower than the baseline"),
+    tolerance: float = typer.Option(0.25, help="allowed slowdown as a fraction"),
+    floor: float = typer.Option(0.5, help="allowed slowdown in microseconds"),
+    save_baseline: bool = typer.Option(False, help="store the results as baseline"),
+):
+    results = run_benchmarks(number)
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "us_per_op": results,
+    }
+    print(json.dumps(report, indent=2))
+
+    if save_baseline:
+        BASELINE_PATH.write_text(json.dumps(report, indent=2) + "\n")
+    elif check:
+        baseline = json.loads(BASELINE_PATH.read_text())["us_per_op"]
+        regressions = compare(results, baseline, tolerance, floor)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
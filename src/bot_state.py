@@ -1,6 +1,8 @@
+import asyncio
+import logging
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import List
+from typing import List, Optional
 
 import format as fmt
 from storage import Question, Storage
@@ -18,15 +20,23 @@ class InvalidCallbackDataException(BotStateException):
         self.data = data
 
 
+class QuestionNotFoundException(BotStateException):
+    def __init__(self, question_id: int):
+        super().__init__(f"Question {question_id} is not found")
+        self.question_id = question_id
+
+
 class BotState(ABC):
     """A class responsible for handling a single chat operation."""
 
     def __init__(self, _on_enter_called: bool):
         self._on_enter_called = _on_enter_called
+        self._changed = False
 
     async def on_enter(self, chat_id: int) -> None:
         assert not self._on_enter_called
         self._on_enter_called = True
+        self._changed = True
         await self._do_on_enter(chat_id)
 
     async def process(self, update: Update) -> "BotState":
@@ -52,6 +62,16 @@ class BotState(ABC):
     def is_on_enter_called(self):
         return self._on_enter_called
 
+    @property
+    def changed(self) -> bool:
+        """Whether the state changed since it was made or `clear_changed` was called.
+        An unchanged state doesn't need to be stored again."""
+
+        return self._changed
+
+    def clear_changed(self) -> None:
+        self._changed = False
+
 
 class IdleState(BotState):
     """A state when there is no active game in place."""
@@ -75,10 +95,14 @@ class IdleState(BotState):
             chat_id = update.message.chat.id
 
             if text == "/startgame":
-                await self._client.send_text(chat_id, "Starting game!")
-                return await self._state_factory.make_game_state()
+                # The questions are fetched while the message is being sent.
+                _, game_state = await asyncio.gather(
+                    self._client.post_text(chat_id, "Starting game!"),
+                    self._state_factory.make_game_state(),
+                )
+                return game_state
 
-            await self._client.send_text(
+            await self._client.post_text(
                 chat_id, "Type /startGame to start a new game."
             )
         return self
@@ -86,12 +110,19 @@ class IdleState(BotState):
 
 @dataclass
 class ProtoGameState:
-    """A serializable part of the GameState. Used to store and load the state."""
+    """A serializable part of the GameState. Used to store and load the state.
+
+    question_ids: ids of the questions of the game. The questions are looked up
+        in `Storage` when needed.
+    questions: the questions themselves, only set in the states stored before
+        the questions were referred to by id. `question_ids` is ignored then.
+    """
 
-    questions: List[Question]
+    question_ids: List[int]
     current_question: int
     score: int
     last_question_msg_id: int
+    questions: Optional[List[Question]] = None
 
 
 class GameState(BotState):
@@ -121,12 +152,22 @@ class GameState(BotState):
     def game_params(self) -> ProtoGameState:
         return self._params
 
+    @property
+    def question_count(self) -> int:
+        if self._params.questions is not None:
+            return len(self._params.questions)
+        return len(self._params.question_ids)
+
+    async def get_question(self, index: int) -> Question:
+        if self._params.questions is not None:
+            return self._params.questions[index]
+        return await self._state_factory.get_question(self._params.question_ids[index])
+
     async def _do_on_enter(self, chat_id: int) -> None:
         assert self._params.current_question == 0
+        question = await self.get_question(0)
         self._params.last_question_msg_id = await self._client.send_text(
-            chat_id,
-            fmt.make_question(self._params.questions[0]),
-            fmt.make_keyboard(self._params.questions[0]),
+            chat_id, fmt.make_question(question), fmt.make_keyboard(question)
         )
 
     async def _do_process(self, update: Update) -> "BotState":
@@ -134,11 +175,9 @@ class GameState(BotState):
         if update.message is not None:
             answer = parse_answer(update.message.text)
             if answer is None:
-                await self._client.send_text(
-                    chat_id,
-                    fmt.make_answers_help_message(
-                        self._params.questions[self._params.current_question].answers
-                    ),
+                question = await self.get_question(self._params.current_question)
+                await self._client.post_text(
+                    chat_id, fmt.make_answers_help_message(question.answers)
                 )
                 return self
         elif update.callback_query is not None:
@@ -150,51 +189,66 @@ class GameState(BotState):
         return await self._handle_answer(chat_id, answer)
 
     async def _handle_answer(self, chat_id: int, answer: int):
-        cur_question = self._params.questions[self._params.current_question]
+        cur_question = await self.get_question(self._params.current_question)
         if answer < 0 or answer >= len(cur_question.answers):
-            await self._client.send_text(
+            await self._client.post_text(
                 chat_id,
                 fmt.make_answers_help_message(cur_question.answers),
             )
             return self
 
-        if (
-            answer
-            == self._params.questions[self._params.current_question].correct_answer
-        ):
+        next_index = self._params.current_question + 1
+        next_question = None
+        if next_index != self.question_count:
+            next_question = await self.get_question(next_index)
+
+        self._changed = True
+        if answer == cur_question.correct_answer:
             self._params.score += 1
 
-        await self._client.edit_message_text(
+        # Editing the answered question doesn't affect the order of the messages
+        # in the chat, so it is done while the next message is being sent.
+        edit = self._edit_answered_question(
             MessageEdit(
                 chat_id,
                 self._params.last_question_msg_id,
-                fmt.make_answered_question(
-                    answer, self._params.questions[self._params.current_question]
-                ),
+                fmt.make_answered_question(answer, cur_question),
             ),
         )
-        self._params.current_question += 1
+        self._params.current_question = next_index
 
-        if self._params.current_question != len(self._params.questions):
-            self._params.last_question_msg_id = await self._client.send_text(
-                chat_id,
-                fmt.make_question(
-                    self._params.questions[self._params.current_question]
-                ),
-                fmt.make_keyboard(
-                    self._params.questions[self._params.current_question]
+        if next_question is not None:
+            _, self._params.last_question_msg_id = await asyncio.gather(
+                edit,
+                self._client.send_text(
+                    chat_id,
+                    fmt.make_question(next_question),
+                    fmt.make_keyboard(next_question),
                 ),
             )
             return self
 
-        await self._client.send_text(
-            chat_id,
-            f"You got {self._params.score} points out of {self._params.current_question}."
-            + "\n"
-            + "If you want to try again, type /startGame to start a new game.",
+        await asyncio.gather(
+            edit,
+            self._client.post_text(
+                chat_id,
+                f"You got {self._params.score} points out of "
+                f"{self._params.current_question}."
+                + "\n"
+                + "If you want to try again, type /startGame to start a new game.",
+            ),
         )
         return await self._state_factory.make_idle_state()
 
+    async def _edit_answered_question(self, edit: MessageEdit) -> None:
+        """Marks the answers of the answered question. A failed edit is only logged:
+        the answer counts, and the next question may be sent already."""
+
+        try:
+            await self._client.edit_message_text(edit)
+        except Exception:  # pylint: disable=broad-except
+            logging.exception("Failed to edit the answered question")
+
 
 class GreetingState(BotState):
     """A state responsible for greeting and introducing new user to the bot."""
@@ -213,7 +267,7 @@ class GreetingState(BotState):
         pass
 
     async def _do_process(self, update: Update) -> "BotState":
-        await self._client.send_text(
+        await self._client.post_text(
             update.chat_id,
             "Hello. I am Trivia Bot. If you want to play the game,\n"
             "please type /startGame",
@@ -228,6 +282,10 @@ class BotStateFactory:
         self._client = client
         self._storage = storage
 
+    @property
+    def client(self) -> TelegramClient:
+        return self._client
+
     async def make_game_state(self):
         _question_count = 5
         if self._storage is not None:
@@ -235,11 +293,17 @@ class BotStateFactory:
                 self._client,
                 self,
                 ProtoGameState(
-                    await self._storage.get_questions(_question_count), 0, 0, 0
+                    await self._storage.get_question_ids(_question_count), 0, 0, 0
                 ),
             )
         raise TypeError("Storage must be chosen for creating game state")
 
+    async def get_question(self, question_id: int) -> Question:
+        question = await self._storage.get_question(question_id)
+        if question is None:
+            raise QuestionNotFoundException(question_id)
+        return question
+
     async def make_idle_state(self):
         return IdleState(self._client, self)
 
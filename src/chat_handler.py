@@ -6,14 +6,18 @@ class ChatHandler:
     """A top-level handler responsible for driving communications within a single chat.
     It works by implementing a state machine over `BotState`s."""
 
-    def __init__(self, initial_state: BotState, chat_id: int) -> None:
+    def __init__(
+        self, initial_state: BotState, chat_id: int, changed: bool = False
+    ) -> None:
         """
         initial_state -- initial state responsible for handling chat updates.
         chat_id -- id of the chat this handler is responsible for.
+        changed -- whether the handler needs to be stored, e.g. a new one.
         """
 
         self._state = initial_state
         self._chat_id = chat_id
+        self._changed = changed
 
     async def process(self, update: Update) -> None:
         """Processes a given `update`."""
@@ -22,6 +26,8 @@ class ChatHandler:
         if new_state != self._state:
             await new_state.on_enter(self._chat_id)
 
+        if new_state is not self._state:
+            self._changed = True
         self._state = new_state
 
     @staticmethod
@@ -30,7 +36,7 @@ class ChatHandler:
         at the very beginning of the game"""
 
         await state.on_enter(chat_id)
-        return ChatHandler(state, chat_id)
+        return ChatHandler(state, chat_id, changed=True)
 
     @property
     def chat_id(self) -> int:
@@ -40,6 +46,17 @@ class ChatHandler:
     def state(self) -> BotState:
         return self._state
 
+    @property
+    def changed(self) -> bool:
+        """Whether the handler changed since it was created, loaded or
+        `clear_changed` was called, i.e. whether it needs to be stored."""
+
+        return self._changed or self._state.changed
+
+    def clear_changed(self) -> None:
+        self._changed = False
+        self._state.clear_changed()
+
     def __eq__(self, other):
         if isinstance(other, ChatHandler):
             return self._chat_id == other._chat_id and self._state == other._state
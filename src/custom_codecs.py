@@ -1,4 +1,9 @@
 import json
+import struct
+import zlib
+from abc import ABC, abstractmethod
+from enum import Enum
+from typing import Optional
 
 import jsons
 
@@ -11,6 +16,7 @@ from bot_state import (
     ProtoGameState,
 )
 from chat_handler import ChatHandler
+from storage import Question
 from telegram_client import TelegramClient
 
 
@@ -71,13 +77,249 @@ class ChatHandlerDecoder:
         elif state_name == "IdleState":
             state = IdleState(self.client, self.state_factory, is_on_enter_called)
         elif state_name == "GameState":
+            game_params = proto_state["game_params"]
+            if "question_ids" not in game_params:
+                # Made before the questions were referred to by id.
+                game_params = {**game_params, "question_ids": []}
             state = GameState(
                 self.client,
                 self.state_factory,
-                jsons.load(proto_state["game_params"], cls=ProtoGameState),
+                jsons.load(game_params, cls=ProtoGameState),
                 is_on_enter_called,
             )
         else:
             raise TypeError(f"Can't deserialize state. Unknown name: {state_name}")
 
         return ChatHandler(state, chat_id)
+
+
+class SnapshotCodec(ABC):
+    """Converts chat handlers to the snapshots kept in `Storage` and back.
+
+    Every codec decodes the snapshots made by any other codec, including the legacy
+    JSON text, so the format can be switched without migrating the stored chats.
+
+    With `sparse_idle`, the idle state most of the chats are in is stored as
+    `IDLE_SNAPSHOT`, which takes no space beyond the row itself. A chat without
+    a snapshot at all is a new chat, so the marker can't be dropped altogether.
+    """
+
+    def __init__(
+        self,
+        client: TelegramClient,
+        state_factory: BotStateFactory,
+        sparse_idle: bool = False,
+    ):
+        self._client = client
+        self._state_factory = state_factory
+        self._sparse_idle = sparse_idle
+
+    def encode(self, chat_handler: ChatHandler) -> bytes:
+        """Makes a snapshot of `chat_handler`."""
+
+        state = chat_handler.state
+        if (
+            self._sparse_idle
+            and isinstance(state, IdleState)
+            and state.is_on_enter_called
+        ):
+            return IDLE_SNAPSHOT
+        return self._encode(chat_handler)
+
+    @abstractmethod
+    def _encode(self, chat_handler: ChatHandler) -> bytes:
+        pass
+
+    def decode(self, snapshot: bytes, chat_id: Optional[int] = None) -> ChatHandler:
+        """Restores a chat handler. `chat_id` is required for `IDLE_SNAPSHOT`, which
+        doesn't include it."""
+
+        if snapshot == IDLE_SNAPSHOT:
+            if chat_id is None:
+                raise ValueError("The chat id is required to decode an idle snapshot")
+            return ChatHandler(
+                IdleState(self._client, self._state_factory, True), chat_id
+            )
+        if snapshot.startswith(BINARY_SNAPSHOT_MAGIC):
+            return _BinarySnapshotReader(
+                self._client, self._state_factory, snapshot
+            ).read()
+        return ChatHandlerDecoder(self._client, self._state_factory).decode(
+            json.loads(snapshot)
+        )
+
+
+class JsonSnapshotCodec(SnapshotCodec):
+    """Makes snapshots in the JSON format of `ChatHandlerEncoder`."""
+
+    def _encode(self, chat_handler: ChatHandler) -> bytes:
+        return json.dumps(chat_handler, cls=ChatHandlerEncoder).encode()
+
+
+IDLE_SNAPSHOT = b""
+
+BINARY_SNAPSHOT_MAGIC = b"TB"
+BINARY_SNAPSHOT_VERSION = 2
+
+_FLAG_COMPRESSED = 1
+
+# All the numbers are little-endian. A snapshot is a header followed by the body,
+# compressed with zlib if the header says so:
+#   header: magic, format version, flags
+#   body: chat id, state tag, whether `on_enter` was called, then for `GameState`:
+#     current question, score, last question message id, question count, then
+#     the question ids (version 2) or, for every question, its text, answer count,
+#     correct answer and the answers (version 1).
+# Strings are UTF-8 prefixed with their length in bytes. The games with the questions
+# kept inline are still written in version 1.
+_HEADER = struct.Struct("<2sBB")
+_HANDLER = struct.Struct("<qBB")
+_GAME = struct.Struct("<HHqB")
+_QUESTION = struct.Struct("<BB")
+_STR_LEN = struct.Struct("<H")
+# Question ids are `integer` in the database.
+_QUESTION_ID = struct.Struct("<i")
+
+_STATE_TAGS = {GreetingState: 0, IdleState: 1, GameState: 2}
+
+
+class BinarySnapshotCodec(SnapshotCodec):
+    """Makes compact binary snapshots. See the format above."""
+
+    def __init__(
+        self,
+        client: TelegramClient,
+        state_factory: BotStateFactory,
+        compress_min_size: Optional[int] = 256,
+        sparse_idle: bool = False,
+    ):
+        """
+        compress_min_size -- bodies of at least this many bytes are compressed with
+            zlib if that makes them smaller. None turns the compression off.
+        """
+
+        super().__init__(client, state_factory, sparse_idle)
+        self._compress_min_size = compress_min_size
+
+    def _encode(self, chat_handler: ChatHandler) -> bytes:
+        state = chat_handler.state
+        tag = _STATE_TAGS.get(type(state))
+        if tag is None:
+            raise TypeError(f"Unsupported state: {type(state)}")
+
+        version = BINARY_SNAPSHOT_VERSION
+        body = bytearray(
+            _HANDLER.pack(chat_handler.chat_id, tag, state.is_on_enter_called)
+        )
+        if isinstance(state, GameState):
+            params = state.game_params
+            body += _GAME.pack(
+                params.current_question,
+                params.score,
+                params.last_question_msg_id,
+                state.question_count,
+            )
+            if params.questions is None:
+                for question_id in params.question_ids:
+                    body += _QUESTION_ID.pack(question_id)
+            else:
+                version = 1
+                for question in params.questions:
+                    _write_str(body, question.text)
+                    body += _QUESTION.pack(
+                        len(question.answers), question.correct_answer
+                    )
+                    for answer in question.answers:
+                        _write_str(body, answer)
+
+        flags = 0
+        if self._compress_min_size is not None and len(body) >= self._compress_min_size:
+            compressed = zlib.compress(body)
+            if len(compressed) < len(body):
+                body, flags = bytearray(compressed), _FLAG_COMPRESSED
+        return _HEADER.pack(BINARY_SNAPSHOT_MAGIC, version, flags) + body
+
+
+class SnapshotFormat(str, Enum):
+    JSON = "json"
+    BINARY = "binary"
+
+
+def make_snapshot_codec(
+    snapshot_format: SnapshotFormat,
+    client: TelegramClient,
+    state_factory: BotStateFactory,
+    sparse_idle: bool = False,
+) -> SnapshotCodec:
+    if snapshot_format == SnapshotFormat.JSON:
+        return JsonSnapshotCodec(client, state_factory, sparse_idle)
+    return BinarySnapshotCodec(client, state_factory, sparse_idle=sparse_idle)
+
+
+def _write_str(buffer: bytearray, value: str) -> None:
+    encoded = value.encode()
+    buffer += _STR_LEN.pack(len(encoded))
+    buffer += encoded
+
+
+class _BinarySnapshotReader:
+    def __init__(
+        self, client: TelegramClient, state_factory: BotStateFactory, snapshot: bytes
+    ):
+        self._client = client
+        self._state_factory = state_factory
+        _, version, flags = _HEADER.unpack_from(snapshot)
+        if version not in (1, BINARY_SNAPSHOT_VERSION):
+            raise TypeError(f"Unsupported snapshot version: {version}")
+        self._version = version
+        body = snapshot[_HEADER.size :]
+        self._body = zlib.decompress(body) if flags & _FLAG_COMPRESSED else body
+        self._offset = 0
+
+    def read(self) -> ChatHandler:
+        chat_id, tag, is_on_enter_called = self._unpack(_HANDLER)
+        is_on_enter_called = bool(is_on_enter_called)
+        state: BotState
+        if tag == _STATE_TAGS[GreetingState]:
+            state = GreetingState(self._client, self._state_factory, is_on_enter_called)
+        elif tag == _STATE_TAGS[IdleState]:
+            state = IdleState(self._client, self._state_factory, is_on_enter_called)
+        elif tag == _STATE_TAGS[GameState]:
+            state = GameState(
+                self._client,
+                self._state_factory,
+                self._read_game_params(),
+                is_on_enter_called,
+            )
+        else:
+            raise TypeError(f"Can't deserialize state. Unknown tag: {tag}")
+        return ChatHandler(state, chat_id)
+
+    def _read_game_params(self) -> ProtoGameState:
+        current_question, score, last_question_msg_id, count = self._unpack(_GAME)
+        if self._version > 1:
+            question_ids = [self._unpack(_QUESTION_ID)[0] for _ in range(count)]
+            return ProtoGameState(
+                question_ids, current_question, score, last_question_msg_id
+            )
+
+        questions = []
+        for _ in range(count):
+            text = self._read_str()
+            answer_count, correct_answer = self._unpack(_QUESTION)
+            answers = [self._read_str() for _ in range(answer_count)]
+            questions.append(Question(text, answers, correct_answer))
+        return ProtoGameState(
+            [], current_question, score, last_question_msg_id, questions
+        )
+
+    def _read_str(self) -> str:
+        (length,) = self._unpack(_STR_LEN)
+        start = self._offset
+        self._offset += length
+        return self._body[start : self._offset].decode()
+
+    def _unpack(self, fmt: struct.Struct) -> tuple:
+        values = fmt.unpack_from(self._body, self._offset)
+        self._offset += fmt.size
+        return values
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+from telegram_client import Update
+
+UpdateHandler = Callable[[Update], Awaitable[None]]
+
+
+class DispatcherFullException(Exception):
+    """Raised when an update can't be accepted because too many updates are pending."""
+
+
+class UpdateDispatcher:
+    """Handles updates concurrently on a bounded pool of workers.
+
+    Updates are sharded by `Update.chat_id` into per-chat queues. Updates of the same
+    chat are handled one after another in the order they were submitted, while
+    different chats are handled concurrently. Workers take turns between the chats
+    with pending updates, so a busy chat doesn't starve the others.
+
+    The dispatcher tracks the committed offset: every update with `update_id` below it
+    has been fully handled. It only moves forward past handled updates.
+    """
+
+    def __init__(
+        self,
+        handler: UpdateHandler,
+        workers: int = 16,
+        max_pending: int = 1000,
+        on_commit: Optional[Callable[[int], None]] = None,
+    ):
+        """
+        handler -- a callback handling a single update. Errors are logged and the update
+            is considered handled.
+        workers -- max number of updates handled at the same time.
+        max_pending -- max number of submitted updates that are not handled yet.
+        on_commit -- a callback called with the new committed offset once it moves.
+        """
+
+        self._handler = handler
+        self._worker_count = workers
+        self._max_pending = max_pending
+        self._on_commit = on_commit
+        self._chat_queues: Dict[int, Deque[Update]] = {}
+        self._ready_chats: "asyncio.Queue[int]" = asyncio.Queue()
+        self._unfinished: Dict[int, None] = {}
+        self._next_offset = 0
+        self._committed_offset = 0
+        self._changed = asyncio.Condition()
+        self._workers: List[asyncio.Task] = []
+
+    @property
+    def pending(self) -> int:
+        """The number of submitted updates that are not handled yet."""
+
+        return len(self._unfinished)
+
+    @property
+    def committed_offset(self) -> int:
+        return self._committed_offset
+
+    async def start(self) -> None:
+        assert not self._workers, "The dispatcher is already started"
+        self._workers = [
+            asyncio.create_task(self._work()) for _ in range(self._worker_count)
+        ]
+
+    async def close(self) -> None:
+        """Stops the workers. Updates that are not handled yet are dropped."""
+
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def __aenter__(self) -> "UpdateDispatcher":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *_exc_info) -> None:
+        await self.close()
+
+    async def submit(self, update: Update) -> None:
+        """Queues `update` for handling. Waits while `max_pending` updates are pending."""
+
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.pending < self._max_pending)
+        self._enqueue(update)
+
+    def submit_nowait(self, update: Update) -> None:
+        """Queues `update` for handling. Raises `DispatcherFullException`
+        if `max_pending` updates are pending."""
+
+        if self.pending >= self._max_pending:
+            raise DispatcherFullException()
+        self._enqueue(update)
+
+    async def join(self) -> None:
+        """Waits until all the submitted updates are handled."""
+
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.pending == 0)
+
+    def _enqueue(self, update: Update) -> None:
+        self._next_offset = max(self._next_offset, update.update_id + 1)
+        if not update.is_processable:
+            self._commit()
+            return
+        if update.update_id in self._unfinished:
+            # Redelivered, e.g. by a webhook retry, while the first copy is pending.
+            logging.debug("Dropped the duplicate of update %d", update.update_id)
+            return
+
+        self._unfinished[update.update_id] = None
+        chat_id = update.chat_id
+        queue = self._chat_queues.get(chat_id)
+        if queue is None:
+            # The chat isn't being handled by any worker. Let one pick it up.
+            self._chat_queues[chat_id] = deque([update])
+            self._ready_chats.put_nowait(chat_id)
+        else:
+            queue.append(update)
+
+    async def _work(self) -> None:
+        while True:
+            chat_id = await self._ready_chats.get()
+            queue = self._chat_queues[chat_id]
+            update = queue[0]
+            try:
+                await self._handler(update)
+            except Exception as e:
+                logging.error(e)
+
+            queue.popleft()
+            if queue:
+                self._ready_chats.put_nowait(chat_id)
+            else:
+                del self._chat_queues[chat_id]
+            del self._unfinished[update.update_id]
+            self._commit()
+            async with self._changed:
+                self._changed.notify_all()
+
+    def _commit(self) -> None:
+        offset = next(iter(self._unfinished), self._next_offset)
+        if offset > self._committed_offset:
+            self._committed_offset = offset
+            if self._on_commit is not None:
+                self._on_commit(offset)
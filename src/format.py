@@ -1,4 +1,5 @@
 import string
+from functools import cache
 from typing import List
 
 from storage import Question
@@ -10,11 +11,19 @@ RED_CIRCLE_MARK = "⭕"
 
 
 def make_keyboard(question: Question) -> InlineKeyboardMarkup:
-    buttons = [
+    """Returns a keyboard with a button per answer. Keyboards with the same number
+    of buttons are the same shared object."""
+
+    return _make_keyboard(len(question.answers))
+
+
+@cache
+def _make_keyboard(answer_count: int) -> InlineKeyboardMarkup:
+    buttons = tuple(
         InlineKeyboardButton(chr(ord("a") + i), f"{chr(ord('a') + i)}")
-        for i in range(len(question.answers))
-    ]
-    return InlineKeyboardMarkup([buttons])
+        for i in range(answer_count)
+    )
+    return InlineKeyboardMarkup((buttons,))
 
 
 def make_question(question: Question) -> str:
@@ -0,0 +1,127 @@
+import asyncio
+import itertools
+from typing import AsyncIterator, Dict, Hashable, List, Optional, Tuple
+
+from storage import Question, Storage
+
+
+class GroupCommitStorage(Storage):
+    """A `Storage` writing the chat handlers saved at about the same time together.
+    Everything else is delegated to the wrapped storage.
+
+    A saved handler waits up to `window` seconds for others to join it, and then
+    all of them are written with a single `set_chat_handlers` request, i.e. a single
+    transaction. The handlers saved while a write is in progress are written with the
+    next one, right after it. `set_chat_handler` returns once the handler is written,
+    so a handled update is as durable as it is with the wrapped storage.
+    """
+
+    def __init__(self, storage: Storage, window: float = 0.002, max_batch: int = 500):
+        """
+        window -- seconds the first handler saved after an idle period waits for
+            the others.
+        max_batch -- max number of handlers written at once. A write starts before
+            the end of the window if that many handlers are waiting.
+        """
+
+        self._storage = storage
+        self._window = window
+        self._max_batch = max_batch
+        self._pending: Dict[int, bytes] = {}
+        self._waiters: Dict[int, List[asyncio.Future]] = {}
+        self._batch_full = asyncio.Event()
+        self._write_lock = asyncio.Lock()
+        self._writer: Optional[asyncio.Task] = None
+
+    @property
+    def pending_count(self) -> int:
+        """The number of handlers waiting to be written."""
+
+        return len(self._pending)
+
+    async def close(self) -> None:
+        """Waits for the saved handlers to be written."""
+
+        while self._writer is not None and not self._writer.done():
+            self._batch_full.set()
+            await asyncio.shield(self._writer)
+
+    async def __aenter__(self) -> "GroupCommitStorage":
+        return self
+
+    async def __aexit__(self, *_exc_info) -> None:
+        await self.close()
+
+    async def set_chat_handler(self, chat_id: int, chat_handler: bytes):
+        # A handler saved again before it is written replaces the previous one.
+        self._pending[chat_id] = chat_handler
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(chat_id, []).append(waiter)
+        if len(self._pending) >= self._max_batch:
+            self._batch_full.set()
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._write_pending())
+        await waiter
+
+    async def del_chat_handler(self, chat_id: int):
+        # The handler waiting to be written is superseded by the deletion.
+        self._pending.pop(chat_id, None)
+        for waiter in self._waiters.pop(chat_id, []):
+            if not waiter.done():
+                waiter.set_result(None)
+        # Waits for a write in progress, so it doesn't bring the handler back.
+        async with self._write_lock:
+            await self._storage.del_chat_handler(chat_id)
+
+    async def get_chat_handler(self, chat_id: int) -> Optional[bytes]:
+        return await self._storage.get_chat_handler(chat_id)
+
+    async def get_chat_handlers(self, chat_ids: List[int]) -> Dict[int, bytes]:
+        return await self._storage.get_chat_handlers(chat_ids)
+
+    async def set_chat_handlers(self, chat_handlers: Dict[int, bytes]):
+        await self._storage.set_chat_handlers(chat_handlers)
+
+    async def get_questions(self, question_count: int) -> List[Question]:
+        return await self._storage.get_questions(question_count)
+
+    async def get_question_ids(self, question_count: int) -> List[int]:
+        return await self._storage.get_question_ids(question_count)
+
+    async def get_question(self, question_id: int) -> Optional[Question]:
+        return await self._storage.get_question(question_id)
+
+    async def get_all_questions(self) -> AsyncIterator[Tuple[int, Question]]:
+        async for question in self._storage.get_all_questions():
+            yield question
+
+    async def get_questions_version(self) -> Hashable:
+        return await self._storage.get_questions_version()
+
+    async def _write_pending(self) -> None:
+        if len(self._pending) < self._max_batch:
+            try:
+                await asyncio.wait_for(self._batch_full.wait(), self._window)
+            except asyncio.TimeoutError:
+                pass
+        while self._pending:
+            self._batch_full.clear()
+            batch = dict(itertools.islice(self._pending.items(), self._max_batch))
+            waiters: List[asyncio.Future] = []
+            for chat_id in batch:
+                del self._pending[chat_id]
+                waiters += self._waiters.pop(chat_id, [])
+
+            error: Optional[BaseException] = None
+            try:
+                async with self._write_lock:
+                    await self._storage.set_chat_handlers(batch)
+            except Exception as e:  # pylint: disable=broad-except
+                error = e
+            for waiter in waiters:
+                if waiter.done():
+                    continue
+                if error is None:
+                    waiter.set_result(None)
+                else:
+                    waiter.set_exception(error)
@@ -0,0 +1,232 @@
+import asyncio
+import logging
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from enum import Enum
+from typing import Dict, List, Optional, Tuple
+
+from chat_handler import ChatHandler
+from custom_codecs import SnapshotCodec
+from storage import Storage
+
+
+class Durability(str, Enum):
+    WRITE_THROUGH = "write_through"
+    """A change is written to the storage before the update is considered handled."""
+
+    WRITE_BEHIND = "write_behind"
+    """Changes are written in the background. The changes made within the last flush
+    interval are lost if the bot crashes."""
+
+
+@dataclass
+class HandlerCacheConfig:
+    """Parameters of the `ChatHandlerCache`.
+
+    capacity: max number of cached chat handlers. The cache may exceed it for a while
+        with handlers that are in use or not written yet.
+    flush_interval: seconds between writes of the changed handlers in `WRITE_BEHIND` mode
+    durability: when the changes are written to the storage
+    """
+
+    capacity: int = 10000
+    flush_interval: float = 1.0
+    durability: Durability = Durability.WRITE_BEHIND
+
+
+class ChatHandlerCache:
+    """An LRU cache of decoded chat handlers in front of `Storage`.
+
+    A cached handler is handled without reading and decoding its snapshot. Handlers are
+    checked out with `get` and returned with `put` after processing an update, or
+    with `discard` if the processing fails. A handler that is checked out is neither
+    written nor evicted, so the storage never sees a half-processed state.
+
+    In `WRITE_BEHIND` mode the changed handlers are written every `flush_interval`
+    seconds, when the cache needs space and on `close`.
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        codec: SnapshotCodec,
+        conf: Optional[HandlerCacheConfig] = None,
+    ):
+        self._storage = storage
+        self._codec = codec
+        self._conf = conf or HandlerCacheConfig()
+        self._handlers: "OrderedDict[int, ChatHandler]" = OrderedDict()
+        # The version and the snapshot of the last change of every handler that is
+        # not written yet.
+        self._dirty: Dict[int, Tuple[int, bytes]] = {}
+        self._version = 0
+        self._in_use: Counter[int] = Counter()
+        self._flush_lock = asyncio.Lock()
+        self._flush_requested = asyncio.Event()
+        self._flusher: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._handlers)
+
+    @property
+    def dirty_count(self) -> int:
+        """The number of changed handlers that are not written yet."""
+
+        return len(self._dirty)
+
+    async def start(self) -> None:
+        assert self._flusher is None, "The cache is already started"
+        if self._conf.durability == Durability.WRITE_BEHIND:
+            self._flusher = asyncio.create_task(self._run_flusher())
+
+    async def close(self) -> None:
+        """Stops the background writes and writes all the changed handlers."""
+
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+
+    async def __aenter__(self) -> "ChatHandlerCache":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *_exc_info) -> None:
+        await self.close()
+
+    async def get(self, chat_id: int) -> Optional[ChatHandler]:
+        """Checks out the handler of `chat_id`. Returns None if the chat has no handler.
+        Must be followed by `put` or `discard`."""
+
+        self._in_use[chat_id] += 1
+        handler = self._handlers.get(chat_id)
+        if handler is not None:
+            self._handlers.move_to_end(chat_id)
+            return handler
+
+        try:
+            snapshot = await self._storage.get_chat_handler(chat_id)
+        except BaseException:
+            self._release(chat_id)
+            raise
+        if snapshot is None:
+            return None
+        # Another update of the chat may have loaded the handler meanwhile.
+        handler = self._handlers.get(chat_id)
+        if handler is None:
+            handler = self._codec.decode(snapshot, chat_id)
+            self._handlers[chat_id] = handler
+        return handler
+
+    async def put(self, chat_id: int, handler: ChatHandler) -> None:
+        """Returns the checked out handler of `chat_id` after a successful processing.
+        The handler is written only if it changed. Its snapshot is taken right away,
+        so a failed processing later on can't leak into the storage."""
+
+        self._release(chat_id)
+        self._handlers[chat_id] = handler
+        self._handlers.move_to_end(chat_id)
+        try:
+            if handler.changed:
+                await self._save(chat_id, handler)
+        finally:
+            self._evict()
+
+    def discard(self, chat_id: int) -> None:
+        """Returns the checked out handler of `chat_id` after a failed processing. The
+        handler may be changed halfway, so it is restored from the snapshot of its last
+        `put` if that one is not written yet. Otherwise it is dropped from the cache,
+        and the next update of the chat starts from the stored snapshot."""
+
+        self._release(chat_id)
+        dirty = self._dirty.get(chat_id)
+        if dirty is None:
+            self._handlers.pop(chat_id, None)
+        else:
+            self._handlers[chat_id] = self._codec.decode(dirty[1], chat_id)
+
+    async def delete(self, chat_id: int) -> None:
+        """Deletes the handler of `chat_id` from both the cache and the storage."""
+
+        self._handlers.pop(chat_id, None)
+        self._dirty.pop(chat_id, None)
+        # Waits for a flush in progress to delete the handler after it is written.
+        async with self._flush_lock:
+            await self._storage.del_chat_handler(chat_id)
+
+    async def flush(self) -> None:
+        """Writes the changed handlers that are not in use."""
+
+        async with self._flush_lock:
+            pending = [chat_id for chat_id in self._dirty if not self._in_use[chat_id]]
+            if pending:
+                await self._write(pending)
+        self._evict()
+
+    async def _save(self, chat_id: int, handler: ChatHandler) -> None:
+        handler.clear_changed()
+        self._version += 1
+        self._dirty[chat_id] = (self._version, self._codec.encode(handler))
+        if self._conf.durability == Durability.WRITE_THROUGH:
+            try:
+                await self._write([chat_id])
+            except BaseException:
+                # The cache must not get ahead of the storage.
+                self._handlers.pop(chat_id, None)
+                self._dirty.pop(chat_id, None)
+                raise
+
+    async def _write(self, chat_ids: List[int]) -> None:
+        """Writes the handlers of `chat_ids` with a single `set_chat_handlers` call.
+        They stay dirty if it fails."""
+
+        dirty = {chat_id: self._dirty[chat_id] for chat_id in chat_ids}
+        try:
+            await self._storage.set_chat_handlers(
+                {chat_id: snapshot for chat_id, (_, snapshot) in dirty.items()}
+            )
+        except Exception as e:
+            logging.error("Failed to write %d chat handlers: %s", len(dirty), e)
+            if self._conf.durability == Durability.WRITE_THROUGH:
+                raise
+            return
+
+        for chat_id, change in dirty.items():
+            # The handler stays dirty if it was changed again during the write.
+            if self._dirty.get(chat_id) == change:
+                del self._dirty[chat_id]
+
+    def _evict(self) -> None:
+        excess = len(self._handlers) - self._conf.capacity
+        if excess <= 0:
+            return
+        for chat_id in list(self._handlers):
+            if excess <= 0:
+                break
+            if chat_id in self._dirty or self._in_use[chat_id]:
+                continue
+            del self._handlers[chat_id]
+            excess -= 1
+        if excess > 0 and any(not self._in_use[chat_id] for chat_id in self._dirty):
+            # These handlers can be evicted once written.
+            self._flush_requested.set()
+
+    def _release(self, chat_id: int) -> None:
+        self._in_use[chat_id] -= 1
+        if self._in_use[chat_id] <= 0:
+            del self._in_use[chat_id]
+
+    async def _run_flusher(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._flush_requested.wait(), self._conf.flush_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Failed to flush chat handlers")
@@ -1,41 +1,157 @@
 import asyncio
-import json
 import logging
 import os
-from dataclasses import dataclass
-from typing import Optional
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass, field
+from functools import partial
+from typing import AsyncIterator, Dict, List, Optional
 
 import jsons
 import typer
 from fastapi import FastAPI, Request
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import PlainTextResponse, Response
 from psycopg_pool import AsyncConnectionPool
 from uvicorn import Config, Server
 
 from bot_state import BotStateFactory
 from chat_handler import ChatHandler
-from custom_codecs import ChatHandlerDecoder, ChatHandlerEncoder
-from storage import InMemoryStorage, PostgresStorage, Question, Storage
+from custom_codecs import (
+    BinarySnapshotCodec,
+    SnapshotCodec,
+    SnapshotFormat,
+    make_snapshot_codec,
+)
+from dispatcher import DispatcherFullException, UpdateDispatcher
+from group_commit import GroupCommitStorage
+from handler_cache import ChatHandlerCache, Durability, HandlerCacheConfig
+from migrations import migrate
+from question_bank import QuestionBankStorage
+from resilience import RetryPolicy
+from send_scheduler import RateLimits, SendScheduler
+from sharded_storage import ShardedStorage, split_hosts
+from sqlite_storage import SqliteStorage
+from storage import (
+    BatchStorage,
+    InMemoryStorage,
+    PostgresStorage,
+    Question,
+    Storage,
+    postgres_conninfo,
+)
 from telegram_client import (
+    DEFAULT_API_URL,
+    CircuitOpenException,
+    HttpSessionConfig,
     LiveTelegramClient,
     NetworkException,
+    TelegramClient,
     TelegramException,
     UnexpectedStatusCodeException,
     UnknownErrorException,
     Update,
+    load_object,
 )
-from utils import transform_keywords
+from webhook_reply import WebhookReplyClient
 
 
 @dataclass
 class ServerConfig:
-    """Necessary parameters to configure the server."""
+    """Necessary parameters to configure the server.
+
+    reply_in_webhook: return the last message of an update in the webhook response
+    ack_fast: respond to Telegram as soon as an update is queued and handle it in
+        the background. Can't be combined with `reply_in_webhook`.
+    workers: max number of updates handled at the same time in `ack_fast` mode
+    max_pending: max number of queued updates in `ack_fast` mode. Telegram is asked
+        to retry the updates arriving when the queue is full.
+    group_commit_window: if set, the chats saved within this many seconds are
+        written together, see `GroupCommitStorage`
+    shutdown_timeout: seconds to wait on shutdown for the queued updates to be
+        handled in `ack_fast` mode. Telegram doesn't resend them, as they are
+        acknowledged already.
+    """
 
     url: str
     host: str
     port: int
     cert_path: Optional[str] = None
     key_path: Optional[str] = None
+    reply_in_webhook: bool = False
+    ack_fast: bool = False
+    workers: int = 16
+    max_pending: int = 1000
+    group_commit_window: Optional[float] = None
+    shutdown_timeout: float = 30.0
+
+
+@dataclass
+class ClientConfig:
+    """Necessary parameters to configure the client mode.
+
+    workers: max number of updates handled at the same time
+    max_pending: max number of received updates waiting to be handled
+    poll_backoff: delays between the attempts to get updates or write the chats
+        after failures
+    batch_storage: read the chats of a batch of updates with a single request and
+        write them back with another one, see `BatchStorage`. The next batch is
+        handled once the current one is written. Has no effect with the handler
+        cache, which writes the chats by itself. In `WRITE_BEHIND` mode it writes all
+        the chats changed since its last flush with a single request.
+    """
+
+    workers: int = 16
+    max_pending: int = 1000
+    poll_backoff: RetryPolicy = field(
+        default_factory=lambda: RetryPolicy(base_delay=1.0, max_delay=60.0)
+    )
+    batch_storage: bool = True
+
+
+@dataclass
+class PoolConfig:
+    """Parameters of a pool of connections to PostgreSQL.
+
+    max_size: max number of connections, by default one per update handled at once
+        with at least 4
+    timeout: seconds a query waits for a free connection before it fails
+    """
+
+    max_size: Optional[int] = None
+    timeout: float = 30.0
+
+    def make_pool(self, conninfo: str, workers: int) -> AsyncConnectionPool:
+        max_size = self.max_size or max(4, workers)
+        return AsyncConnectionPool(
+            conninfo,
+            min_size=min(4, max_size),
+            max_size=max_size,
+            timeout=self.timeout,
+        )
+
+
+@dataclass
+class StorageConfig:
+    """Where and how the data is stored.
+
+    inmemory: keep a few questions in memory to debug without a database
+    sqlite_path: the SQLite file the data is stored in instead of PostgreSQL
+    question_bank: load the questions into memory once, see `QuestionBankStorage`
+    pool: the pools of connections to the PostgreSQL databases
+    replica_pool: the pools of connections to the read replicas
+    handler_cache: if set, the active chats are kept in memory, see
+        `ChatHandlerCache`
+    snapshot_format: the format the chats are stored in
+    sparse_idle: store the idle chats as an empty marker
+    """
+
+    inmemory: bool = False
+    sqlite_path: Optional[str] = None
+    question_bank: bool = False
+    pool: PoolConfig = field(default_factory=PoolConfig)
+    replica_pool: PoolConfig = field(default_factory=PoolConfig)
+    handler_cache: Optional[HandlerCacheConfig] = None
+    snapshot_format: SnapshotFormat = SnapshotFormat.BINARY
+    sparse_idle: bool = False
 
 
 @dataclass
@@ -45,72 +161,202 @@ class Bot:
     telegram_client: LiveTelegramClient
     state_factory: BotStateFactory
     storage: Storage
+    webhook_reply: Optional[WebhookReplyClient] = None
+    handler_cache: Optional[ChatHandlerCache] = None
+    snapshot_codec: Optional[SnapshotCodec] = None
+    _codec: SnapshotCodec = field(init=False)
+
+    def __post_init__(self):
+        self._codec = self.snapshot_codec or BinarySnapshotCodec(
+            self.state_factory.client, self.state_factory
+        )
+
+    async def handle_update(self, update: Update, storage: Optional[Storage] = None):
+        """Handles `update` with the chats kept in `storage`, `self.storage`
+        by default."""
 
-    async def handle_update(self, update: Update):
         chat_id = update.chat_id
+        storage = storage or self.storage
 
         if update.my_chat_member is None:
-            chat_handler_snapshot = await self.storage.get_chat_handler(chat_id)
+            if self.handler_cache is not None:
+                await self._handle_cached(update, self.handler_cache)
+                return
+
+            chat_handler_snapshot = await storage.get_chat_handler(chat_id)
             if chat_handler_snapshot is None:
                 chat_handler = await ChatHandler.create(
                     await self.state_factory.make_greeting_state(), chat_id
                 )
             else:
-                chat_handler = ChatHandlerDecoder(
-                    self.telegram_client, self.state_factory
-                ).decode(json.loads(chat_handler_snapshot))
+                chat_handler = self._codec.decode(chat_handler_snapshot, chat_id)
             await chat_handler.process(update)
-            await self.storage.set_chat_handler(
-                chat_id, json.dumps(chat_handler, cls=ChatHandlerEncoder)
-            )
+            if chat_handler.changed:
+                await storage.set_chat_handler(
+                    chat_id, self._codec.encode(chat_handler)
+                )
         elif update.my_chat_member.new_chat_member.status == "member":
             logging.warning("The bot was unblocked by user: %s", chat_id)
         elif update.my_chat_member.new_chat_member.status == "kicked":
             logging.warning("The bot was blocked by user: %s", chat_id)
-            await self.storage.del_chat_handler(chat_id)
+            if self.handler_cache is not None:
+                await self.handler_cache.delete(chat_id)
+            else:
+                await storage.del_chat_handler(chat_id)
 
-    async def run_client_mode(self):
-        self.telegram_client.delete_webhook()
-        offset = 0
+    async def _handle_cached(self, update: Update, cache: ChatHandlerCache):
+        chat_id = update.chat_id
+        chat_handler = await cache.get(chat_id)
+        try:
+            if chat_handler is None:
+                chat_handler = await ChatHandler.create(
+                    await self.state_factory.make_greeting_state(), chat_id
+                )
+            await chat_handler.process(update)
+        except BaseException:
+            cache.discard(chat_id)
+            raise
+        await cache.put(chat_id, chat_handler)
+
+    async def run_client_mode(self, conf: ClientConfig):
+        await self.telegram_client.delete_webhook()
+        updates = self.telegram_client.updates(auto_commit=False)
+        batch: Optional[BatchStorage] = None
+        if conf.batch_storage and self.handler_cache is None:
+            batch = BatchStorage(self.storage)
+            dispatcher = UpdateDispatcher(
+                partial(self.handle_update, storage=batch),
+                conf.workers,
+                conf.max_pending,
+            )
+        else:
+            dispatcher = UpdateDispatcher(
+                self.handle_update, conf.workers, conf.max_pending, updates.commit
+            )
+
+        async with dispatcher:
+            failures = 0
+            try:
+                while True:
+                    try:
+                        batch_updates = await updates.next_batch()
+                    except TelegramException as e:
+                        logging.error(e)
+                        await asyncio.sleep(conf.poll_backoff.delay(failures))
+                        failures += 1
+                        continue
+
+                    failures = 0
+                    if batch is None:
+                        for update in batch_updates:
+                            await dispatcher.submit(update)
+                        continue
+
+                    await self._handle_batch(batch_updates, batch, dispatcher, conf)
+                    # The updates are confirmed only once their chats are written.
+                    updates.commit(dispatcher.committed_offset)
+            finally:
+                await updates.close()
+
+    @staticmethod
+    async def _handle_batch(
+        batch_updates: List[Update],
+        batch: BatchStorage,
+        dispatcher: UpdateDispatcher,
+        conf: ClientConfig,
+    ):
+        chat_ids = [u.chat_id for u in batch_updates if u.is_processable]
+        try:
+            await batch.load(chat_ids)
+        except Exception as e:  # pylint: disable=broad-except
+            # The chats are read one by one then.
+            logging.error("Failed to read the chats of a batch: %s", e)
+        for update in batch_updates:
+            await dispatcher.submit(update)
+        await dispatcher.join()
+
+        failures = 0
         while True:
             try:
-                result = await self.telegram_client.get_updates(offset)
-            except TelegramException as e:
-                logging.error(e)
-                continue
-
-            for update in result:
-                try:
-                    if update.is_processable:
-                        await self.handle_update(update)
-                except Exception as e:
-                    logging.error(e)
-                finally:
-                    offset = update.update_id + 1
+                await batch.flush()
+                return
+            except Exception as e:  # pylint: disable=broad-except
+                logging.error("Failed to write the chats of a batch: %s", e)
+                await asyncio.sleep(conf.poll_backoff.delay(failures))
+                failures += 1
 
     async def run_server_mode(self, conf: ServerConfig):
-        self.telegram_client.set_webhook(conf.url, conf.cert_path)
+        dispatcher: Optional[UpdateDispatcher] = None
+        if conf.ack_fast:
+            if self.webhook_reply is not None:
+                raise ValueError("Replies in webhook require handling updates inline")
+            dispatcher = UpdateDispatcher(
+                self.handle_update, conf.workers, conf.max_pending
+            )
+
+        await self.telegram_client.set_webhook(conf.url, conf.cert_path)
+        app = self.make_app(dispatcher)
+        uvicorn_conf = Config(
+            app=app,
+            host=conf.host,
+            port=conf.port,
+            debug=True,
+            ssl_keyfile=conf.key_path,
+            ssl_certfile=conf.cert_path,
+        )
+        if dispatcher is None:
+            await Server(uvicorn_conf).serve()
+        else:
+            async with dispatcher:
+                await Server(uvicorn_conf).serve()
+                await drain(dispatcher, conf.shutdown_timeout)
+
+    def make_app(self, dispatcher: Optional[UpdateDispatcher] = None) -> FastAPI:
+        """Makes the webhook app. The updates are queued in `dispatcher` if it is
+        given, and handled before responding otherwise."""
+
         app = FastAPI()
 
         @app.post("/handleUpdate")
         async def handle_update(request: Request):
-            payload = await request.json()
+            payload = await request.body()
 
             try:
-                update = jsons.load(
-                    payload, cls=Update, key_transformer=transform_keywords
-                )
+                update = load_object(payload, Update)
             except jsons.DeserializationError as e:
                 raise UnknownErrorException(
                     "Failed to deserialize Telegram request"
                 ) from e
 
-            if update.is_processable:
+            if not update.is_processable:
+                return None
+            if dispatcher is not None:
+                try:
+                    dispatcher.submit_nowait(update)
+                except DispatcherFullException:
+                    return PlainTextResponse(
+                        status_code=503,
+                        content="Too many pending updates",
+                        headers={"Retry-After": "1"},
+                    )
+                return None
+            if self.webhook_reply is None:
+                await self.handle_update(update)
+                return None
+
+            async with self.webhook_reply.collect() as reply:
                 await self.handle_update(update)
+            body = reply.to_bytes()
+            if body is None:
+                return None
+            return Response(content=body, media_type="application/json")
 
         @app.exception_handler(TelegramException)
         async def telegram_exception_handler(_request: Request, exc: TelegramException):
             logging.error(exc)
+            if isinstance(exc, CircuitOpenException):
+                return PlainTextResponse(status_code=503, content="Service unavailable")
+
             if isinstance(exc, UnexpectedStatusCodeException):
                 if 400 <= exc.status_code <= 500:
                     return PlainTextResponse(
@@ -131,54 +377,167 @@ class Bot:
 
             return PlainTextResponse(status_code=500, content="Internal server error")
 
-        uvicorn_conf = Config(
-            app=app,
-            host=conf.host,
-            port=conf.port,
-            debug=True,
-            ssl_keyfile=conf.key_path,
-            ssl_certfile=conf.cert_path,
+        return app
+
+
+async def drain(dispatcher: UpdateDispatcher, timeout: float) -> None:
+    """Waits up to `timeout` seconds for the queued updates to be handled."""
+
+    try:
+        await asyncio.wait_for(dispatcher.join(), timeout)
+    except asyncio.TimeoutError:
+        logging.error("Dropped %d acknowledged updates on shutdown", dispatcher.pending)
+
+
+INMEMORY_QUESTIONS = [
+    Question("1.What is the color of sky?", ["orange", "blue", "green"], 1),
+    Question("2.How much is 2 + 5?", ["4", "10", "7", "8"], 2),
+    Question("3.What date is Christmas?", ["Dec 24", "Apr 15", "Jan 1", "Dec 25"], 3),
+]
+
+
+@asynccontextmanager
+async def open_postgres_storage(
+    pool_conf: PoolConfig, replica_pool_conf: PoolConfig, workers: int
+) -> AsyncIterator[Storage]:
+    """Connects to the PostgreSQL databases of the environment with pools of up to
+    `workers` connections by default. The chats are spread over several databases if
+    shard hosts are given, see `ShardedStorage`. The questions are read from the
+    first shard and its read replicas."""
+
+    shard_hosts = split_hosts(os.environ.get("POSTGRES_DB_SHARD_HOSTS", ""))
+    previous_hosts = split_hosts(os.environ.get("POSTGRES_DB_PREVIOUS_SHARD_HOSTS", ""))
+    replica_hosts = split_hosts(os.environ.get("POSTGRES_DB_REPLICA_HOSTS", ""))
+    if shard_hosts:
+        hosts = shard_hosts + previous_hosts
+    else:
+        hosts = [os.environ["POSTGRES_DB_HOST"]]
+    async with AsyncExitStack() as stack:
+        storages: Dict[str, PostgresStorage] = {}
+        for host in dict.fromkeys(hosts):
+            pool = await stack.enter_async_context(
+                pool_conf.make_pool(postgres_conninfo(host), workers)
+            )
+            await migrate(pool)
+            replica_pools = []
+            if host == hosts[0]:
+                for replica_host in replica_hosts:
+                    replica_pools.append(
+                        await stack.enter_async_context(
+                            replica_pool_conf.make_pool(
+                                postgres_conninfo(replica_host), workers
+                            )
+                        )
+                    )
+            storages[host] = PostgresStorage(pool, replica_pools=replica_pools)
+            stack.push_async_callback(storages[host].close)
+        if not shard_hosts:
+            yield storages[hosts[0]]
+            return
+
+        yield ShardedStorage(
+            [storages[host] for host in shard_hosts],
+            [storages[host] for host in previous_hosts],
         )
-        await Server(uvicorn_conf).serve()
 
 
-async def launch_bot(inmemory: bool, server_conf: Optional[ServerConfig] = None):
-    """Launches of a specific mode depends on the assembled storage configuration.
-    The storage configuration build process, in turn,
-    depends on the presence of a server configuration parameter."""
+@asynccontextmanager
+async def open_storage(
+    conf: StorageConfig, server_conf: Optional[ServerConfig], workers: int
+) -> AsyncIterator[Storage]:
+    """Opens the storage of `conf` with the question bank and, in server mode, the
+    group commit in front of it."""
+
+    async with AsyncExitStack() as stack:
+        storage: Storage
+        if conf.inmemory:
+            storage = InMemoryStorage(INMEMORY_QUESTIONS)
+        elif conf.sqlite_path is not None:
+            storage = await stack.enter_async_context(SqliteStorage(conf.sqlite_path))
+        else:
+            storage = await stack.enter_async_context(
+                open_postgres_storage(conf.pool, conf.replica_pool, workers)
+            )
+
+        if conf.question_bank and not conf.inmemory:
+            storage = await stack.enter_async_context(QuestionBankStorage(storage))
+        if server_conf is not None:
+            window = server_conf.group_commit_window
+            if window is None and conf.sqlite_path is not None:
+                # SQLite has a single writer, so the chats saved by concurrent
+                # updates are committed together even without a window.
+                window = 0.0
+            if window is not None:
+                storage = await stack.enter_async_context(
+                    GroupCommitStorage(storage, window)
+                )
+        yield storage
+
+
+@asynccontextmanager
+async def open_bot(
+    telegram_client: LiveTelegramClient,
+    storage: Storage,
+    conf: StorageConfig,
+    server_conf: Optional[ServerConfig],
+) -> AsyncIterator[Bot]:
+    """Assembles the bot and its chat handler cache if `conf` has one."""
+
+    webhook_reply = None
+    state_client: TelegramClient = telegram_client
+    if server_conf and server_conf.reply_in_webhook:
+        webhook_reply = WebhookReplyClient(telegram_client)
+        state_client = webhook_reply
+    state_factory = BotStateFactory(state_client, storage)
+    codec = make_snapshot_codec(
+        conf.snapshot_format, state_client, state_factory, conf.sparse_idle
+    )
+    bot = Bot(
+        telegram_client, state_factory, storage, webhook_reply, snapshot_codec=codec
+    )
+    if conf.handler_cache is None:
+        yield bot
+        return
+
+    async with ChatHandlerCache(storage, codec, conf.handler_cache) as handler_cache:
+        bot.handler_cache = handler_cache
+        yield bot
+
+
+async def launch_bot(
+    storage_conf: StorageConfig,
+    server_conf: Optional[ServerConfig] = None,
+    session_config: Optional[HttpSessionConfig] = None,
+    client_conf: Optional[ClientConfig] = None,
+    rate_limits: Optional[RateLimits] = None,
+):
+    """Runs the bot with the storage of `storage_conf` in server mode if `server_conf`
+    is given, and in client mode otherwise."""
 
     token = os.environ["TELEGRAM_BOT_TOKEN"]
-    telegram_client = LiveTelegramClient(token)
+    session_config = session_config or HttpSessionConfig(
+        api_url=os.environ.get("TELEGRAM_API_URL", DEFAULT_API_URL)
+    )
+    # The pools have a connection per update handled at once by default.
+    workers = (server_conf or client_conf or ClientConfig()).workers
+
+    async with open_storage(storage_conf, server_conf, workers) as storage:
+        async with LiveTelegramClient(
+            token, session_config, SendScheduler(rate_limits)
+        ) as telegram_client:
+            async with open_bot(
+                telegram_client, storage, storage_conf, server_conf
+            ) as bot:
+                if server_conf:
+                    await bot.run_server_mode(server_conf)
+                else:
+                    await bot.run_client_mode(client_conf or ClientConfig())
 
-    async def run_bot(storage: Storage):
-        bot = Bot(telegram_client, BotStateFactory(telegram_client, storage), storage)
-        if server_conf:
-            await bot.run_server_mode(server_conf)
-        else:
-            await bot.run_client_mode()
-
-    if inmemory:
-        game_storage = InMemoryStorage(
-            [
-                Question("1.What is the color of sky?", ["orange", "blue", "green"], 1),
-                Question("2.How much is 2 + 5?", ["4", "10", "7", "8"], 2),
-                Question(
-                    "3.What date is Christmas?",
-                    ["Dec 24", "Apr 15", "Jan 1", "Dec 25"],
-                    3,
-                ),
-            ]
-        )
-        await run_bot(game_storage)
-    else:
-        user = os.environ["POSTGRES_DB_USER"]
-        password = os.environ["POSTGRES_DB_PASSWD"]
-        db_host = os.environ["POSTGRES_DB_HOST"]
-        db_name = os.environ["POSTGRES_DB_NAME"]
-        conninfo = f"postgresql://{user}:{password}@{db_host}:{5432}/{db_name}"
-        async with AsyncConnectionPool(conninfo) as pool:
-            game_storage = PostgresStorage(pool)
-            await run_bot(game_storage)
+
+def make_cache_config(
+    handler_cache: bool, durability: Durability
+) -> Optional[HandlerCacheConfig]:
+    return HandlerCacheConfig(durability=durability) if handler_cache else None
 
 
 run = typer.Typer()
@@ -189,11 +548,59 @@ def client(
     inmemory: bool = typer.Option(
         False,
         help="Turn on `InMemory` mode to debug without connection to the database.",
-    )
-):
+    ),
+    workers: int = typer.Option(16, help="max number of updates handled at once"),
+    batch_storage: bool = typer.Option(
+        True, help="Read and write the chats of a batch of updates at once."
+    ),
+    handler_cache: bool = typer.Option(
+        False, help="Keep the active chats in memory instead of loading every update."
+    ),
+    durability: Durability = typer.Option(
+        Durability.WRITE_BEHIND, help="When the cached chats are written to the DB."
+    ),
+    question_bank: bool = typer.Option(
+        False, help="Load the questions into memory once instead of every game."
+    ),
+    snapshot_format: SnapshotFormat = typer.Option(
+        SnapshotFormat.BINARY, help="The format the chats are stored in."
+    ),
+    sparse_idle: bool = typer.Option(
+        False, help="Store the idle chats as an empty marker."
+    ),
+    sqlite: Optional[str] = typer.Option(
+        None, help="Store the data in this SQLite file instead of PostgreSQL."
+    ),
+    pool_size: Optional[int] = typer.Option(
+        None, help="max number of connections to the DB, `workers` by default"
+    ),
+    pool_timeout: float = typer.Option(
+        30.0, help="seconds to wait for a connection to the DB"
+    ),
+    replica_pool_size: int = typer.Option(
+        4, help="max number of connections to every read replica"
+    ),
+    replica_pool_timeout: float = typer.Option(
+        5.0, help="seconds to wait for a connection to a read replica"
+    ),
+):  # pylint: disable=too-many-arguments
     """Configures parameters for client mode."""
 
-    asyncio.run(launch_bot(inmemory))
+    asyncio.run(
+        launch_bot(
+            StorageConfig(
+                inmemory,
+                sqlite,
+                question_bank,
+                PoolConfig(pool_size, pool_timeout),
+                PoolConfig(replica_pool_size, replica_pool_timeout),
+                make_cache_config(handler_cache, durability),
+                snapshot_format,
+                sparse_idle,
+            ),
+            client_conf=ClientConfig(workers, batch_storage=batch_storage),
+        )
+    )
 
 
 @run.command()
@@ -207,11 +614,81 @@ def server(
         False,
         help="Turn on `InMemory` mode to debug without connection to the database.",
     ),
-):  # pylint: disable=too-many-arguments
+    reply_in_webhook: bool = typer.Option(
+        False,
+        help="Return the last message of an update in the webhook response "
+        "instead of sending it with a separate request.",
+    ),
+    ack_fast: bool = typer.Option(
+        False,
+        help="Respond to Telegram once an update is queued and handle it "
+        "in the background.",
+    ),
+    workers: int = typer.Option(
+        16, help="max number of updates handled at once in `ack-fast` mode"
+    ),
+    group_commit_window: Optional[float] = typer.Option(
+        None,
+        help="Write the chats saved within this many seconds with a single "
+        "transaction.",
+    ),
+    handler_cache: bool = typer.Option(
+        False, help="Keep the active chats in memory instead of loading every update."
+    ),
+    durability: Durability = typer.Option(
+        Durability.WRITE_BEHIND, help="When the cached chats are written to the DB."
+    ),
+    question_bank: bool = typer.Option(
+        False, help="Load the questions into memory once instead of every game."
+    ),
+    snapshot_format: SnapshotFormat = typer.Option(
+        SnapshotFormat.BINARY, help="The format the chats are stored in."
+    ),
+    sparse_idle: bool = typer.Option(
+        False, help="Store the idle chats as an empty marker."
+    ),
+    sqlite: Optional[str] = typer.Option(
+        None, help="Store the data in this SQLite file instead of PostgreSQL."
+    ),
+    pool_size: Optional[int] = typer.Option(
+        None, help="max number of connections to the DB, `workers` by default"
+    ),
+    pool_timeout: float = typer.Option(
+        30.0, help="seconds to wait for a connection to the DB"
+    ),
+    replica_pool_size: int = typer.Option(
+        4, help="max number of connections to every read replica"
+    ),
+    replica_pool_timeout: float = typer.Option(
+        5.0, help="seconds to wait for a connection to a read replica"
+    ),
+):  # pylint: disable=too-many-arguments,too-many-locals
     """Configures parameters for server mode."""
 
     asyncio.run(
-        launch_bot(inmemory, ServerConfig(url, host, port, cert_path, key_path))
+        launch_bot(
+            StorageConfig(
+                inmemory,
+                sqlite,
+                question_bank,
+                PoolConfig(pool_size, pool_timeout),
+                PoolConfig(replica_pool_size, replica_pool_timeout),
+                make_cache_config(handler_cache, durability),
+                snapshot_format,
+                sparse_idle,
+            ),
+            ServerConfig(
+                url,
+                host,
+                port,
+                cert_path,
+                key_path,
+                reply_in_webhook,
+                ack_fast,
+                workers,
+                group_commit_window=group_commit_window,
+            ),
+        )
     )
 
 
@@ -0,0 +1,156 @@
+"""Versioned migrations of the database schema.
+
+Every migration is applied once, in a transaction, in the order of the versions. The
+applied versions are recorded in the `schema_version` table. Migrations are run at
+startup, so the bot never changes the schema while it handles updates.
+
+A new migration is added to the end of `MIGRATIONS` with the next version. Applied
+migrations must not be changed.
+"""
+
+import logging
+from dataclasses import dataclass
+from typing import List, Tuple
+
+from psycopg import AsyncConnection, Connection
+from psycopg.abc import Query
+from psycopg_pool import AsyncConnectionPool
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    statements: Tuple[Query, ...]
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(
+        1,
+        "Create the questions, answers and handlers tables",
+        (
+            # The tables may already exist in the databases set up before
+            # the migrations were introduced.
+            """
+            CREATE TABLE IF NOT EXISTS questions (
+                id integer PRIMARY KEY,
+                category text,
+                type text,
+                difficulty text,
+                question text
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS answers (
+                question_id integer,
+                text text,
+                is_correct bool,
+                FOREIGN KEY (question_id) REFERENCES questions(id)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS handlers (
+                chat_id bigint PRIMARY KEY,
+                chat_handler text
+            )
+            """,
+        ),
+    ),
+    Migration(
+        2,
+        "Add the indexes and constraints used by the hot queries",
+        (
+            """
+            CREATE INDEX IF NOT EXISTS answers_question_id_idx
+            ON answers (question_id)
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS questions_category_difficulty_idx
+            ON questions (category, difficulty)
+            """,
+            # The columns were nullable, so the rows violating the constraints are
+            # fixed first. An answer without a question is never shown, and a chat
+            # without a handler starts over anyway.
+            "DELETE FROM answers WHERE question_id IS NULL",
+            "UPDATE answers SET is_correct = false WHERE is_correct IS NULL",
+            "DELETE FROM handlers WHERE chat_handler IS NULL",
+            "ALTER TABLE answers ALTER COLUMN question_id SET NOT NULL",
+            "ALTER TABLE answers ALTER COLUMN is_correct SET NOT NULL",
+            "ALTER TABLE handlers ALTER COLUMN chat_handler SET NOT NULL",
+        ),
+    ),
+    Migration(
+        3,
+        "Store the chat handler snapshots as binary",
+        (
+            """
+            ALTER TABLE handlers ALTER COLUMN chat_handler TYPE bytea
+            USING convert_to(chat_handler, 'UTF8')
+            """,
+        ),
+    ),
+]
+
+_CREATE_VERSION_TABLE = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version integer PRIMARY KEY,
+        description text NOT NULL,
+        applied_at timestamptz NOT NULL DEFAULT now()
+    )
+"""
+
+# Keeps several bot instances starting at once from running the migrations twice.
+_LOCK = "SELECT pg_advisory_xact_lock(4242)"
+_GET_VERSION = "SELECT coalesce(max(version), 0) FROM schema_version"
+_SET_VERSION = "INSERT INTO schema_version (version, description) VALUES (%s, %s)"
+
+
+def pending_migrations(version: int) -> List[Migration]:
+    """Returns the migrations to apply to a database of the given schema version."""
+
+    return [m for m in MIGRATIONS if m.version > version]
+
+
+async def migrate(pool: AsyncConnectionPool) -> int:
+    """Brings the schema up to date. Returns the number of applied migrations."""
+
+    # pylint: disable = not-context-manager
+    async with pool.connection() as conn:
+        return await migrate_connection(conn)
+
+
+async def migrate_connection(conn: AsyncConnection) -> int:
+    async with conn.transaction():
+        await conn.execute(_LOCK)
+        await conn.execute(_CREATE_VERSION_TABLE)
+        cur = await conn.execute(_GET_VERSION)
+        row = await cur.fetchone()
+        assert row is not None
+        pending = pending_migrations(row[0])
+        for migration in pending:
+            logging.info("Applying migration %d: %s", *_describe(migration))
+            for statement in migration.statements:
+                await conn.execute(statement)
+            await conn.execute(_SET_VERSION, _describe(migration))
+    return len(pending)
+
+
+def migrate_sync(conn: Connection) -> int:
+    """The same as `migrate` for a synchronous connection, e.g. in scripts."""
+
+    with conn.transaction():
+        conn.execute(_LOCK)
+        conn.execute(_CREATE_VERSION_TABLE)
+        row = conn.execute(_GET_VERSION).fetchone()
+        assert row is not None
+        pending = pending_migrations(row[0])
+        for migration in pending:
+            logging.info("Applying migration %d: %s", *_describe(migration))
+            for statement in migration.statements:
+                conn.execute(statement)
+            conn.execute(_SET_VERSION, _describe(migration))
+    return len(pending)
+
+
+def _describe(migration: Migration) -> Tuple[int, str]:
+    return migration.version, migration.description
@@ -0,0 +1,254 @@
+import asyncio
+import logging
+import random
+from array import array
+from bisect import bisect_left
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from storage import Question, Storage
+
+
+@dataclass(frozen=True)
+class PackedQuestions:
+    """The flat arrays a `QuestionBank` keeps its questions in."""
+
+    ids: array
+    texts: bytes
+    text_offsets: array
+    answers: List[str]
+    answer_refs: array
+    answer_offsets: array
+    correct_answers: array
+
+
+class QuestionBank:
+    """An immutable in-memory set of questions in a compact representation.
+
+    Instead of a `Question` object per question, the bank keeps a few flat arrays:
+    - the UTF-8 question texts concatenated into a single `bytes` with an array of
+      offsets,
+    - every distinct answer string stored once, with the answers of the questions
+      kept as an array of indices into them,
+    - the ids and the correct answers as arrays of machine integers.
+
+    `Question` objects are only made for the questions of a game, in O(k).
+
+    With 4 answers per question and texts of ~70 characters, a million questions take
+    ~470 MiB as `Question` objects and ~105 MiB as a bank, ~70 MiB of which are the
+    texts themselves. See `benchmarks/bench_question_bank.py`.
+    """
+
+    __slots__ = (
+        "_ids",
+        "_texts",
+        "_text_offsets",
+        "_answers",
+        "_answer_refs",
+        "_answer_offsets",
+        "_correct_answers",
+    )
+
+    def __init__(self, packed: PackedQuestions):
+        """Use `QuestionBankBuilder` to make a bank."""
+
+        # The arrays are kept in slots of their own, as attribute lookups are on
+        # the hot path.
+        self._ids = packed.ids
+        self._texts = packed.texts
+        self._text_offsets = packed.text_offsets
+        self._answers = packed.answers
+        self._answer_refs = packed.answer_refs
+        self._answer_offsets = packed.answer_offsets
+        self._correct_answers = packed.correct_answers
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def get_questions(self, question_count: int) -> List[Question]:
+        """Returns up to `question_count` distinct random questions."""
+
+        return [self._question(i) for i in self._sample(question_count)]
+
+    def get_question_ids(self, question_count: int) -> List[int]:
+        """Returns the ids of up to `question_count` distinct random questions."""
+
+        return [self._ids[i] for i in self._sample(question_count)]
+
+    def get_question(self, question_id: int) -> Optional[Question]:
+        index = bisect_left(self._ids, question_id)
+        if index == len(self._ids) or self._ids[index] != question_id:
+            return None
+        return self._question(index)
+
+    def memory_usage(self) -> int:
+        """The approximate number of bytes taken by the bank."""
+
+        arrays = (
+            self._ids,
+            self._text_offsets,
+            self._answer_refs,
+            self._answer_offsets,
+            self._correct_answers,
+        )
+        return (
+            len(self._texts)
+            + sum(a.itemsize * len(a) for a in arrays)
+            + sum(len(answer) + 50 for answer in self._answers)
+            + 8 * len(self._answers)
+        )
+
+    def _sample(self, question_count: int) -> List[int]:
+        return random.sample(range(len(self)), min(question_count, len(self)))
+
+    def _question(self, index: int) -> Question:
+        text = self._texts[
+            self._text_offsets[index] : self._text_offsets[index + 1]
+        ].decode()
+        answers = [
+            self._answers[ref]
+            for ref in self._answer_refs[
+                self._answer_offsets[index] : self._answer_offsets[index + 1]
+            ]
+        ]
+        return Question(text, answers, self._correct_answers[index])
+
+
+class QuestionBankBuilder:
+    """Accumulates questions into a `QuestionBank`. Questions must be added in the
+    ascending order of their ids."""
+
+    def __init__(self) -> None:
+        self._ids = array("q")
+        self._texts = bytearray()
+        self._text_offsets = array("Q", [0])
+        self._answers: List[str] = []
+        self._answer_indices: Dict[str, int] = {}
+        self._answer_refs = array("I")
+        self._answer_offsets = array("I", [0])
+        self._correct_answers = array("B")
+
+    def add(self, question_id: int, question: Question) -> None:
+        if self._ids and question_id <= self._ids[-1]:
+            raise ValueError("Questions must be added in the ascending order of ids")
+
+        self._ids.append(question_id)
+        self._texts += question.text.encode()
+        self._text_offsets.append(len(self._texts))
+        for answer in question.answers:
+            ref = self._answer_indices.get(answer)
+            if ref is None:
+                ref = self._answer_indices[answer] = len(self._answers)
+                self._answers.append(answer)
+            self._answer_refs.append(ref)
+        self._answer_offsets.append(len(self._answer_refs))
+        self._correct_answers.append(question.correct_answer)
+
+    def add_all(self, questions: Iterable[Question], first_id: int = 1) -> None:
+        for question_id, question in enumerate(questions, first_id):
+            self.add(question_id, question)
+
+    def build(self) -> QuestionBank:
+        return QuestionBank(
+            PackedQuestions(
+                self._ids,
+                bytes(self._texts),
+                self._text_offsets,
+                self._answers,
+                self._answer_refs,
+                self._answer_offsets,
+                self._correct_answers,
+            )
+        )
+
+
+class QuestionBankStorage(Storage):
+    """A `Storage` serving questions from a `QuestionBank` loaded from another storage.
+    Everything else is delegated to that storage.
+
+    The questions are loaded on `start`. Every `refresh_interval` seconds the storage
+    is checked for changed questions, and if there are any, a new bank is loaded in the
+    background and replaces the old one at once.
+    """
+
+    def __init__(self, storage: Storage, refresh_interval: float = 60.0):
+        self._storage = storage
+        self._refresh_interval = refresh_interval
+        self._bank: Optional[QuestionBank] = None
+        self._version: Optional[Hashable] = None
+        self._refresher: Optional[asyncio.Task] = None
+
+    @property
+    def bank(self) -> QuestionBank:
+        assert self._bank is not None, "The question bank is not loaded"
+        return self._bank
+
+    async def start(self) -> None:
+        await self.refresh()
+        self._refresher = asyncio.create_task(self._refresh_periodically())
+
+    async def close(self) -> None:
+        if self._refresher is not None:
+            self._refresher.cancel()
+            await asyncio.gather(self._refresher, return_exceptions=True)
+            self._refresher = None
+
+    async def __aenter__(self) -> "QuestionBankStorage":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *_exc_info) -> None:
+        await self.close()
+
+    async def refresh(self) -> bool:
+        """Reloads the questions if they changed. Returns whether they were reloaded."""
+
+        version = await self._storage.get_questions_version()
+        if self._bank is not None and version == self._version:
+            return False
+
+        builder = QuestionBankBuilder()
+        async for question_id, question in self._storage.get_all_questions():
+            builder.add(question_id, question)
+        self._bank, self._version = builder.build(), version
+        logging.info("Loaded %d questions", len(self._bank))
+        return True
+
+    async def get_questions(self, question_count: int) -> List[Question]:
+        return self.bank.get_questions(question_count)
+
+    async def get_question_ids(self, question_count: int) -> List[int]:
+        return self.bank.get_question_ids(question_count)
+
+    async def get_question(self, question_id: int) -> Optional[Question]:
+        return self.bank.get_question(question_id)
+
+    async def get_questions_version(self) -> Hashable:
+        return await self._storage.get_questions_version()
+
+    async def get_all_questions(self) -> AsyncIterator[Tuple[int, Question]]:
+        async for question in self._storage.get_all_questions():
+            yield question
+
+    async def get_chat_handler(self, chat_id: int) -> Optional[bytes]:
+        return await self._storage.get_chat_handler(chat_id)
+
+    async def set_chat_handler(self, chat_id: int, chat_handler: bytes):
+        await self._storage.set_chat_handler(chat_id, chat_handler)
+
+    async def del_chat_handler(self, chat_id: int):
+        await self._storage.del_chat_handler(chat_id)
+
+    async def get_chat_handlers(self, chat_ids: List[int]) -> Dict[int, bytes]:
+        return await self._storage.get_chat_handlers(chat_ids)
+
+    async def set_chat_handlers(self, chat_handlers: Dict[int, bytes]):
+        await self._storage.set_chat_handlers(chat_handlers)
+
+    async def _refresh_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self._refresh_interval)
+            try:
+                await self.refresh()
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Failed to refresh the question bank")
@@ -0,0 +1,62 @@
+import random
+import time
+from array import array
+from typing import Collection, List, Sequence, Union
+
+IdPopulation = Union[range, Sequence[int]]
+
+
+class QuestionSampler:
+    """Picks distinct random question ids in O(k) without touching the questions table.
+
+    Question ids are usually dense, so the population is just their range. Otherwise
+    the ids are kept in a compact array. The population is a snapshot of the table
+    and should be reloaded once it is `stale`, which also picks up new questions.
+    """
+
+    def __init__(self, ids: IdPopulation, max_age: float = 300.0):
+        """
+        ids -- ids of all the questions.
+        max_age -- seconds after which the sampler is considered stale.
+        """
+
+        self._ids = ids
+        self._max_age = max_age
+        self._loaded_at = time.monotonic()
+
+    @staticmethod
+    def from_stats(
+        min_id: int, max_id: int, count: int, max_age: float = 300.0
+    ) -> "QuestionSampler":
+        """Makes a sampler for dense ids without loading them. Returns an empty sampler
+        for an empty table. Raises ValueError if the ids are not dense."""
+
+        if count == 0:
+            return QuestionSampler(range(0), max_age)
+        if max_id - min_id + 1 != count:
+            raise ValueError("Question ids are not dense")
+        return QuestionSampler(range(min_id, max_id + 1), max_age)
+
+    @staticmethod
+    def from_ids(ids: Collection[int], max_age: float = 300.0) -> "QuestionSampler":
+        return QuestionSampler(array("q", ids), max_age)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @property
+    def stale(self) -> bool:
+        return time.monotonic() - self._loaded_at >= self._max_age
+
+    def sample(self, count: int, exclude: Collection[int] = ()) -> List[int]:
+        """Returns up to `count` distinct random ids that are not in `exclude`."""
+
+        count = min(count, len(self._ids) - len(exclude))
+        if count <= 0:
+            return []
+        if not exclude:
+            return random.sample(self._ids, count)
+
+        # At most `len(exclude)` of the sampled ids are excluded.
+        sampled = random.sample(self._ids, count + len(exclude))
+        return [i for i in sampled if i not in exclude][:count]
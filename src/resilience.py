@@ -0,0 +1,127 @@
+import logging
+import random
+import time
+from dataclasses import dataclass
+from enum import Enum
+from typing import Callable, Optional
+
+
+@dataclass
+class RetryPolicy:
+    """Retries with exponential backoff and full jitter:
+    https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+
+    max_attempts: how many times a call is made at most, the first one included
+    base_delay: seconds to wait at most before the first retry
+    max_delay: seconds to wait at most before any retry
+    """
+
+    max_attempts: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+
+    def delay(self, retry: int) -> float:
+        """Seconds to wait before the `retry`-th retry (0-based)."""
+
+        # The exponent is capped to keep the float in range for long outages.
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** min(retry, 32))
+        )
+
+
+class CircuitState(str, Enum):
+    CLOSED = "closed"
+    """Calls are made as usual."""
+
+    OPEN = "open"
+    """Too many calls failed recently. Calls fail fast without being made."""
+
+    HALF_OPEN = "half_open"
+    """The open period is over. A single trial call decides whether to close again."""
+
+
+class CircuitBreaker:
+    """Stops calling a service that keeps failing, to fail fast and give it time
+    to recover. https://martinfowler.com/bliki/CircuitBreaker.html
+
+    Callers ask `allow_request` before a call and report its outcome with
+    `record_success` or `record_failure`. A trial call of a half-open circuit that
+    ends without an outcome, e.g. is cancelled, is reported with `release_trial`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        on_state_change: Optional[Callable[[CircuitState, CircuitState], None]] = None,
+    ):
+        """
+        name -- the name of the protected service used in logs.
+        failure_threshold -- the number of consecutive failures that opens the circuit.
+        reset_timeout -- seconds the circuit stays open before a trial call is allowed.
+        on_state_change -- a callback called with the old and the new state.
+        """
+
+        self._name = name
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._on_state_change = on_state_change
+        self._state = CircuitState.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> CircuitState:
+        if (
+            self._state == CircuitState.OPEN
+            and time.monotonic() - self._opened_at >= self._reset_timeout
+        ):
+            self._set_state(CircuitState.HALF_OPEN)
+        return self._state
+
+    @property
+    def failures(self) -> int:
+        """The number of consecutive failures."""
+
+        return self._failures
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == CircuitState.CLOSED:
+            return True
+        if state == CircuitState.HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._trial_in_flight = False
+        if self._state != CircuitState.CLOSED:
+            self._set_state(CircuitState.CLOSED)
+
+    def release_trial(self) -> None:
+        """Lets another call be the trial call of a half-open circuit."""
+
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._trial_in_flight = False
+        if (
+            self._state == CircuitState.HALF_OPEN
+            or self._failures >= self._failure_threshold
+        ):
+            self._opened_at = time.monotonic()
+            if self._state != CircuitState.OPEN:
+                self._set_state(CircuitState.OPEN)
+
+    def _set_state(self, state: CircuitState) -> None:
+        old_state, self._state = self._state, state
+        logging.warning(
+            "Circuit breaker '%s': %s -> %s", self._name, old_state.value, state.value
+        )
+        if self._on_state_change is not None:
+            self._on_state_change(old_state, state)
@@ -0,0 +1,442 @@
+"""A local stand-in for the Telegram Bot API used for load and latency testing.
+
+It serves the methods `LiveTelegramClient` uses and simulates users playing the game:
+every chat greets the bot, starts a game, answers the questions and starts over until
+it has played the requested number of games. Each simulated user reacts to the
+bot's message immediately, so the measured latency is the time from an update
+being available to the bot answering it. A user whose reply is lost, e.g. to an
+injected error, sends the update again after a while and eventually gives up, and
+the whole run stops at a deadline, so a run always ends with a summary.
+
+Usage (from `src`):
+    python -m scripts.fake_telegram --chats 1000 --games 3 --port 8081
+    TELEGRAM_API_URL=http://localhost:8081 python main.py client --inmemory
+or, for the server mode:
+    python main.py server http://localhost:8082/handleUpdate localhost 8082 --inmemory
+"""
+
+import asyncio
+import json
+import random
+import statistics
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import aiohttp
+import typer
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from uvicorn import Config, Server
+
+
+@dataclass
+class FakeTelegramConfig:
+    """Behaviour of the stand-in server.
+
+    latency: seconds every request takes on average
+    jitter: max deviation from `latency` in seconds
+    error_rate: fraction of the requests failing with 500
+    flood_rate: fraction of the sendMessage/editMessageText requests failing with 429
+    retry_after: `retry_after` reported in the 429 responses
+    webhook_connections: max number of simultaneous webhook requests
+    reply_timeout: seconds a user waits for the bot's reply before sending the update
+        again
+    max_resends: number of times a user sends an update again before giving up on
+        the bot
+    """
+
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    flood_rate: float = 0.0
+    retry_after: int = 1
+    webhook_connections: int = 40
+    reply_timeout: float = 10.0
+    max_resends: int = 3
+
+
+@dataclass
+class SimulatedUser:
+    """A user playing `games_left` games with the bot."""
+
+    chat_id: int
+    games_left: int
+    waiting_since: Optional[float] = None
+    last_update: Optional[Dict[str, Any]] = None
+    sent_at: float = 0.0
+    resends: int = 0
+
+
+@dataclass
+class Stats:
+    started: float = field(default_factory=time.monotonic)
+    updates: int = 0
+    sent: int = 0
+    edited: int = 0
+    failed: int = 0
+    throttled: int = 0
+    resent: int = 0
+    abandoned: int = 0
+    unfinished: int = 0
+    latencies: List[float] = field(default_factory=list)
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.started
+        latencies = sorted(self.latencies)
+
+        def percentile(p: float) -> float:
+            if not latencies:
+                return 0.0
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+        return {
+            "elapsed_s": round(elapsed, 3),
+            "updates": self.updates,
+            "updates_per_s": round(self.updates / elapsed, 1) if elapsed else 0.0,
+            "sent": self.sent,
+            "edited": self.edited,
+            "failed": self.failed,
+            "throttled": self.throttled,
+            "resent": self.resent,
+            "abandoned": self.abandoned,
+            "unfinished": self.unfinished,
+            "latency_ms_p50": round(percentile(0.5), 2),
+            "latency_ms_p99": round(percentile(0.99), 2),
+            "latency_ms_mean": round(
+                statistics.fmean(latencies) * 1000 if latencies else 0.0, 2
+            ),
+        }
+
+
+class Webhook:
+    """Delivers the updates to the webhook of the bot once it is set, over
+    `connections` simultaneous requests. A method call returned in a webhook response
+    is passed to `on_reply`."""
+
+    def __init__(
+        self,
+        connections: int,
+        on_reply: Callable[[Dict[str, Any]], Awaitable[None]],
+    ):
+        self.url: Optional[str] = None
+        self._connections = connections
+        self._on_reply = on_reply
+        self._queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+        self._workers: List[asyncio.Task] = []
+
+    def set_url(self, url: Optional[str]) -> None:
+        """Sets the webhook, or deletes it if `url` is None."""
+
+        self.url = url
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+        if url is not None:
+            self._workers = [
+                asyncio.create_task(self._deliver(url))
+                for _ in range(self._connections)
+            ]
+
+    def send(self, update: Dict[str, Any]) -> None:
+        self._queue.put_nowait(update)
+
+    async def _deliver(self, url: str) -> None:
+        async with aiohttp.ClientSession() as session:
+            while True:
+                update = await self._queue.get()
+                try:
+                    async with session.post(url, json=update) as response:
+                        body = await response.read()
+                        if response.status != 200:
+                            # Telegram would redeliver the update later.
+                            await asyncio.sleep(1)
+                            self._queue.put_nowait(update)
+                        elif body and body != b"null":
+                            await self._on_reply(json.loads(body))
+                except aiohttp.ClientError:
+                    await asyncio.sleep(1)
+                    self._queue.put_nowait(update)
+
+
+class FakeTelegram:
+    """The state of the stand-in server: pending updates and simulated users."""
+
+    def __init__(self, conf: FakeTelegramConfig, chats: int, games: int):
+        self._conf = conf
+        self._users = {
+            chat_id: SimulatedUser(chat_id, games) for chat_id in range(1, chats + 1)
+        }
+        self._active_users = chats
+        self._updates: List[Dict[str, Any]] = []
+        self._new_updates = asyncio.Event()
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._webhook = Webhook(conf.webhook_connections, self._handle_webhook_reply)
+        self._watchdog: Optional[asyncio.Task] = None
+        self.stats = Stats()
+        self.finished = asyncio.Event()
+
+    def start(self) -> None:
+        self.stats = Stats()
+        for user in self._users.values():
+            self._act(user, {"message": self._message(user.chat_id, "hi")})
+        self._watchdog = asyncio.create_task(self._watch_replies())
+
+    def stop(self) -> None:
+        """Stops the background tasks and counts the users still playing."""
+
+        if self._watchdog is not None:
+            self._watchdog.cancel()
+        self._webhook.set_url(None)
+        self.stats.unfinished = self._active_users
+
+    async def handle(self, method: str, params: Dict[str, Any]) -> JSONResponse:
+        await asyncio.sleep(
+            max(0.0, self._conf.latency + random.uniform(-1, 1) * self._conf.jitter)
+        )
+        if random.random() < self._conf.error_rate:
+            self.stats.failed += 1
+            return _error(500, "Internal Server Error")
+        if (
+            method in ("sendMessage", "editMessageText")
+            and random.random() < self._conf.flood_rate
+        ):
+            self.stats.throttled += 1
+            return _error(
+                429,
+                f"Too Many Requests: retry after {self._conf.retry_after}",
+                {"retry_after": self._conf.retry_after},
+            )
+
+        handler = _METHODS.get(method)
+        if handler is None:
+            return _error(404, "Not Found")
+        return _ok(await handler(self, params))
+
+    async def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get("offset", 0))
+        timeout = float(params.get("timeout", 0))
+        limit = int(params.get("limit", 100))
+        # Updates before `offset` are confirmed and never returned again.
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates and timeout > 0:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        return self._updates[:limit]
+
+    async def _send_message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        self.stats.sent += 1
+        message_id = self._next_message_id
+        self._next_message_id += 1
+        chat_id = int(params["chat_id"])
+        user = self._users.get(chat_id)
+        if user is not None:
+            self._react(user, params)
+        return {"message_id": message_id, "chat": {"id": chat_id}}
+
+    async def _edit_message_text(self, _params: Dict[str, Any]) -> bool:
+        self.stats.edited += 1
+        return True
+
+    async def _set_webhook(self, params: Dict[str, Any]) -> bool:
+        self._webhook.set_url(params.get("url"))
+        if self._webhook.url is not None:
+            for update in self._updates:
+                self._webhook.send(update)
+            self._updates = []
+        return True
+
+    async def _delete_webhook(self, _params: Dict[str, Any]) -> bool:
+        self._webhook.set_url(None)
+        return True
+
+    def _react(self, user: SimulatedUser, message: Dict[str, Any]) -> None:
+        """Makes the user answer the bot's `message` like a player would."""
+
+        text: str = message.get("text", "")
+        if message.get("reply_markup"):
+            buttons = message["reply_markup"]["inline_keyboard"][0]
+            answer = random.choice(buttons)["callback_data"]
+            self._act(
+                user,
+                {"callback_query": {"from": {"id": user.chat_id}, "data": answer}},
+            )
+        elif text.startswith("You got"):
+            user.games_left -= 1
+            if user.games_left > 0:
+                self._act(user, {"message": self._message(user.chat_id, "/startGame")})
+            else:
+                self._record_latency(user)
+                self._finish(user)
+        elif text.startswith("Hello") or text.startswith("Type /startGame"):
+            self._act(user, {"message": self._message(user.chat_id, "/startGame")})
+
+    def _act(self, user: SimulatedUser, update: Dict[str, Any]) -> None:
+        self._record_latency(user)
+        self.stats.updates += 1
+        user.waiting_since = time.monotonic()
+        user.last_update = update
+        user.resends = 0
+        self._send_update(user, update)
+
+    def _send_update(self, user: SimulatedUser, update: Dict[str, Any]) -> None:
+        update = dict(update, update_id=self._next_update_id)
+        self._next_update_id += 1
+        user.sent_at = time.monotonic()
+        if self._webhook.url is None:
+            self._updates.append(update)
+            self._new_updates.set()
+        else:
+            self._webhook.send(update)
+
+    def _finish(self, user: SimulatedUser) -> None:
+        user.waiting_since = None
+        self._active_users -= 1
+        if self._active_users == 0:
+            self.finished.set()
+
+    async def _watch_replies(self) -> None:
+        """Sends the update again for the users who got no reply in time and gives up
+        on them after `max_resends` attempts."""
+
+        while True:
+            await asyncio.sleep(self._conf.reply_timeout / 4)
+            deadline = time.monotonic() - self._conf.reply_timeout
+            for user in self._users.values():
+                if user.waiting_since is None or user.sent_at > deadline:
+                    continue
+                if user.resends < self._conf.max_resends and user.last_update:
+                    user.resends += 1
+                    self.stats.resent += 1
+                    self._send_update(user, user.last_update)
+                else:
+                    self.stats.abandoned += 1
+                    self._finish(user)
+
+    def _record_latency(self, user: SimulatedUser) -> None:
+        if user.waiting_since is not None:
+            self.stats.latencies.append(time.monotonic() - user.waiting_since)
+            user.waiting_since = None
+
+    @staticmethod
+    def _message(chat_id: int, text: str) -> Dict[str, Any]:
+        return {"chat": {"id": chat_id, "type": "private"}, "text": text}
+
+    async def _handle_webhook_reply(self, reply: Dict[str, Any]) -> None:
+        """Handles a method call returned in a webhook response."""
+
+        method = reply.pop("method", None)
+        if method == "sendMessage":
+            await self._send_message(reply)
+
+
+_METHODS: Dict[str, Callable[[FakeTelegram, Dict[str, Any]], Awaitable[Any]]] = {
+    # pylint: disable=protected-access
+    "getUpdates": FakeTelegram._get_updates,
+    "sendMessage": FakeTelegram._send_message,
+    "editMessageText": FakeTelegram._edit_message_text,
+    "setWebhook": FakeTelegram._set_webhook,
+    "deleteWebhook": FakeTelegram._delete_webhook,
+}
+"""The handlers of the Bot API methods by the method name."""
+
+
+def _ok(result: Any) -> JSONResponse:
+    return JSONResponse({"ok": True, "result": result})
+
+
+def _error(code: int, description: str, parameters: Optional[dict] = None):
+    body: Dict[str, Any] = {"ok": False, "error_code": code, "description": description}
+    if parameters is not None:
+        body["parameters"] = parameters
+    return JSONResponse(body, status_code=code)
+
+
+def make_app(telegram: FakeTelegram) -> FastAPI:
+    app = FastAPI()
+
+    @app.api_route("/bot{_token}/{method}", methods=["GET", "POST"])
+    async def bot_api(_token: str, method: str, request: Request):
+        params: Dict[str, Any] = dict(request.query_params)
+        if request.headers.get("content-type", "").startswith("application/json"):
+            params.update(await request.json())
+        return await telegram.handle(method, params)
+
+    @app.get("/stats")
+    async def stats():
+        return telegram.stats.summary()
+
+    return app
+
+
+async def serve(  # pylint: disable=too-many-arguments
+    conf: FakeTelegramConfig,
+    chats: int,
+    games: int,
+    host: str,
+    port: int,
+    deadline: float,
+) -> Dict[str, Any]:
+    """Runs the stand-in server until all the simulated users are done, but no
+    longer than `deadline` seconds, and returns the summary of the run."""
+
+    telegram = FakeTelegram(conf, chats, games)
+    server = Server(
+        Config(app=make_app(telegram), host=host, port=port, log_level="warning")
+    )
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    telegram.start()
+    try:
+        await asyncio.wait_for(telegram.finished.wait(), deadline)
+    except asyncio.TimeoutError:
+        pass
+    telegram.stop()
+    summary = telegram.stats.summary()
+    # The bot keeps polling, so its connections are never idle long enough for
+    # a graceful shutdown.
+    server.should_exit = server.force_exit = True
+    await serving
+    return summary
+
+
+def main(
+    chats: int = typer.Option(100, help="number of simulated chats"),
+    games: int = typer.Option(1, help="number of games played in every chat"),
+    host: str = typer.Option("localhost", help="server host"),
+    port: int = typer.Option(8081, help="server port"),
+    latency: float = typer.Option(0.0, help="mean latency of a request in seconds"),
+    jitter: float = typer.Option(0.0, help="max deviation from the latency in seconds"),
+    error_rate: float = typer.Option(0.0, help="fraction of requests failing with 500"),
+    flood_rate: float = typer.Option(0.0, help="fraction of sends failing with 429"),
+    retry_after: int = typer.Option(1, help="`retry_after` reported with 429"),
+    reply_timeout: float = typer.Option(
+        10.0, help="seconds a user waits for a reply before sending the update again"
+    ),
+    deadline: float = typer.Option(600.0, help="max duration of the run in seconds"),
+    seed: Optional[int] = typer.Option(None, help="random seed"),
+):  # pylint: disable=too-many-arguments
+    """Runs the stand-in server until all the simulated users finish their games
+    and prints the throughput and latency numbers."""
+
+    random.seed(seed)
+    conf = FakeTelegramConfig(
+        latency,
+        jitter,
+        error_rate,
+        flood_rate,
+        retry_after,
+        reply_timeout=reply_timeout,
+    )
+    summary = asyncio.run(serve(conf, chats, games, host, port, deadline))
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    typer.run(main)
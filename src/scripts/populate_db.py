@@ -2,12 +2,16 @@ import json
 import os
 from enum import Enum
 from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
 
 import html2text
 import psycopg
 import typer
 from psycopg import Cursor
 
+from migrations import migrate_sync
+from sqlite_storage import connect as sqlite_connect
+
 
 class Command(str, Enum):
     reset = "reset"
@@ -24,9 +28,16 @@ def populated_db(
     questions_file: Path = typer.Option(
         "questions.json", help="Questions file used to populate the database."
     ),
+    sqlite: Optional[Path] = typer.Option(
+        None, help="SQLite file to use instead of the PostgreSQL database."
+    ),
 ):
     """Establishes the connection with the selected database."""
 
+    if sqlite is not None:
+        _sqlite_db(command, sqlite, questions_file)
+        return
+
     user = os.environ["POSTGRES_DB_USER"]
     password = os.environ["POSTGRES_DB_PASSWD"]
     host = os.environ["POSTGRES_DB_HOST"]
@@ -39,6 +50,7 @@ def populated_db(
         if command == Command.reset:
             _reset(conn.cursor())
         elif command == Command.populate:
+            migrate_sync(conn)
             _create(conn.cursor(), questions_file)
         else:
             raise RuntimeError(f"Unsupported command: {command}")
@@ -46,54 +58,75 @@ def populated_db(
     print("Connection was closed")
 
 
-def _create(cur: Cursor, questions_fpath: Path):
-    """Creates 'questions' and 'answers' tables in the selected database
-    and populates data from question_file to the selected database."""
-
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS questions (
-            id integer PRIMARY KEY,
-            category text,
-            type text,
-            difficulty text,
-            question text
+def _sqlite_db(command: Command, path: Path, questions_fpath: Path):
+    """Same as `populated_db` for the SQLite file at `path`. The file is created by
+    `populate`, and `reset` deletes it."""
+
+    if command == Command.reset:
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{path}{suffix}").unlink(missing_ok=True)
+        print("The database is clear")
+        return
+
+    conn = sqlite_connect(str(path))
+    try:
+        conn.execute("BEGIN")
+        for question_row, answers in _read_questions(questions_fpath):
+            conn.execute(
+                "INSERT INTO questions (id, category, type, difficulty, question)"
+                "VALUES (?, ?, ?, ?, ?)",
+                question_row,
             )
-        """
-    )
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS answers (
-            question_id integer,
-            text text,
-            is_correct bool,
-            FOREIGN KEY (question_id) REFERENCES questions(id))
-        """
-    )
+            conn.executemany(
+                "INSERT INTO answers (question_id, text, is_correct) VALUES (?, ?, ?)",
+                [(question_row[0], text, is_correct) for text, is_correct in answers],
+            )
+        conn.execute("COMMIT")
+        for table_name in ("questions", "answers"):
+            (count,) = conn.execute(f"SELECT COUNT (*) FROM {table_name}").fetchone()
+            print(f"Number of entries in {table_name} table: {count}")
+    finally:
+        conn.close()
+
+
+def _read_questions(
+    questions_fpath: Path,
+) -> Iterator[Tuple[Tuple[int, str, str, str, str], List[Tuple[str, bool]]]]:
+    """Reads the questions file. Yields the `questions` row of every question along
+    with its answers and whether they are correct. Question ids start with 1."""
+
     with open(questions_fpath, encoding="utf-8") as f:
         all_questions = json.load(f)
 
     for index, question in enumerate(all_questions):
         # convert a question of HTML into clean, easy-to-read plain ASCII text
         cleaned_question = html2text.html2text(f"{question['question']}").strip()
+        answers = [(f"{a}", False) for a in question["incorrect_answers"]] + [
+            (f"{question['correct_answer']}", True)
+        ]
+        yield (
+            index + 1,
+            f"{question['category']}",
+            f"{question['type']}",
+            f"{question['difficulty']}",
+            f"{cleaned_question}",
+        ), answers
+
+
+def _create(cur: Cursor, questions_fpath: Path):
+    """Populates data from question_file to the 'questions' and 'answers' tables
+    of the selected database. The tables are created by the migrations."""
+
+    for question, answers in _read_questions(questions_fpath):
         cur.execute(
             "INSERT INTO questions (id, category, type, difficulty, question)"
             "VALUES (%s, %s, %s, %s, %s) RETURNING id;",
-            (
-                index + 1,
-                f"{question['category']}",
-                f"{question['type']}",
-                f"{question['difficulty']}",
-                f"{cleaned_question}",
-            ),
+            question,
         )
         print("inserting in 'questions' table ")
         question_row = cur.fetchone()
         if question_row is not None:
             question_id = question_row[0]
-            answers = [(a, False) for a in question["incorrect_answers"]] + [  # type: ignore
-                (question["correct_answer"], True)
-            ]
             for text, is_correct in answers:
                 cur.execute(
                     "INSERT INTO answers (question_id, text, is_correct)"
@@ -105,7 +138,7 @@ def _create(cur: Cursor, questions_fpath: Path):
                     ),
                 )
                 print("inserting in 'answers' table")
-    print("'questions' and 'answers' tables were created")
+    print("'questions' and 'answers' tables were populated")
     _print_rows_in_table(cur, "questions")
     _print_rows_in_table(cur, "answers")
 
@@ -128,7 +161,7 @@ def _reset(cur: Cursor):
 
     cur.execute(
         """
-        DROP TABLE IF EXISTS handlers, questions, answers;
+        DROP TABLE IF EXISTS handlers, questions, answers, schema_version;
         """
     )
     print("The database is clear")
@@ -0,0 +1,104 @@
+"""Moves the chat handlers to their new shards after shards were added.
+
+The bot moves a chat to its new shard when it saves the chat, so the chats that stay
+idle would be kept on their previous shards forever. Run this script while the bot
+runs with both the new `POSTGRES_DB_SHARD_HOSTS` and the old
+`POSTGRES_DB_PREVIOUS_SHARD_HOSTS`, see `ShardedStorage`. Once it is done, the
+previous hosts can be unset.
+
+A batch is locked on its previous shard until it is copied and deleted there, so a
+chat the bot deletes meanwhile, e.g. when it is kicked, doesn't come back: the
+deletion waits for the lock, and then removes the copy from the new shard too.
+
+Usage (from `src`, with the environment of the bot):
+    python -m scripts.reshard
+"""
+
+import os
+from contextlib import ExitStack
+from typing import Dict, Iterable, List
+
+import psycopg
+import typer
+from psycopg import Connection
+
+from sharded_storage import shard_index, split_hosts
+from storage import postgres_conninfo
+
+_GET_CHAT_IDS = "SELECT chat_id FROM handlers"
+_LOCK_CHAT_HANDLERS = (
+    "SELECT chat_id, chat_handler FROM handlers WHERE chat_id = ANY(%s) FOR UPDATE"
+)
+# The bot may have saved the chat to its new shard meanwhile, and that handler is
+# the newer one.
+_COPY_CHAT_HANDLERS = """
+    INSERT INTO handlers(chat_id, chat_handler)
+    SELECT * FROM unnest(%s::bigint[], %s::bytea[])
+    ON CONFLICT(chat_id) DO NOTHING
+"""
+# The bot only deletes from the previous shards, and the rows are locked.
+_DEL_CHAT_HANDLERS = "DELETE FROM handlers WHERE chat_id = ANY(%s)"
+
+
+def group_moved_chats(
+    chat_ids: Iterable[int], previous_host: str, shard_hosts: List[str]
+) -> Dict[str, List[int]]:
+    """Groups the chats stored on `previous_host` that belong to another host now
+    by that host."""
+
+    moved: Dict[str, List[int]] = {}
+    for chat_id in chat_ids:
+        host = shard_hosts[shard_index(chat_id, len(shard_hosts))]
+        if host != previous_host:
+            moved.setdefault(host, []).append(chat_id)
+    return moved
+
+
+def move_chats(source: Connection, target: Connection, chat_ids: List[int]) -> int:
+    """Copies the handlers of `chat_ids` from `source` to `target` and deletes them
+    from `source`. Returns the number of moved handlers.
+
+    The handlers stay locked on `source` until the copy is committed on `target`."""
+
+    with source.transaction():
+        rows = source.execute(_LOCK_CHAT_HANDLERS, (chat_ids,)).fetchall()
+        moved_ids = [chat_id for chat_id, _ in rows]
+        with target.transaction():
+            target.execute(
+                _COPY_CHAT_HANDLERS,
+                (moved_ids, [chat_handler for _, chat_handler in rows]),
+            )
+        source.execute(_DEL_CHAT_HANDLERS, (moved_ids,))
+    return len(rows)
+
+
+def main(batch_size: int = typer.Option(1000, help="number of chats moved at once")):
+    """Moves the chats of the previous shards that belong to other shards now."""
+
+    shard_hosts = split_hosts(os.environ["POSTGRES_DB_SHARD_HOSTS"])
+    previous_hosts = split_hosts(os.environ["POSTGRES_DB_PREVIOUS_SHARD_HOSTS"])
+
+    with ExitStack() as stack:
+        connections: Dict[str, Connection] = {}
+
+        def connection(host: str) -> Connection:
+            if host not in connections:
+                connections[host] = stack.enter_context(
+                    psycopg.connect(postgres_conninfo(host), autocommit=True)
+                )
+            return connections[host]
+
+        for previous_host in dict.fromkeys(previous_hosts):
+            source = connection(previous_host)
+            chat_ids = [row[0] for row in source.execute(_GET_CHAT_IDS)]
+            moved = group_moved_chats(chat_ids, previous_host, shard_hosts)
+            for host, host_chat_ids in moved.items():
+                count = 0
+                for start in range(0, len(host_chat_ids), batch_size):
+                    batch = host_chat_ids[start : start + batch_size]
+                    count += move_chats(source, connection(host), batch)
+                print(f"Moved {count} chats from {previous_host} to {host}")
+
+
+if __name__ == "__main__":
+    typer.run(main)
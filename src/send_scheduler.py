@@ -0,0 +1,266 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field, replace
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set
+
+from telegram_client import TooManyRequestsException
+
+
+class SendSchedulerClosedException(Exception):
+    """Raised for a message that wasn't sent because the scheduler was closed."""
+
+
+@dataclass
+class RateLimits:
+    """Outbound rate limits. Defaults follow the Telegram flood limits:
+    https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+
+    global_rate: messages per second to all chats
+    global_burst: messages that can be sent to all chats at once after a quiet period
+    chat_rate: messages per second to a single chat
+    chat_burst: messages that can be sent to a single chat at once after a quiet period
+    max_retries: how many times a message rejected with 429 is sent again
+    """
+
+    global_rate: float = 30
+    global_burst: int = 30
+    chat_rate: float = 1
+    chat_burst: int = 3
+    max_retries: int = 3
+
+
+@dataclass
+class SendSchedulerStats:
+    """Metrics of a `SendScheduler`. Wait time is measured from the moment a message is
+    submitted to the moment it is sent for the first time."""
+
+    queue_depth: int
+    sent: int
+    throttled: int
+    total_wait: float
+    max_wait: float
+
+    @property
+    def mean_wait(self) -> float:
+        return self.total_wait / self.sent if self.sent else 0.0
+
+
+class TokenBucket:
+    """A token bucket refilled at `rate` tokens per second up to `capacity` tokens."""
+
+    def __init__(self, rate: float, capacity: int, now: float):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds to wait until a token is available."""
+
+        self._refill(now)
+        return max(0.0, (1 - self._tokens) / self._rate)
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self._tokens -= 1
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self._tokens >= self._capacity
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(
+            self._capacity, self._tokens + (now - self._updated) * self._rate
+        )
+        self._updated = now
+
+
+@dataclass
+class _Job:
+    send: Callable[[], Awaitable[Any]]
+    future: asyncio.Future
+    submitted: float
+    ordered: bool
+    attempts: int = field(default=0)
+
+
+class SendScheduler:
+    """Paces outbound messages to stay within the Telegram flood limits.
+
+    Messages wait in per-chat queues. A message is sent once both the global and its
+    chat token buckets have a token. Chats with pending messages take turns, so a chat
+    with a burst of messages doesn't delay the others. Ordered messages of a chat are
+    sent one at a time in the submission order; unordered ones (e.g. edits) don't wait
+    for the messages in flight. When Telegram responds with 429, the chat is paused
+    for `retry_after` seconds and the message is sent again.
+    """
+
+    def __init__(self, limits: Optional[RateLimits] = None):
+        self._limits = limits or RateLimits()
+        self._global_bucket = TokenBucket(
+            self._limits.global_rate, self._limits.global_burst, time.monotonic()
+        )
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._paused_until: Dict[int, float] = {}
+        self._queues: "OrderedDict[int, Deque[_Job]]" = OrderedDict()
+        self._busy_chats: Set[int] = set()
+        self._wakeup = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        # The messages being sent.
+        self._sends: Set[asyncio.Task] = set()
+        self._stats = SendSchedulerStats(0, 0, 0, 0.0, 0.0)
+
+    @property
+    def queue_depth(self) -> int:
+        """The number of messages waiting to be sent."""
+
+        return self._stats.queue_depth
+
+    def stats(self) -> SendSchedulerStats:
+        return replace(self._stats)
+
+    def start(self) -> None:
+        assert self._worker is None, "The scheduler is already started"
+        self._worker = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Stops sending. Waits for the messages being sent, and the messages still
+        waiting in the queues fail with `SendSchedulerClosedException`."""
+
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        await asyncio.gather(*self._sends, return_exceptions=True)
+        for queue in self._queues.values():
+            for job in queue:
+                if not job.future.done():
+                    job.future.set_exception(SendSchedulerClosedException())
+        self._queues.clear()
+        self._stats.queue_depth = 0
+
+    async def submit(
+        self, chat_id: int, send: Callable[[], Awaitable[Any]], ordered: bool = True
+    ) -> Any:
+        """Queues `send` for the chat `chat_id` and returns its result once it is sent.
+        An ordered `send` starts only after the previous ordered one has finished."""
+
+        assert self._worker is not None, "The scheduler must be started first"
+        job = _Job(
+            send, asyncio.get_running_loop().create_future(), time.monotonic(), ordered
+        )
+        self._queues.setdefault(chat_id, deque()).append(job)
+        self._stats.queue_depth += 1
+        self._wakeup.set()
+        return await job.future
+
+    async def _run(self) -> None:
+        while True:
+            timeout = self._dispatch(time.monotonic())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _dispatch(self, now: float) -> Optional[float]:
+        """Sends the messages that are allowed to be sent now.
+        Returns the number of seconds until the next one can be sent, if any."""
+
+        next_at: Optional[float] = None
+        dispatched = False
+        for chat_id in list(self._queues):
+            queue = self._queues[chat_id]
+            while queue and queue[0].future.done():
+                # The caller is gone, e.g. cancelled.
+                queue.popleft()
+                self._stats.queue_depth -= 1
+            if not queue:
+                del self._queues[chat_id]
+                continue
+            if queue[0].ordered and chat_id in self._busy_chats:
+                continue
+
+            bucket = self._chat_bucket(chat_id, now)
+            ready_at = max(
+                self._paused_until.get(chat_id, now), now + bucket.delay(now)
+            )
+            if ready_at > now:
+                next_at = ready_at if next_at is None else min(next_at, ready_at)
+                continue
+
+            global_delay = self._global_bucket.delay(now)
+            if global_delay > 0:
+                ready_at = now + global_delay
+                next_at = ready_at if next_at is None else min(next_at, ready_at)
+                break
+
+            self._global_bucket.take(now)
+            bucket.take(now)
+            self._paused_until.pop(chat_id, None)
+            job = queue.popleft()
+            self._stats.queue_depth -= 1
+            if queue:
+                self._queues.move_to_end(chat_id)
+            else:
+                del self._queues[chat_id]
+            if job.attempts == 0:
+                wait = now - job.submitted
+                self._stats.sent += 1
+                self._stats.total_wait += wait
+                self._stats.max_wait = max(self._stats.max_wait, wait)
+            if job.ordered:
+                self._busy_chats.add(chat_id)
+            send = asyncio.create_task(self._execute(chat_id, job))
+            self._sends.add(send)
+            send.add_done_callback(self._sends.discard)
+            dispatched = True
+
+        self._prune_chat_buckets(now)
+        if dispatched:
+            # The chats just served may have more messages that can be sent right away.
+            return 0.0
+        return None if next_at is None else next_at - now
+
+    async def _execute(self, chat_id: int, job: _Job) -> None:
+        try:
+            result = await job.send()
+        except TooManyRequestsException as e:
+            self._stats.throttled += 1
+            self._paused_until[chat_id] = time.monotonic() + e.retry_after
+            if job.attempts < self._limits.max_retries:
+                job.attempts += 1
+                self._queues.setdefault(chat_id, deque()).appendleft(job)
+                self._stats.queue_depth += 1
+            elif not job.future.done():
+                job.future.set_exception(e)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            if job.ordered:
+                self._busy_chats.discard(chat_id)
+            self._wakeup.set()
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self._limits.chat_rate, self._limits.chat_burst, now)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _prune_chat_buckets(self, now: float) -> None:
+        # A full bucket of an idle chat is no different from a freshly created one.
+        if len(self._chat_buckets) <= 2 * len(self._queues) + 1000:
+            return
+        for chat_id, bucket in list(self._chat_buckets.items()):
+            if chat_id not in self._queues and bucket.is_full(now):
+                del self._chat_buckets[chat_id]
+                self._paused_until.pop(chat_id, None)
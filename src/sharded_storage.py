@@ -0,0 +1,163 @@
+import asyncio
+from typing import (
+    AsyncIterator,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from storage import Question, Storage
+
+
+def shard_index(chat_id: int, shard_count: int) -> int:
+    """Maps `chat_id` to one of `shard_count` shards with the jump consistent hash
+    by Lamping and Veach. The mapping is the same in every process, and only
+    1/`shard_count` of the chats move when a shard is added."""
+
+    key = chat_id & 0xFFFFFFFFFFFFFFFF
+    bucket, jump = -1, 0
+    while jump < shard_count:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return bucket
+
+
+def split_hosts(hosts: str) -> List[str]:
+    """Parses a comma-separated list of hosts."""
+
+    return [host.strip() for host in hosts.split(",") if host.strip()]
+
+
+class ShardedStorage(Storage):
+    """A `Storage` spreading the chat handlers over several storages, e.g. PostgreSQL
+    instances, by `shard_index` of the chat id. The questions are read from the first
+    shard.
+
+    The shards can be changed online. Start the bot with the new `shards` and the old
+    ones as `previous_shards`. During this migration window a chat handler is read
+    from its new shard, and from the old one if it isn't there yet. It is moved to
+    the new shard when it is saved. Deletions go to the old shard first and then to
+    the new one. The chats that are not saved, e.g. idle ones, stay on the old shards
+    until `scripts.reshard` moves them. The window is over once it is done, and then
+    the bot can be started without `previous_shards`.
+    """
+
+    def __init__(
+        self,
+        shards: Sequence[Storage],
+        previous_shards: Optional[Sequence[Storage]] = None,
+    ):
+        """
+        shards -- the storages the chat handlers are written to. Their order must not
+            change, and the shards are only added to the end.
+        previous_shards -- the shards before the resharding, if it is in progress.
+        """
+
+        assert shards, "At least one shard is required"
+        self._shards = shards
+        self._previous_shards = previous_shards or []
+
+    async def get_chat_handler(self, chat_id: int) -> Optional[bytes]:
+        shard = self._shard(chat_id)
+        snapshot = await shard.get_chat_handler(chat_id)
+        previous_shard = self._previous_shard(chat_id)
+        if snapshot is None and previous_shard is not None:
+            snapshot = await previous_shard.get_chat_handler(chat_id)
+            if snapshot is None:
+                # `scripts.reshard` may have moved it between the two reads.
+                snapshot = await shard.get_chat_handler(chat_id)
+        return snapshot
+
+    async def set_chat_handler(self, chat_id: int, chat_handler: bytes):
+        await self._shard(chat_id).set_chat_handler(chat_id, chat_handler)
+        previous_shard = self._previous_shard(chat_id)
+        if previous_shard is not None:
+            # The handler isn't read from there anymore, so it can't come back.
+            await previous_shard.del_chat_handler(chat_id)
+
+    async def del_chat_handler(self, chat_id: int):
+        previous_shard = self._previous_shard(chat_id)
+        if previous_shard is not None:
+            # `scripts.reshard` locks the handler on the old shard until its copy is
+            # committed, so the deletion from the new shard below removes the copy.
+            await previous_shard.del_chat_handler(chat_id)
+        await self._shard(chat_id).del_chat_handler(chat_id)
+
+    async def get_chat_handlers(self, chat_ids: List[int]) -> Dict[int, bytes]:
+        snapshots = await _get_chat_handlers(self._shard, chat_ids)
+        missing = [chat_id for chat_id in chat_ids if chat_id not in snapshots]
+        snapshots.update(await _get_chat_handlers(self._previous_shard, missing))
+        moving = [
+            chat_id
+            for chat_id in missing
+            if chat_id not in snapshots and self._previous_shard(chat_id) is not None
+        ]
+        # `scripts.reshard` may have moved them between the two reads.
+        snapshots.update(await _get_chat_handlers(self._shard, moving))
+        return snapshots
+
+    async def set_chat_handlers(self, chat_handlers: Dict[int, bytes]):
+        groups: Dict[int, Tuple[Storage, Dict[int, bytes]]] = {}
+        for chat_id, chat_handler in chat_handlers.items():
+            shard = self._shard(chat_id)
+            groups.setdefault(id(shard), (shard, {}))[1][chat_id] = chat_handler
+        await asyncio.gather(
+            *(shard.set_chat_handlers(group) for shard, group in groups.values())
+        )
+
+        moved = []
+        for chat_id in chat_handlers:
+            previous_shard = self._previous_shard(chat_id)
+            if previous_shard is not None:
+                moved.append(previous_shard.del_chat_handler(chat_id))
+        await asyncio.gather(*moved)
+
+    async def get_questions(self, question_count: int) -> List[Question]:
+        return await self._shards[0].get_questions(question_count)
+
+    async def get_question_ids(self, question_count: int) -> List[int]:
+        return await self._shards[0].get_question_ids(question_count)
+
+    async def get_question(self, question_id: int) -> Optional[Question]:
+        return await self._shards[0].get_question(question_id)
+
+    async def get_all_questions(self) -> AsyncIterator[Tuple[int, Question]]:
+        async for question in self._shards[0].get_all_questions():
+            yield question
+
+    async def get_questions_version(self) -> Hashable:
+        return await self._shards[0].get_questions_version()
+
+    def _shard(self, chat_id: int) -> Storage:
+        return self._shards[shard_index(chat_id, len(self._shards))]
+
+    def _previous_shard(self, chat_id: int) -> Optional[Storage]:
+        """The shard of `chat_id` before the resharding if it is another one."""
+
+        if not self._previous_shards:
+            return None
+        shard = self._previous_shards[shard_index(chat_id, len(self._previous_shards))]
+        return None if shard is self._shard(chat_id) else shard
+
+
+async def _get_chat_handlers(
+    route: Callable[[int], Optional[Storage]], chat_ids: List[int]
+) -> Dict[int, bytes]:
+    """Reads the handlers of `chat_ids` with a request per shard."""
+
+    groups: Dict[int, Tuple[Storage, List[int]]] = {}
+    for chat_id in chat_ids:
+        shard = route(chat_id)
+        if shard is not None:
+            groups.setdefault(id(shard), (shard, []))[1].append(chat_id)
+    snapshots: Dict[int, bytes] = {}
+    for shard_snapshots in await asyncio.gather(
+        *(shard.get_chat_handlers(group) for shard, group in groups.values())
+    ):
+        snapshots.update(shard_snapshots)
+    return snapshots
@@ -0,0 +1,275 @@
+import asyncio
+import itertools
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, List, Optional, Tuple
+
+from question_sampler import QuestionSampler
+from storage import (
+    PostgresQuestionRecord,
+    Question,
+    QuestionCache,
+    Storage,
+    group_question_records,
+)
+
+# The schema versions, applied in order. The applied version is kept in
+# `PRAGMA user_version`. Applied versions must not be changed.
+_MIGRATIONS: List[Tuple[str, ...]] = [
+    (
+        """
+        CREATE TABLE IF NOT EXISTS questions (
+            id integer PRIMARY KEY,
+            category text,
+            type text,
+            difficulty text,
+            question text NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS answers (
+            question_id integer NOT NULL REFERENCES questions(id),
+            text text NOT NULL,
+            is_correct integer NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS answers_question_id_idx ON answers (question_id)",
+        """
+        CREATE TABLE IF NOT EXISTS handlers (
+            chat_id integer PRIMARY KEY,
+            chat_handler blob NOT NULL
+        )
+        """,
+    ),
+]
+
+# The statements are kept constant, so sqlite3 prepares each of them once and reuses
+# it from the statement cache of the connection. Lists of ids are passed as JSON
+# arrays for that reason.
+_GET_CHAT_HANDLER = "SELECT chat_handler FROM handlers WHERE chat_id = ?"
+_GET_CHAT_HANDLERS = """
+    SELECT chat_id, chat_handler FROM handlers
+    WHERE chat_id IN (SELECT value FROM json_each(?))
+"""
+_SET_CHAT_HANDLER = """
+    INSERT INTO handlers (chat_id, chat_handler) VALUES (?, ?)
+    ON CONFLICT (chat_id) DO UPDATE SET chat_handler = excluded.chat_handler
+"""
+_DEL_CHAT_HANDLER = "DELETE FROM handlers WHERE chat_id = ?"
+_GET_QUESTIONS = """
+    SELECT id, question, text, is_correct FROM questions
+    INNER JOIN answers ON questions.id = answers.question_id
+    WHERE id IN (SELECT value FROM json_each(?))
+    ORDER BY id, text
+"""
+_GET_ALL_QUESTIONS = """
+    SELECT id, question, text, is_correct FROM questions
+    INNER JOIN answers ON questions.id = answers.question_id
+    ORDER BY id, text
+"""
+_GET_ID_STATS = "SELECT min(id), max(id), count(*) FROM questions"
+_GET_IDS = "SELECT id FROM questions"
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """Opens the database at `path` and brings its schema up to date. The connection
+    is in the autocommit mode and must only be used by the thread that opened it."""
+
+    conn = sqlite3.connect(path, isolation_level=None, cached_statements=64)
+    # Readers don't block the writer, and a transaction takes a single fsync.
+    conn.execute("PRAGMA journal_mode = WAL")
+    # Unlike NORMAL, FULL keeps the committed transactions on a power loss.
+    conn.execute("PRAGMA synchronous = FULL")
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA busy_timeout = 5000")
+    (version,) = conn.execute("PRAGMA user_version").fetchone()
+    for new_version, statements in enumerate(_MIGRATIONS[version:], version + 1):
+        with _transaction(conn):
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {new_version}")
+    return conn
+
+
+class _transaction:
+    # pylint: disable = invalid-name
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+
+    def __enter__(self) -> None:
+        self._conn.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, *_exc_info) -> None:
+        self._conn.execute("COMMIT" if exc_type is None else "ROLLBACK")
+
+
+class SqliteStorage(Storage):
+    """Data storage in an SQLite file, for deployments without a database server.
+
+    The file is in the WAL mode. All the calls run on a dedicated thread owning the
+    connection, so the event loop is never blocked. Writes are committed one by one;
+    wrap the storage into `GroupCommitStorage` to commit concurrent writes together.
+    Questions are sampled by id, see `QuestionSampler`.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        sampler_max_age: float = 300.0,
+        question_cache_size: int = 10000,
+    ):
+        """
+        path -- the database file. It is created if it doesn't exist.
+        sampler_max_age -- seconds after which the question ids are reloaded to pick
+            up new questions.
+        question_cache_size -- max number of questions cached for `get_question`.
+        """
+
+        self._path = path
+        self._question_cache = QuestionCache(question_cache_size)
+        self._sampler_max_age = sampler_max_age
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._sampler: Optional[QuestionSampler] = None
+
+    async def open(self) -> None:
+        assert self._conn is None, "The storage is already opened"
+        self._conn = await self._run(connect, self._path)
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown()
+
+    async def __aenter__(self) -> "SqliteStorage":
+        await self.open()
+        return self
+
+    async def __aexit__(self, *_exc_info) -> None:
+        await self.close()
+
+    async def get_questions(self, question_count: int) -> List[Question]:
+        return [question for _, question in await self._sample(question_count)]
+
+    async def get_question_ids(self, question_count: int) -> List[int]:
+        return [question_id for question_id, _ in await self._sample(question_count)]
+
+    async def get_question(self, question_id: int) -> Optional[Question]:
+        question = self._question_cache.get(question_id)
+        if question is None:
+            questions = await self._load_questions([question_id])
+            if questions:
+                question = questions[0][1]
+        return question
+
+    async def get_all_questions(self) -> AsyncIterator[Tuple[int, Question]]:
+        for question in await self._run(self._read_all_questions):
+            yield question
+
+    async def get_questions_version(self) -> Hashable:
+        """Changes whenever another connection, e.g. `populate_db.py`, commits, along
+        with the number of questions."""
+
+        def read_version(conn: sqlite3.Connection) -> Hashable:
+            (data_version,) = conn.execute("PRAGMA data_version").fetchone()
+            (count,) = conn.execute("SELECT count(*) FROM questions").fetchone()
+            return data_version, count
+
+        return await self._run_with_conn(read_version)
+
+    async def get_chat_handler(self, chat_id: int) -> Optional[bytes]:
+        def read(conn: sqlite3.Connection) -> Optional[bytes]:
+            row = conn.execute(_GET_CHAT_HANDLER, (chat_id,)).fetchone()
+            return row[0] if row else None
+
+        return await self._run_with_conn(read)
+
+    async def get_chat_handlers(self, chat_ids: List[int]) -> Dict[int, bytes]:
+        def read(conn: sqlite3.Connection) -> Dict[int, bytes]:
+            return dict(conn.execute(_GET_CHAT_HANDLERS, (json.dumps(chat_ids),)))
+
+        return await self._run_with_conn(read)
+
+    async def set_chat_handler(self, chat_id: int, chat_handler: bytes):
+        await self.set_chat_handlers({chat_id: chat_handler})
+
+    async def set_chat_handlers(self, chat_handlers: Dict[int, bytes]):
+        def write(conn: sqlite3.Connection) -> None:
+            with _transaction(conn):
+                conn.executemany(_SET_CHAT_HANDLER, chat_handlers.items())
+
+        await self._run_with_conn(write)
+
+    async def del_chat_handler(self, chat_id: int):
+        def delete(conn: sqlite3.Connection) -> None:
+            conn.execute(_DEL_CHAT_HANDLER, (chat_id,))
+
+        await self._run_with_conn(delete)
+
+    async def _sample(self, question_count: int) -> List[Tuple[int, Question]]:
+        """Selects random questions. They are cached as the game is about to show
+        them."""
+
+        sampler = self._sampler
+        if sampler is None or sampler.stale:
+            sampler = self._sampler = await self._run(self._load_sampler)
+        ids = sampler.sample(question_count)
+        questions = await self._load_questions(ids)
+        if len(questions) < len(ids):
+            # Some questions were deleted since the ids were loaded.
+            sampler = self._sampler = await self._run(self._load_sampler)
+            found = {question_id for question_id, _ in questions}
+            more_ids = sampler.sample(len(ids) - len(found), exclude=found)
+            questions += await self._load_questions(more_ids)
+        return questions
+
+    async def _load_questions(self, ids: List[int]) -> List[Tuple[int, Question]]:
+        """Reads the questions with `ids` and caches them. The cache is only used on
+        the event loop, never on the thread of the connection."""
+
+        questions = await self._run(self._read_questions, ids)
+        for question_id, question in questions:
+            self._question_cache.put(question_id, question)
+        return questions
+
+    def _load_sampler(self) -> QuestionSampler:
+        conn = self._connection()
+        min_id, max_id, count = conn.execute(_GET_ID_STATS).fetchone()
+        try:
+            return QuestionSampler.from_stats(
+                min_id or 0, max_id or 0, count, self._sampler_max_age
+            )
+        except ValueError:
+            ids = [row[0] for row in conn.execute(_GET_IDS)]
+            return QuestionSampler.from_ids(ids, self._sampler_max_age)
+
+    def _read_questions(self, ids: List[int]) -> List[Tuple[int, Question]]:
+        if not ids:
+            return []
+        rows = self._connection().execute(_GET_QUESTIONS, (json.dumps(ids),))
+        return _group_rows(rows.fetchall())
+
+    def _read_all_questions(self) -> List[Tuple[int, Question]]:
+        return _group_rows(self._connection().execute(_GET_ALL_QUESTIONS).fetchall())
+
+    def _connection(self) -> sqlite3.Connection:
+        assert self._conn is not None, "The storage is not opened"
+        return self._conn
+
+    async def _run_with_conn(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        return await self._run(lambda: func(self._connection()))
+
+    async def _run(self, func: Callable, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+
+def _group_rows(rows: List[tuple]) -> List[Tuple[int, Question]]:
+    records = [
+        PostgresQuestionRecord(id, question, text, bool(is_correct))
+        for id, question, text, is_correct in rows
+    ]
+    ids = [question_id for question_id, _ in itertools.groupby(r.id for r in records)]
+    return list(zip(ids, group_question_records(records)))
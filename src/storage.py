@@ -1,11 +1,27 @@
 import asyncio
 import itertools
+import logging
+import os
+import time
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 from dataclasses import dataclass
-from functools import cache
-from typing import Dict, List, Optional
+from typing import (
+    AsyncIterator,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
 
-from psycopg_pool import AsyncConnectionPool
+from psycopg import AsyncConnection, AsyncCursor, OperationalError
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+from typing_extensions import LiteralString
+
+from question_sampler import QuestionSampler
 
 
 @dataclass
@@ -52,6 +68,43 @@ class PostgresQuestionRecord:
     is_correct: bool
 
 
+def group_question_records(records: List[PostgresQuestionRecord]) -> List[Question]:
+    """Assembles questions from the answer records sorted by question id."""
+
+    game_questions = []
+    for _, group_ in itertools.groupby(records, lambda q: q.id):
+        group: List[PostgresQuestionRecord] = list(group_)
+        text = group[0].question
+        answers = [x.answer for x in group]
+        correct_answer = [y.is_correct for y in group].index(True)
+        game_questions.append(Question(text, answers, correct_answer))
+
+    return game_questions
+
+
+class QuestionCache:
+    """An LRU cache of questions by id shared by all the games."""
+
+    def __init__(self, capacity: int = 10000):
+        self._capacity = capacity
+        self._questions: "OrderedDict[int, Question]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._questions)
+
+    def get(self, question_id: int) -> Optional[Question]:
+        question = self._questions.get(question_id)
+        if question is not None:
+            self._questions.move_to_end(question_id)
+        return question
+
+    def put(self, question_id: int, question: Question) -> None:
+        self._questions[question_id] = question
+        self._questions.move_to_end(question_id)
+        if len(self._questions) > self._capacity:
+            self._questions.popitem(last=False)
+
+
 class Storage(ABC):
     """An interface for accessing and updating the game data (questions, chat states etc.)."""
 
@@ -61,94 +114,381 @@ class Storage(ABC):
         Calling the method multiple time may result in a different set of questions."""
 
     @abstractmethod
-    async def get_chat_handler(self, chat_id: int) -> Optional[str]:
+    async def get_chat_handler(self, chat_id: int) -> Optional[bytes]:
         """Read the serialized chat_handler from the DB for a specific chat_id.
         Returns None if chat handler for `chat_id` is not found.
         """
 
     @abstractmethod
-    async def set_chat_handler(self, chat_id: int, chat_handler: str):
+    async def set_chat_handler(self, chat_id: int, chat_handler: bytes):
         """Save serialized chat_handler to the DB or internal memory."""
 
     async def del_chat_handler(self, chat_id: int):
         """Delete all entries related to a specific chat id due to user blocking."""
 
+    async def get_chat_handlers(self, chat_ids: List[int]) -> Dict[int, bytes]:
+        """Reads the handlers of several chats at once. The chats without a handler
+        are missing from the result."""
+
+        snapshots = await asyncio.gather(*map(self.get_chat_handler, chat_ids))
+        return {
+            chat_id: snapshot
+            for chat_id, snapshot in zip(chat_ids, snapshots)
+            if snapshot is not None
+        }
+
+    async def set_chat_handlers(self, chat_handlers: Dict[int, bytes]):
+        """Saves the handlers of several chats at once."""
+
+        await asyncio.gather(
+            *(self.set_chat_handler(*item) for item in chat_handlers.items())
+        )
+
+    @abstractmethod
+    async def get_question_ids(self, question_count: int) -> List[int]:
+        """Gets the ids of `question_count` questions selected the same way as by
+        `get_questions`."""
+
+    @abstractmethod
+    async def get_question(self, question_id: int) -> Optional[Question]:
+        """Returns the question with `question_id` or None if there is no such question."""
+
+    @abstractmethod
+    async def get_all_questions(self) -> AsyncIterator[Tuple[int, Question]]:
+        """Iterates over all the questions with their ids in the ascending order of ids."""
+
+        raise NotImplementedError()
+        # Makes it an async generator like the implementations.
+        yield  # pylint: disable=unreachable
+
+    @abstractmethod
+    async def get_questions_version(self) -> Hashable:
+        """Returns a value that changes whenever the questions change."""
+
+
+async def _execute(
+    conn: AsyncConnection, query: LiteralString, params: tuple
+) -> AsyncCursor:
+    """Runs `query` in a transaction of its own in a single round trip. BEGIN,
+    the query and COMMIT are sent at once in the pipeline mode, and the query is
+    prepared on the server the first time the connection runs it."""
+
+    async with conn.pipeline():
+        async with conn.transaction():
+            cur = await conn.execute(query, params, prepare=True)
+    return cur
 
-class PostgresStorage(Storage):
-    """Data storage over a PostgreSQL database."""
 
+# The replay lag of a standby. It is 0 if the standby has replayed everything it
+# received, so it doesn't grow while the primary is idle, and NULL on a primary.
+_REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp())
+    END;
+"""
+
+
+def postgres_conninfo(host: str) -> str:
+    """The connection string of the database on `host` from the environment."""
+
+    user = os.environ["POSTGRES_DB_USER"]
+    password = os.environ["POSTGRES_DB_PASSWD"]
+    db_name = os.environ["POSTGRES_DB_NAME"]
+    return f"postgresql://{user}:{password}@{host}:{5432}/{db_name}"
+
+
+class _Replica:
     def __init__(self, pool: AsyncConnectionPool):
+        self.pool = pool
+        # A replica is used once a lag check shows it is fine.
+        self.usable = False
+        # The number of queries in progress.
+        self.active = 0
+        self.checked_at = float("-inf")
+        self.check: Optional[asyncio.Task] = None
+
+
+class PostgresStorage(Storage):
+    """Data storage over a PostgreSQL database.
+
+    Every statement on the hot paths is prepared and takes a single round trip to
+    the database, see `_execute`. A connection is held only for a query, never while
+    an update is processed, as the processing may need another one, e.g. to read
+    a question.
+
+    The questions are sampled and read on the read replicas if there are any. A query
+    goes to the replica with the fewest queries in progress. A replica that lags
+    behind the primary by more than `max_replica_lag` or fails a query is not used
+    until a lag check shows it is fine again, and the queries go to the primary
+    meanwhile. The chat handlers, `get_questions_version` and `get_all_questions`
+    always use the primary.
+    """
+
+    def __init__(
+        self,
+        pool: AsyncConnectionPool,
+        sampler_max_age: float = 300.0,
+        question_cache_size: int = 10000,
+        replica_pools: Sequence[AsyncConnectionPool] = (),
+        max_replica_lag: float = 10.0,
+        replica_check_interval: float = 5.0,
+    ):  # pylint: disable=too-many-arguments
+        """
+        pool -- the pool of connections to the primary database.
+        sampler_max_age -- seconds after which the question ids are reloaded in the
+            background to pick up new questions.
+        question_cache_size -- max number of questions cached for `get_question`.
+        replica_pools -- the pools of connections to the read replicas.
+        max_replica_lag -- seconds a replica may lag behind the primary.
+        replica_check_interval -- seconds between the lag checks of a replica.
+        """
+
         self._pool = pool
+        self._replicas = [_Replica(replica_pool) for replica_pool in replica_pools]
+        self._next_replica = 0
+        self._max_replica_lag = max_replica_lag
+        self._replica_check_interval = replica_check_interval
+        self._question_cache = QuestionCache(question_cache_size)
+        self._sampler_max_age = sampler_max_age
+        self._sampler: Optional[QuestionSampler] = None
+        self._sampler_lock = asyncio.Lock()
+        self._sampler_refresh: Optional[asyncio.Task] = None
+
+    async def close(self) -> None:
+        """Stops the background lag checks and question id reloads. The pools are
+        closed by their owner."""
+
+        tasks = [replica.check for replica in self._replicas] + [self._sampler_refresh]
+        for task in tasks:
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(
+            *(t for t in tasks if t is not None), return_exceptions=True
+        )
 
     async def get_questions(self, question_count: int) -> List[Question]:
-        # pylint: disable = not-context-manager
+        return [question for _, question in await self._sample(question_count)]
+
+    async def get_question_ids(self, question_count: int) -> List[int]:
+        return [question_id for question_id, _ in await self._sample(question_count)]
+
+    async def get_question(self, question_id: int) -> Optional[Question]:
+        question = self._question_cache.get(question_id)
+        if question is None:
+            records = await self._get_question_records([question_id])
+            if not records and self._replicas:
+                # The question may be too new for the replica.
+                records = await self._get_question_records([question_id], primary=True)
+            questions = self._cache_questions(records)
+            if questions:
+                question = questions[0][1]
+        return question
+
+    async def _sample(self, question_count: int) -> List[Tuple[int, Question]]:
+        """Selects random questions. They are cached as the game is about to show
+        them."""
+
+        sampler = await self._get_sampler()
+        ids = sampler.sample(question_count)
+        records = await self._get_question_records(ids)
+        found = {r.id for r in records}
+        if len(found) < len(ids):
+            # Some questions were deleted since the ids were loaded.
+            sampler = await self._load_sampler()
+            more_ids = sampler.sample(len(ids) - len(found), exclude=found)
+            records += await self._get_question_records(more_ids)
+        return self._cache_questions(records)
+
+    def _cache_questions(
+        self, records: List[PostgresQuestionRecord]
+    ) -> List[Tuple[int, Question]]:
+        ids = [
+            question_id for question_id, _ in itertools.groupby(r.id for r in records)
+        ]
+        questions = list(zip(ids, group_question_records(records)))
+        for question_id, question in questions:
+            self._question_cache.put(question_id, question)
+        return questions
+
+    async def _get_question_records(
+        self, ids: List[int], primary: bool = False
+    ) -> List[PostgresQuestionRecord]:
+        if not ids:
+            return []
+        rows = await self._read(
+            """
+            SELECT id, question, text, is_correct FROM questions
+            INNER JOIN answers ON questions.id = answers.question_id
+            WHERE id = ANY(%s)
+            ORDER BY id, text;
+            """,
+            (ids,),
+            primary,
+        )
+        return [PostgresQuestionRecord(*r) for r in rows]
+
+    async def _read(
+        self, query: LiteralString, params: tuple, primary: bool = False
+    ) -> List[tuple]:
+        """Runs the read-only `query` on a replica, or on the primary if there is no
+        usable replica or the replica fails."""
+
+        replica = None if primary else self._pick_replica()
+        if replica is not None:
+            replica.active += 1
+            try:
+                # pylint: disable = not-context-manager
+                async with replica.pool.connection() as conn:
+                    cur = await _execute(conn, query, params)
+                    return await cur.fetchall()
+            except (OperationalError, PoolTimeout) as e:
+                logging.warning("A read replica failed, using the primary: %s", e)
+                replica.usable = False
+            finally:
+                replica.active -= 1
+
         async with self._pool.connection() as conn:
-            async with conn.cursor() as cur:
+            cur = await _execute(conn, query, params)
+            return await cur.fetchall()
+
+    def _pick_replica(self) -> Optional[_Replica]:
+        now = time.monotonic()
+        for replica in self._replicas:
+            if now - replica.checked_at >= self._replica_check_interval and (
+                replica.check is None or replica.check.done()
+            ):
+                replica.checked_at = now
+                replica.check = asyncio.create_task(self._check_replica(replica))
+
+        # Rotating the order spreads the queries when the replicas are equally busy.
+        self._next_replica = (self._next_replica + 1) % max(1, len(self._replicas))
+        replicas = (
+            self._replicas[self._next_replica :] + self._replicas[: self._next_replica]
+        )
+        return min(
+            (replica for replica in replicas if replica.usable),
+            key=lambda replica: replica.active,
+            default=None,
+        )
+
+    async def _check_replica(self, replica: _Replica) -> None:
+        try:
+            async with replica.pool.connection() as conn:
+                cur = await conn.execute(_REPLICA_LAG_QUERY)
+                row = await cur.fetchone()
+        except (OperationalError, PoolTimeout) as e:
+            logging.warning("Failed to check a read replica: %s", e)
+            replica.usable = False
+            return
+
+        lag = row[0] if row is not None and row[0] is not None else 0
+        usable = lag <= self._max_replica_lag
+        if replica.usable and not usable:
+            logging.warning("A read replica lags by %.1f seconds", lag)
+        replica.usable = usable
+
+    async def _get_sampler(self) -> QuestionSampler:
+        if self._sampler is None:
+            async with self._sampler_lock:
+                if self._sampler is None:
+                    return await self._load_sampler()
+        elif self._sampler.stale and (
+            self._sampler_refresh is None or self._sampler_refresh.done()
+        ):
+            self._sampler_refresh = asyncio.create_task(self._load_sampler())
+        return self._sampler
+
+    async def _load_sampler(self) -> QuestionSampler:
+        """Loads the ids of the questions. Only the bounds are loaded if the ids are
+        dense, which is the case for the questions added by `populate_db.py`."""
+
+        rows = await self._read("SELECT min(id), max(id), count(*) FROM questions;", ())
+        min_id, max_id, count = rows[0]
+        try:
+            sampler = QuestionSampler.from_stats(
+                min_id or 0, max_id or 0, count, self._sampler_max_age
+            )
+        except ValueError:
+            rows = await self._read("SELECT id FROM questions;", ())
+            sampler = QuestionSampler.from_ids(
+                [r[0] for r in rows], self._sampler_max_age
+            )
+        self._sampler = sampler
+        return sampler
+
+    async def get_all_questions(self) -> AsyncIterator[Tuple[int, Question]]:
+        # A server-side cursor streams the rows instead of loading all of them at once.
+        async with self._pool.connection() as conn:
+            async with conn.cursor("all_questions") as cur:
+                cur.itersize = 10000
                 await cur.execute(
                     """
                     SELECT id, question, text, is_correct FROM questions
                     INNER JOIN answers ON questions.id = answers.question_id
-                    WHERE id IN (
-                        SELECT id FROM questions
-                        ORDER BY random()
-                        LIMIT (%s)
-                    )
                     ORDER BY id, text;
-                    """,
-                    (question_count,),
+                    """
                 )
-                questions = [PostgresQuestionRecord(*r) async for r in cur]
-        game_questions = []
-        for _, group_ in itertools.groupby(questions, lambda q: q.id):
-            group: List[PostgresQuestionRecord] = list(group_)
-            text = group[0].question
-            answers = [x.answer for x in group]
-            correct_answer = [y.is_correct for y in group].index(True)
-            game_questions.append(Question(text, answers, correct_answer))
-
-        return game_questions
-
-    async def get_chat_handler(self, chat_id: int) -> Optional[str]:
-        """Read the serialized chat_handler from the DB for a particular chat_id."""
+                group: List[PostgresQuestionRecord] = []
+                async for row in cur:
+                    record = PostgresQuestionRecord(*row)
+                    if group and group[0].id != record.id:
+                        yield group[0].id, group_question_records(group)[0]
+                        group = []
+                    group.append(record)
+                if group:
+                    yield group[0].id, group_question_records(group)[0]
+
+    async def get_questions_version(self) -> Hashable:
+        """The number of rows modified in the question tables since the statistics
+        were reset, along with the number of questions."""
 
         async with self._pool.connection() as conn:
             async with conn.cursor() as cur:
-                self._ensure_chat_handler_table()
                 await cur.execute(
                     """
-                    SELECT chat_handler FROM handlers
-                    WHERE chat_id = (%s);
-                    """,
-                    (chat_id,),
+                    SELECT relname, n_tup_ins + n_tup_upd + n_tup_del
+                    FROM pg_stat_user_tables
+                    WHERE relname IN ('questions', 'answers')
+                    UNION ALL
+                    SELECT 'count', count(*) FROM questions
+                    ORDER BY 1;
+                    """
                 )
-                json_chat_handler = await cur.fetchone()
-                if json_chat_handler:
-                    return json_chat_handler[0]
+                return tuple(await cur.fetchall())
 
-                return None
+    async def get_chat_handler(self, chat_id: int) -> Optional[bytes]:
+        """Read the serialized chat_handler from the DB for a particular chat_id."""
 
-    async def set_chat_handler(self, chat_id: int, chat_handler: str):
+        async with self._pool.connection() as conn:
+            cur = await _execute(
+                conn,
+                """
+                SELECT chat_handler FROM handlers
+                WHERE chat_id = (%s);
+                """,
+                (chat_id,),
+            )
+            row = await cur.fetchone()
+            return row[0] if row else None
 
+    async def set_chat_handler(self, chat_id: int, chat_handler: bytes):
         async with self._pool.connection() as conn:
-            async with conn.cursor() as cur:
-                self._ensure_chat_handler_table()
-                await cur.execute(
-                    """
-                    INSERT INTO handlers(chat_id, chat_handler)
-                    VALUES(%s, %s)
-                    ON CONFLICT(chat_id) DO UPDATE
-                    SET chat_handler = excluded.chat_handler;
-                    """,
-                    (
-                        chat_id,
-                        chat_handler,
-                    ),
-                )
+            await _execute(
+                conn,
+                """
+                INSERT INTO handlers(chat_id, chat_handler)
+                VALUES(%s, %s)
+                ON CONFLICT(chat_id) DO UPDATE
+                SET chat_handler = excluded.chat_handler;
+                """,
+                (chat_id, chat_handler),
+            )
 
     async def del_chat_handler(self, chat_id: int):
-        async with self._pool.connection() as cur:
-            self._ensure_chat_handler_table()
-            await cur.execute(
+        async with self._pool.connection() as conn:
+            await _execute(
+                conn,
                 """
                 DELETE FROM handlers
                 WHERE chat_id = (%s);
@@ -156,22 +496,34 @@ class PostgresStorage(Storage):
                 (chat_id,),
             )
 
-    @cache
-    def _ensure_chat_handler_table(self):
-        coro = self._ensure_chat_handler_table_coro()
-        return asyncio.create_task(coro)
+    async def get_chat_handlers(self, chat_ids: List[int]) -> Dict[int, bytes]:
+        async with self._pool.connection() as conn:
+            cur = await _execute(
+                conn,
+                """
+                SELECT chat_id, chat_handler FROM handlers
+                WHERE chat_id = ANY(%s);
+                """,
+                (chat_ids,),
+            )
+            return dict(await cur.fetchall())
 
-    async def _ensure_chat_handler_table_coro(self):
+    async def set_chat_handlers(self, chat_handlers: Dict[int, bytes]):
+        if not chat_handlers:
+            return
+        # Unnesting arrays keeps the statement the same for any number of rows,
+        # so it is prepared once.
         async with self._pool.connection() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute(
-                    """
-                    CREATE TABLE IF NOT EXISTS handlers (
-                        chat_id bigint PRIMARY KEY,
-                        chat_handler text
-                        )
-                    """
-                )
+            await _execute(
+                conn,
+                """
+                INSERT INTO handlers(chat_id, chat_handler)
+                SELECT * FROM unnest(%s::bigint[], %s::bytea[])
+                ON CONFLICT(chat_id) DO UPDATE
+                SET chat_handler = excluded.chat_handler;
+                """,
+                (list(chat_handlers), list(chat_handlers.values())),
+            )
 
 
 class InMemoryStorage(Storage):
@@ -179,19 +531,119 @@ class InMemoryStorage(Storage):
 
     def __init__(self, questions: List[Question]):
         self._questions = questions
-        self._chat_handlers: Dict[int, str] = {}
+        self._chat_handlers: Dict[int, bytes] = {}
 
     async def get_questions(self, question_count: int) -> List[Question]:
         return self._questions[:question_count]
 
-    async def get_chat_handler(self, chat_id: int) -> Optional[str]:
+    async def get_question_ids(self, question_count: int) -> List[int]:
+        return list(range(1, min(question_count, len(self._questions)) + 1))
+
+    async def get_question(self, question_id: int) -> Optional[Question]:
+        if 1 <= question_id <= len(self._questions):
+            return self._questions[question_id - 1]
+        return None
+
+    async def get_all_questions(self) -> AsyncIterator[Tuple[int, Question]]:
+        for question_id, question in enumerate(self._questions, 1):
+            yield question_id, question
+
+    async def get_questions_version(self) -> Hashable:
+        return len(self._questions)
+
+    async def get_chat_handler(self, chat_id: int) -> Optional[bytes]:
         try:
             return self._chat_handlers[chat_id]
         except KeyError:
             return None
 
-    async def set_chat_handler(self, chat_id: int, chat_handler: str):
+    async def set_chat_handler(self, chat_id: int, chat_handler: bytes):
         self._chat_handlers[chat_id] = chat_handler
 
     async def del_chat_handler(self, chat_id: int):
-        del self._chat_handlers[chat_id]
+        self._chat_handlers.pop(chat_id, None)
+
+    async def get_chat_handlers(self, chat_ids: List[int]) -> Dict[int, bytes]:
+        return {
+            chat_id: self._chat_handlers[chat_id]
+            for chat_id in chat_ids
+            if chat_id in self._chat_handlers
+        }
+
+    async def set_chat_handlers(self, chat_handlers: Dict[int, bytes]):
+        self._chat_handlers.update(chat_handlers)
+
+
+class BatchStorage(Storage):
+    """A `Storage` reading and writing the chat handlers of a batch of updates at once.
+    Everything else is delegated to the wrapped storage.
+
+    `load` reads the handlers of the chats in the batch with a single request. The
+    handlers saved while the batch is handled are kept in memory, so a chat with
+    several updates in the batch sees its own changes, and are written with a single
+    request by `flush`. The changes are kept if the write fails, and `flush` can be
+    retried.
+    """
+
+    def __init__(self, storage: Storage):
+        self._storage = storage
+        self._loaded: Dict[int, Optional[bytes]] = {}
+        self._pending: Dict[int, bytes] = {}
+
+    @property
+    def pending_count(self) -> int:
+        """The number of chat handlers that are not written yet."""
+
+        return len(self._pending)
+
+    async def load(self, chat_ids: Iterable[int]) -> None:
+        """Starts a new batch with the handlers of `chat_ids`."""
+
+        self._loaded = dict(self._pending)
+        chat_ids = [
+            chat_id for chat_id in set(chat_ids) if chat_id not in self._pending
+        ]
+        snapshots = await self._storage.get_chat_handlers(chat_ids)
+        self._loaded.update((chat_id, snapshots.get(chat_id)) for chat_id in chat_ids)
+
+    async def flush(self) -> None:
+        """Writes the handlers saved since the last flush."""
+
+        if not self._pending:
+            return
+        # Handlers saved during the write are written with the next flush.
+        pending, self._pending = self._pending, {}
+        try:
+            await self._storage.set_chat_handlers(pending)
+        except BaseException:
+            self._pending = {**pending, **self._pending}
+            raise
+
+    async def get_chat_handler(self, chat_id: int) -> Optional[bytes]:
+        if chat_id in self._loaded:
+            return self._loaded[chat_id]
+        return await self._storage.get_chat_handler(chat_id)
+
+    async def set_chat_handler(self, chat_id: int, chat_handler: bytes):
+        self._loaded[chat_id] = self._pending[chat_id] = chat_handler
+
+    async def del_chat_handler(self, chat_id: int):
+        self._pending.pop(chat_id, None)
+        self._loaded[chat_id] = None
+        await self._storage.del_chat_handler(chat_id)
+
+    async def get_questions(self, question_count: int) -> List[Question]:
+        return await self._storage.get_questions(question_count)
+
+    async def get_question_ids(self, question_count: int) -> List[int]:
+        return await self._storage.get_question_ids(question_count)
+
+    async def get_question(self, question_id: int) -> Optional[Question]:
+        return await self._storage.get_question(question_id)
+
+    async def get_all_questions(self) -> AsyncIterator[Tuple[int, Question]]:
+        async for question in self._storage.get_all_questions():
+            yield question
+
+    async def get_questions_version(self) -> Hashable:
+        return await self._storage.get_questions_version()
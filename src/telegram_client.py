@@ -1,17 +1,46 @@
+import asyncio
+import json as _json
 import logging
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
+from collections import deque
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, List, Optional, Type, TypeVar
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Generic,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
 
 import aiohttp
 import jsons
-import requests
 
+from resilience import CircuitBreaker, CircuitState, RetryPolicy
 from utils import transform_keywords
 
+if TYPE_CHECKING:
+    from send_scheduler import SendScheduler
+
 T = TypeVar("T")
 
+DEFAULT_API_URL = "https://api.telegram.org"
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+DEFAULT_POLL_TIMEOUT = 30
+"""Seconds Telegram holds a `getUpdates` request open while there are no updates."""
+
+DEFAULT_POLL_LIMIT = 100
+"""Max number of updates returned by a single `getUpdates` request."""
+
 
 class TelegramException(Exception):
     def __init__(self, message: str, status_code: Optional[int] = None):
@@ -24,6 +53,22 @@ class UnexpectedStatusCodeException(TelegramException):
         super().__init__(message, status_code)
 
 
+class TooManyRequestsException(UnexpectedStatusCodeException):
+    """Telegram refused the request due to flood control.
+    It can be repeated after `retry_after` seconds."""
+
+    def __init__(self, retry_after: float, message: str):
+        self.retry_after = retry_after
+        super().__init__(429, message)
+
+
+class CircuitOpenException(TelegramException):
+    """Telegram is considered down after too many failures. The request wasn't made."""
+
+    def __init__(self):
+        super().__init__("Telegram is unavailable")
+
+
 class NetworkException(TelegramException):
     def __init__(self, message: str):
         super().__init__(message)
@@ -168,7 +213,7 @@ class SendMessageResponse:
     result: SendMessageResponseResult
 
 
-@dataclass
+@dataclass(frozen=True)
 class InlineKeyboardButton:
     """A button of an inline keyboard attachable to a message.
 
@@ -185,12 +230,14 @@ class InlineKeyboardButton:
     callback_data: str
 
 
-@dataclass
+@dataclass(frozen=True)
 class InlineKeyboardMarkup:
     """Layout of an inline keyboard that can be attached to messages.
-    https://core.telegram.org/bots/api#inlinekeyboardmarkup"""
+    https://core.telegram.org/bots/api#inlinekeyboardmarkup
 
-    inline_keyboard: List[List[InlineKeyboardButton]]
+    The rows are tuples, so a keyboard shared by many messages can't be changed."""
+
+    inline_keyboard: Tuple[Tuple[InlineKeyboardButton, ...], ...]
 
 
 @dataclass
@@ -211,12 +258,276 @@ class MessageEdit:
     text: str
 
 
+# Hand-written decoders for the objects received from Telegram. They build the same
+# objects as `jsons.load(..., key_transformer=transform_keywords)` without its
+# reflection overhead: every decoder reads only the keys its class needs, so unknown
+# keys are skipped without being looked at. Values are coerced the way jsons does it,
+# and malformed objects raise `jsons.DeserializationError`.
+
+
+def _field(obj: Any, key: str, cls: type) -> Any:
+    try:
+        return obj[key]
+    except KeyError:
+        raise jsons.DeserializationError(
+            f'No value found for "{key}".', obj, cls
+        ) from None
+    except TypeError as e:
+        raise jsons.DeserializationError(
+            f'Could not deserialize value "{obj}" into "{cls.__name__}".', obj, cls
+        ) from e
+
+
+def _int(obj: Any, key: str, cls: type) -> int:
+    value = _field(obj, key, cls)
+    if isinstance(value, int):
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError) as e:
+        raise jsons.DeserializationError(
+            f'Could not deserialize value "{value}" into "int".', value, int
+        ) from e
+
+
+def _str(obj: Any, key: str, cls: type) -> str:
+    value = _field(obj, key, cls)
+    return value if isinstance(value, str) else str(value)
+
+
+def _optional(obj: Dict[str, Any], key: str, decode: Callable[[Any], T]) -> Optional[T]:
+    value = obj.get(key)
+    if value is None:
+        return None
+    if not isinstance(value, dict):
+        raise jsons.DeserializationError(
+            f'Could not match the object of type "{type(value).__name__}" '
+            f"to any type of the Union.",
+            value,
+            None,
+        )
+    return decode(value)
+
+
+def decode_chat(obj: Any) -> Chat:
+    return Chat(_int(obj, "id", Chat))
+
+
+def decode_user(obj: Any) -> User:
+    return User(_int(obj, "id", User))
+
+
+def decode_message(obj: Any) -> Message:
+    return Message(
+        decode_chat(_field(obj, "chat", Message)), _str(obj, "text", Message)
+    )
+
+
+def decode_callback_query(obj: Any) -> CallbackQuery:
+    return CallbackQuery(
+        decode_user(_field(obj, "from", CallbackQuery)),
+        _str(obj, "data", CallbackQuery),
+    )
+
+
+def decode_chat_member_updated(obj: Any) -> ChatMemberUpdated:
+    return ChatMemberUpdated(
+        decode_chat(_field(obj, "chat", ChatMemberUpdated)),
+        ChatMember(
+            _str(
+                _field(obj, "new_chat_member", ChatMemberUpdated), "status", ChatMember
+            )
+        ),
+    )
+
+
+def decode_update(obj: Any) -> Update:
+    if not isinstance(obj, dict):
+        raise jsons.DeserializationError(
+            f'Could not deserialize value "{obj}" into "Update".', obj, Update
+        )
+    return Update(
+        _int(obj, "update_id", Update),
+        _optional(obj, "message", decode_message),
+        _optional(obj, "callback_query", decode_callback_query),
+        _optional(obj, "my_chat_member", decode_chat_member_updated),
+        _optional(obj, "channel_post", decode_message),
+    )
+
+
+def decode_get_updates_response(obj: Any) -> GetUpdatesResponse:
+    updates = _field(obj, "result", GetUpdatesResponse)
+    if not isinstance(updates, list):
+        raise jsons.DeserializationError(
+            f'Could not deserialize value "{updates}" into "List[Update]".',
+            updates,
+            list,
+        )
+    return GetUpdatesResponse([decode_update(u) for u in updates])
+
+
+def decode_send_message_response(obj: Any) -> SendMessageResponse:
+    result = _field(obj, "result", SendMessageResponse)
+    return SendMessageResponse(
+        SendMessageResponseResult(_int(result, "message_id", SendMessageResponseResult))
+    )
+
+
+DECODERS: Dict[type, Callable[[Any], Any]] = {
+    Update: decode_update,
+    GetUpdatesResponse: decode_get_updates_response,
+    SendMessageResponse: decode_send_message_response,
+}
+
+
+def decode_object(obj: Any, cls: Type[T]) -> T:
+    """Builds an object of `cls` from a parsed JSON value. Classes without
+    a hand-written decoder fall back to `jsons`."""
+
+    decoder = DECODERS.get(cls)
+    if decoder is None:
+        return jsons.load(obj, cls=cls, key_transformer=transform_keywords)
+    return decoder(obj)
+
+
+def load_object(raw: Union[bytes, str], cls: Type[T]) -> T:
+    """Parses raw JSON and builds an object of `cls` from it."""
+
+    return decode_object(_json.loads(raw), cls)
+
+
+# Encoders for the payloads sent to Telegram. They write the same JSON as
+# `_json.dumps(jsons.dump(payload, strip_nulls=True))` straight to bytes. Keyboards are
+# few and shared (see `format.make_keyboard`), so their encoded form is cached by
+# identity and reused by all the messages carrying the same keyboard.
+
+_MAX_CACHED_KEYBOARDS = 64
+_keyboard_fragments: Dict[int, Tuple[InlineKeyboardMarkup, bytes]] = {}
+
+
+def _encode_str(value: str) -> bytes:
+    return _json.dumps(value, ensure_ascii=False).encode()
+
+
+def encode_keyboard(markup: InlineKeyboardMarkup) -> bytes:
+    cached = _keyboard_fragments.get(id(markup))
+    if cached is not None and cached[0] is markup:
+        return cached[1]
+
+    rows = b",".join(
+        b"[%s]"
+        % b",".join(
+            b'{"text":%s,"callback_data":%s}'
+            % (_encode_str(button.text), _encode_str(button.callback_data))
+            for button in row
+        )
+        for row in markup.inline_keyboard
+    )
+    fragment = b'{"inline_keyboard":[%s]}' % rows
+    if len(_keyboard_fragments) < _MAX_CACHED_KEYBOARDS:
+        # Keeping a reference to `markup` guarantees its id isn't reused.
+        _keyboard_fragments[id(markup)] = (markup, fragment)
+    return fragment
+
+
+def encode_send_message(payload: SendMessagePayload) -> bytes:
+    if payload.reply_markup is None:
+        return b'{"chat_id":%d,"text":%s}' % (
+            payload.chat_id,
+            _encode_str(payload.text),
+        )
+    return b'{"chat_id":%d,"text":%s,"reply_markup":%s}' % (
+        payload.chat_id,
+        _encode_str(payload.text),
+        encode_keyboard(payload.reply_markup),
+    )
+
+
+def encode_message_edit(payload: MessageEdit) -> bytes:
+    return b'{"chat_id":%d,"message_id":%d,"text":%s}' % (
+        payload.chat_id,
+        payload.message_id,
+        _encode_str(payload.text),
+    )
+
+
+@dataclass
+class HttpSessionConfig:
+    """Settings of the HTTP session `LiveTelegramClient` keeps open for its lifetime.
+
+    Attributes
+    ----------
+    pool_size : int
+        max number of simultaneously open connections
+    pool_size_per_host : int
+        max number of simultaneously open connections to the same host
+    dns_cache_ttl : int
+        seconds a resolved address of a host is reused
+    keepalive_timeout : float
+        seconds an idle connection is kept in the pool
+    connect_timeout : float
+        seconds allowed to establish a new connection
+    request_timeout : float
+        seconds allowed for a whole request, including reading the response
+    api_url : str
+        the Bot API server, e.g. a local stand-in for load testing
+    """
+
+    pool_size: int = 100
+    pool_size_per_host: int = 100
+    dns_cache_ttl: int = 300
+    keepalive_timeout: float = 60.0
+    connect_timeout: float = 10.0
+    request_timeout: float = 60.0
+    api_url: str = DEFAULT_API_URL
+
+
+@dataclass
+class ResilienceConfig:
+    """How `LiveTelegramClient` copes with failing requests.
+
+    Attributes
+    ----------
+    retry_policy : RetryPolicy
+        how failed requests are retried
+    circuit_breaker : CircuitBreaker
+        makes requests fail fast while Telegram is down
+    poll_circuit_breaker : CircuitBreaker
+        the same for `getUpdates`. A long poll takes up to its whole timeout, so
+        as the trial request of a half-open circuit it would hold off the other
+        requests for that long.
+    """
+
+    retry_policy: RetryPolicy = field(default_factory=RetryPolicy)
+    circuit_breaker: CircuitBreaker = field(
+        default_factory=lambda: CircuitBreaker("telegram")
+    )
+    poll_circuit_breaker: CircuitBreaker = field(
+        default_factory=lambda: CircuitBreaker("telegram-polling")
+    )
+
+
 class TelegramClient(ABC):
     """An interface for communicating with Telegram backend."""
 
     @abstractmethod
-    async def get_updates(self, offset: int = 0) -> List[Update]:
-        """Gets updates from the telegram with `update_id` bigger than `offset`."""
+    async def get_updates(
+        self, offset: int = 0, timeout: int = 0, limit: Optional[int] = None
+    ) -> List[Update]:
+        """Gets updates from the telegram with `update_id` bigger than `offset`.
+        If there are none, waits up to `timeout` seconds for them to arrive (long polling).
+        `limit` caps the number of returned updates."""
+
+    def updates(
+        self,
+        offset: int = 0,
+        timeout: int = DEFAULT_POLL_TIMEOUT,
+        limit: Optional[int] = DEFAULT_POLL_LIMIT,
+        auto_commit: bool = True,
+    ) -> "UpdateStream":
+        """Returns an async iterator over the updates with `update_id` bigger than `offset`."""
+
+        return UpdateStream(self, offset, timeout, limit, auto_commit)
 
     @abstractmethod
     async def send_message(self, payload: SendMessagePayload) -> int:
@@ -224,7 +535,8 @@ class TelegramClient(ABC):
 
     @abstractmethod
     async def edit_message_text(self, payload: MessageEdit) -> None:
-        """Edits the text of the selected message."""
+        """Edits the text of the selected message. An edit doesn't change the order of
+        the messages, so it may be done concurrently with sending new messages."""
 
     async def send_text(
         self,
@@ -235,113 +547,383 @@ class TelegramClient(ABC):
 
         return await self.send_message(SendMessagePayload(chat_id, text, reply_markup))
 
+    async def post_text(
+        self,
+        chat_id: int,
+        text: str,
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+    ) -> None:
+        """Sends a text when the id of the sent message isn't needed. Implementations
+        may deliver it later than the call returns, but before any following message."""
+
+        await self.send_text(chat_id, text, reply_markup)
+
+
+class UpdateStream:
+    """An async iterator over incoming updates backed by long polling.
+
+    The next batch is requested as soon as the current one arrives, so it is fetched
+    while the current one is still being processed. Telegram considers the updates
+    confirmed once a batch is requested with a bigger offset.
+
+    With `auto_commit` the updates are confirmed as soon as they are received.
+    Otherwise the consumer calls `commit` once the updates are handled. Until then
+    the unconfirmed updates are requested again, and the already returned ones are
+    skipped. A request that brings nothing new is repeated only after a commit.
+    """
+
+    def __init__(
+        self,
+        client: TelegramClient,
+        offset: int,
+        timeout: int,
+        limit: Optional[int],
+        auto_commit: bool = True,
+    ):  # pylint: disable=too-many-arguments
+        self._client = client
+        self._committed = offset
+        self._received = offset
+        self._timeout = timeout
+        self._limit = limit
+        self._auto_commit = auto_commit
+        self._batch: Deque[Update] = deque()
+        self._next_batch: Optional[asyncio.Task] = None
+        self._commit_event = asyncio.Event()
+
+    def __aiter__(self) -> "UpdateStream":
+        return self
+
+    async def __anext__(self) -> Update:
+        """Returns the next update. A failed request is reported by raising its exception;
+        the stream remains usable and retries on the next call."""
+
+        while not self._batch:
+            if self._next_batch is None:
+                self._prefetch(stale=False)
+            assert self._next_batch is not None
+            try:
+                batch = await self._next_batch
+            finally:
+                self._next_batch = None
+            fresh = [u for u in batch if u.update_id >= self._received]
+            if fresh:
+                self._received = fresh[-1].update_id + 1
+            if self._auto_commit:
+                self._committed = self._received
+            self._batch.extend(fresh)
+            self._prefetch(stale=bool(batch) and not fresh)
+        return self._batch.popleft()
+
+    async def next_batch(self) -> List[Update]:
+        """Returns all the received updates that are not returned yet. Waits for
+        a batch if there are none."""
+
+        batch = [await anext(self)]
+        batch.extend(self._batch)
+        self._batch.clear()
+        return batch
+
+    def commit(self, offset: int) -> None:
+        """Confirms all the updates with `update_id` smaller than `offset`."""
+
+        if offset > self._committed:
+            self._committed = offset
+            self._commit_event.set()
+
+    async def close(self) -> None:
+        """Cancels the request for the next batch if there is one in flight."""
+
+        if self._next_batch is not None:
+            self._next_batch.cancel()
+            try:
+                await self._next_batch
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._next_batch = None
+
+    def _prefetch(self, stale: bool) -> None:
+        self._next_batch = asyncio.create_task(self._fetch(stale))
+
+    async def _fetch(self, stale: bool) -> List[Update]:
+        if stale:
+            # Telegram would immediately return the same unconfirmed updates again.
+            await self._commit_event.wait()
+        self._commit_event.clear()
+        return await self._client.get_updates(
+            self._committed, self._timeout, self._limit
+        )
+
+
+@dataclass
+class _Request(Generic[T]):
+    """A request to the Bot API.
+
+    cls: the type of the response, None if the response is ignored
+    data: an already encoded JSON body
+    files: the files of a multipart body by the field name, as (file name, content)
+    extra_timeout: seconds the server may legitimately hold the request open
+        (e.g. long polling), added on top of the configured request timeout
+    idempotent: whether repeating the request has the same effect as making it
+        once. A non-idempotent request is retried only if it surely wasn't sent.
+    poll: whether it is a `getUpdates` request. These have a circuit breaker
+        of their own, see `ResilienceConfig`.
+    """
+
+    method: str
+    url: str
+    cls: Optional[Type[T]] = None
+    data: Optional[bytes] = None
+    files: Optional[Dict[str, Tuple[str, bytes]]] = None
+    extra_timeout: float = 0
+    idempotent: bool = True
+    poll: bool = False
+
+    def body(self) -> Union[bytes, aiohttp.FormData, None]:
+        """Returns the body to send. A form is built anew for every attempt, as it
+        can't be sent twice."""
+
+        if self.files is None:
+            return self.data
+        form = aiohttp.FormData()
+        for name, (file_name, content) in self.files.items():
+            form.add_field(name, content, filename=file_name)
+        return form
+
 
 class LiveTelegramClient(TelegramClient):
     """An implementation of the `TelegramClient` for communicating with an actual backend."""
 
-    def __init__(self, token: str) -> None:
+    def __init__(
+        self,
+        token: str,
+        session_config: Optional[HttpSessionConfig] = None,
+        send_scheduler: Optional["SendScheduler"] = None,
+        resilience: Optional[ResilienceConfig] = None,
+    ) -> None:
         """
         token -- Telegram bot token.
+        session_config -- settings of the pooled HTTP session.
+        send_scheduler -- if set, paces sent and edited messages to stay within
+            the Telegram flood limits.
+        resilience -- how failed requests are retried and cut off while Telegram
+            is down.
         """
         self._token = token
+        self._session_config = session_config or HttpSessionConfig()
+        self._base_url = f"{self._session_config.api_url.rstrip('/')}/bot{token}"
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._send_scheduler = send_scheduler
+        self._resilience = resilience or ResilienceConfig()
 
-    @staticmethod
-    def _request(
-        method: str,
-        url: str,
-        cls: Optional[Type[T]] = None,
-        files: Optional[dict] = None,
-        json: Optional[Any] = None,
-    ) -> Optional[T]:
-        try:
-            response = requests.request(method, url, files=files, json=json)
-            if cls is not None:
-                return jsons.load(
-                    response.json(), cls=cls, key_transformer=transform_keywords
-                )
-        except ConnectionError as exc:
-            raise NetworkException("Failed to establish a new connection.") from exc
-        except Exception as exc:
-            raise UnknownErrorException("Telegram request failed") from exc
+    @property
+    def send_scheduler(self) -> Optional["SendScheduler"]:
+        return self._send_scheduler
 
-        if response.status_code != 200:
-            raise UnexpectedStatusCodeException(response.status_code, response.reason)
-        return None
+    @property
+    def circuit_breaker(self) -> CircuitBreaker:
+        return self._resilience.circuit_breaker
+
+    async def open(self) -> None:
+        """Opens the HTTP session. Connections are kept alive and reused by all
+        requests until `close` is called."""
+
+        assert self._session is None, "The session is already opened"
+        conf = self._session_config
+        connector = aiohttp.TCPConnector(
+            limit=conf.pool_size,
+            limit_per_host=conf.pool_size_per_host,
+            ttl_dns_cache=conf.dns_cache_ttl,
+            keepalive_timeout=conf.keepalive_timeout,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(
+                total=conf.request_timeout, connect=conf.connect_timeout
+            ),
+        )
+        if self._send_scheduler is not None:
+            self._send_scheduler.start()
+
+    async def close(self) -> None:
+        if self._send_scheduler is not None:
+            await self._send_scheduler.close()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self) -> "LiveTelegramClient":
+        await self.open()
+        return self
 
-    def set_webhook(self, url: str, cert_path: Optional[str] = None) -> None:
+    async def __aexit__(self, *_exc_info) -> None:
+        await self.close()
+
+    async def set_webhook(self, url: str, cert_path: Optional[str] = None) -> None:
         fields = "allowed_updates=['message','callback_query','my_chat_member']"
-        if cert_path is None:
-            self._request(
-                "post",
-                f"https://api.telegram.org/bot{self._token}/setWebhook?url={url}&{fields}",
-            )
-        else:
+        request = _Request("post", f"{self._base_url}/setWebhook?url={url}&{fields}")
+        if cert_path is not None:
             cert = Path(cert_path)
-            with open(cert, encoding="utf-8") as cert:
-                files = {"certificate": cert}
-                self._request(
-                    "post",
-                    f"https://api.telegram.org/bot{self._token}/setWebhook?url={url}&{fields}",
-                    files=files,
-                )
-
-    def delete_webhook(self):
-        self._request(
-            "post", f"https://api.telegram.org/bot{self._token}/deleteWebhook"
-        )
+            # Read upfront so a retried request sends the certificate again.
+            request.files = {"certificate": (cert.name, cert.read_bytes())}
+        await self._async_request(request)
 
-    @staticmethod
-    async def _async_request(
-        method: str,
-        url: str,
-        cls: Optional[Type[T]] = None,
-        json: Optional[Any] = None,
-    ) -> Optional[T]:
+    async def delete_webhook(self) -> None:
+        await self._async_request(_Request("post", f"{self._base_url}/deleteWebhook"))
+
+    async def _async_request(self, request: "_Request[T]") -> Optional[T]:
+        """Makes `request`, retrying it after failures as allowed by the retry policy."""
+
+        breaker = (
+            self._resilience.poll_circuit_breaker
+            if request.poll
+            else self._resilience.circuit_breaker
+        )
+        retry = 0
+        while True:
+            trial = breaker.state == CircuitState.HALF_OPEN
+            if not breaker.allow_request():
+                raise CircuitOpenException()
+            try:
+                result = await self._async_request_once(request)
+            except TelegramException as exc:
+                if not self._should_retry(exc, retry, request, breaker):
+                    raise
+            else:
+                breaker.record_success()
+                return result
+            finally:
+                if trial:
+                    # A cancelled trial records no outcome and would keep
+                    # the circuit half-open for good.
+                    breaker.release_trial()
+            await asyncio.sleep(self._resilience.retry_policy.delay(retry))
+            retry += 1
+
+    async def _async_request_once(self, request: "_Request[T]") -> Optional[T]:
+        assert self._session is not None, "The session must be opened first"
+        timeout = aiohttp.ClientTimeout(
+            total=self._session_config.request_timeout + request.extra_timeout,
+            connect=self._session_config.connect_timeout,
+        )
         try:
-            async with aiohttp.ClientSession() as session:
-                response = await session.request(method, url, json=json)
-                if cls is not None:
-                    return jsons.load(
-                        await response.json(),
-                        cls=cls,
-                        key_transformer=transform_keywords,
+            # pylint: disable = not-async-context-manager
+            async with self._session.request(
+                request.method,
+                request.url,
+                data=request.body(),
+                headers=None if request.data is None else _JSON_HEADERS,
+                timeout=timeout,
+            ) as response:
+                if response.status == 429:
+                    raise TooManyRequestsException(
+                        await self._get_retry_after(response), response.reason or ""
+                    )
+                # Read the body so the connection goes back to the pool.
+                body = await response.read()
+                if response.status != 200:
+                    raise UnexpectedStatusCodeException(
+                        response.status, response.reason or ""
                     )
-        except ConnectionError as exc:
+                if request.cls is not None:
+                    return load_object(body, request.cls)
+        except TelegramException:
+            raise
+        except aiohttp.ClientConnectorError as exc:
+            # Only a failure to connect means the request wasn't sent. A connection
+            # reset later on may happen after Telegram got the request.
             raise NetworkException("Failed to establish a new connection.") from exc
         except Exception as exc:
             raise UnknownErrorException("Telegram request failed") from exc
-
-        if response.status != 200:
-            raise UnexpectedStatusCodeException(response.status, response.reason)
         return None
 
-    async def get_updates(self, offset: int = 0) -> List[Update]:
+    def _should_retry(
+        self,
+        exc: TelegramException,
+        retry: int,
+        request: "_Request",
+        breaker: CircuitBreaker,
+    ) -> bool:
+        """Records the failure `exc` and decides whether the request is worth repeating."""
+
+        if isinstance(exc, TooManyRequestsException):
+            # Telegram is up. Flood control is up to the callers, e.g. `SendScheduler`.
+            breaker.record_success()
+            return False
+        if isinstance(exc, UnexpectedStatusCodeException) and exc.status_code < 500:
+            # The request itself is wrong. Repeating it won't help.
+            breaker.record_success()
+            return False
+
+        breaker.record_failure()
+        if retry + 1 >= self._resilience.retry_policy.max_attempts:
+            return False
+        return request.idempotent or isinstance(exc, NetworkException)
+
+    @staticmethod
+    async def _get_retry_after(response: aiohttp.ClientResponse) -> float:
+        """Reads `retry_after` from the body of a 429 response.
+        https://core.telegram.org/bots/api#responseparameters"""
+
+        try:
+            body = await response.json()
+            return float(body["parameters"]["retry_after"])
+        except Exception:
+            return float(response.headers.get("Retry-After", 1))
+
+    async def get_updates(
+        self, offset: int = 0, timeout: int = 0, limit: Optional[int] = None
+    ) -> List[Update]:
         fields = "allowed_updates=['message','callback_query','my_chat_member']"
+        params = f"offset={offset}&timeout={timeout}"
+        if limit is not None:
+            params += f"&limit={limit}"
         response = await self._async_request(
-            "get",
-            f"https://api.telegram.org/bot{self._token}/getUpdates?offset={offset}&{fields}",
-            cls=GetUpdatesResponse,
+            _Request(
+                "get",
+                f"{self._base_url}/getUpdates?{params}&{fields}",
+                cls=GetUpdatesResponse,
+                extra_timeout=timeout,
+                poll=True,
+            )
         )
         if response is None:
             raise UnknownErrorException("Failed to get updates")
         return response.result
 
     async def send_message(self, payload: SendMessagePayload) -> int:
-        data = jsons.dump(payload, strip_nulls=True)
+        if self._send_scheduler is not None:
+            return await self._send_scheduler.submit(
+                payload.chat_id, lambda: self._send_message(payload)
+            )
+        return await self._send_message(payload)
+
+    async def _send_message(self, payload: SendMessagePayload) -> int:
         response = await self._async_request(
-            "post",
-            f"https://api.telegram.org/bot{self._token}/sendMessage",
-            cls=SendMessageResponse,
-            json=data,
+            _Request(
+                "post",
+                f"{self._base_url}/sendMessage",
+                cls=SendMessageResponse,
+                data=encode_send_message(payload),
+                idempotent=False,
+            )
         )
         if response is None:
             raise UnknownErrorException("Failed to get a response")
         return response.result.message_id
 
     async def edit_message_text(self, payload: MessageEdit) -> None:
-        data = jsons.dump(payload, strip_nulls=True)
+        if self._send_scheduler is not None:
+            await self._send_scheduler.submit(
+                payload.chat_id, lambda: self._edit_message_text(payload), ordered=False
+            )
+        else:
+            await self._edit_message_text(payload)
+
+    async def _edit_message_text(self, payload: MessageEdit) -> None:
         await self._async_request(
-            "post",
-            f"https://api.telegram.org/bot{self._token}/editMessageText",
-            json=data,
+            _Request(
+                "post",
+                f"{self._base_url}/editMessageText",
+                data=encode_message_edit(payload),
+            )
         )
@@ -0,0 +1,97 @@
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, List, Optional
+
+from telegram_client import (
+    InlineKeyboardMarkup,
+    MessageEdit,
+    SendMessagePayload,
+    TelegramClient,
+    Update,
+    encode_send_message,
+)
+
+
+class WebhookReply:
+    """The Bot API call to be returned in the body of a webhook response."""
+
+    def __init__(self) -> None:
+        self.payload: Optional[SendMessagePayload] = None
+
+    def to_bytes(self) -> Optional[bytes]:
+        """Encodes the call as a webhook response body.
+        https://core.telegram.org/bots/api#making-requests-when-getting-updates"""
+
+        if self.payload is None:
+            return None
+        return b'{"method":"sendMessage",' + encode_send_message(self.payload)[1:]
+
+
+_current_reply: ContextVar[Optional[WebhookReply]] = ContextVar(
+    "current_reply", default=None
+)
+
+
+class WebhookReplyClient(TelegramClient):
+    """A `TelegramClient` that returns the last message of an update inline in the
+    webhook response instead of sending it with a separate request.
+
+    Only messages sent with `post_text` can be returned inline, since Telegram doesn't
+    tell the bot the id of such a message. A message held for the reply is sent
+    separately as soon as any other message is sent after it, which keeps the order
+    of the messages in the chat. Edits don't affect the order and don't release
+    the held message.
+    """
+
+    def __init__(self, client: TelegramClient):
+        """
+        client -- the client used for everything that can't be returned inline.
+        """
+        self._client = client
+
+    @asynccontextmanager
+    async def collect(self) -> AsyncIterator[WebhookReply]:
+        """Collects the reply for the update handled within the context.
+        If the handling fails, the held message is sent separately."""
+
+        reply = WebhookReply()
+        token = _current_reply.set(reply)
+        try:
+            yield reply
+        except BaseException:
+            await self._flush()
+            raise
+        finally:
+            _current_reply.reset(token)
+
+    async def get_updates(
+        self, offset: int = 0, timeout: int = 0, limit: Optional[int] = None
+    ) -> List[Update]:
+        return await self._client.get_updates(offset, timeout, limit)
+
+    async def send_message(self, payload: SendMessagePayload) -> int:
+        await self._flush()
+        return await self._client.send_message(payload)
+
+    async def edit_message_text(self, payload: MessageEdit) -> None:
+        await self._client.edit_message_text(payload)
+
+    async def post_text(
+        self,
+        chat_id: int,
+        text: str,
+        reply_markup: Optional[InlineKeyboardMarkup] = None,
+    ) -> None:
+        reply = _current_reply.get()
+        if reply is None:
+            await self._client.post_text(chat_id, text, reply_markup)
+            return
+
+        await self._flush()
+        reply.payload = SendMessagePayload(chat_id, text, reply_markup)
+
+    async def _flush(self) -> None:
+        reply = _current_reply.get()
+        if reply is not None and reply.payload is not None:
+            payload, reply.payload = reply.payload, None
+            await self._client.send_message(payload)
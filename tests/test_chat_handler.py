@@ -1,8 +1,19 @@
 import pytest
 from test_greeting_state import make_conv_conf
-from tutils import QUESTIONS, bot_edit, bot_msg, check_conversation, user
+from tutils import (
+    QUESTIONS,
+    FakeTelegramClient,
+    bot_edit,
+    bot_msg,
+    check_conversation,
+    user,
+)
 
 import format as fmt
+from bot_state import BotStateFactory, IdleState
+from chat_handler import ChatHandler
+from storage import InMemoryStorage
+from telegram_client import Chat, Message, Update
 
 
 @pytest.mark.asyncio
@@ -34,3 +45,28 @@ async def test_entire_game():
             bot_msg("Starting game!"),
         ],
     )
+
+
+@pytest.mark.asyncio
+async def test_change_tracking():
+    client = FakeTelegramClient()
+    state_factory = BotStateFactory(client, InMemoryStorage(QUESTIONS))
+    handler = ChatHandler(IdleState(client, state_factory, True), 1)
+
+    async def process(text: str) -> bool:
+        await handler.process(Update(0, Message(Chat(1), text), None))
+        changed = handler.changed
+        handler.clear_changed()
+        return changed
+
+    assert not handler.changed
+    assert not await process("hi")
+    assert await process("/startGame")
+    assert not await process("what?")
+    assert await process("a")
+    assert await process("a")
+    assert await process("a")
+    assert isinstance(handler.state, IdleState)
+
+    created = await ChatHandler.create(await state_factory.make_greeting_state(), 2)
+    assert created.changed
@@ -0,0 +1,109 @@
+import asyncio
+from typing import Callable, Dict, List, Optional
+
+import pytest
+from tutils import FakeTelegramClient, RecordingStorage, make_update
+
+from bot_state import BotStateFactory
+from main import Bot, ClientConfig
+from resilience import RetryPolicy
+from telegram_client import SendMessagePayload, Update, UpdateStream
+
+
+class RecordingUpdateStream(UpdateStream):
+    def __init__(self, client: "PollingClient", *args):
+        super().__init__(client, *args)
+        self.commits = client.commits
+
+    def commit(self, offset: int) -> None:
+        self.commits.append(offset)
+        super().commit(offset)
+
+
+class PollingClient(FakeTelegramClient):
+    """Returns `batches` to the polling and holds the messages to the chats
+    in `gates` until their gate is set."""
+
+    def __init__(self, batches: List[List[Update]]):
+        super().__init__()
+        self.batches = batches
+        self.commits: List[int] = []
+        self.gates: Dict[int, asyncio.Event] = {}
+
+    async def delete_webhook(self) -> None:
+        pass
+
+    def updates(
+        self,
+        offset: int = 0,
+        timeout: int = 0,
+        limit: Optional[int] = None,
+        auto_commit: bool = True,
+    ) -> UpdateStream:
+        return RecordingUpdateStream(self, offset, timeout, limit, auto_commit)
+
+    async def get_updates(
+        self, offset: int = 0, timeout: int = 0, limit: Optional[int] = None
+    ) -> List[Update]:
+        if not self.batches:
+            await asyncio.Event().wait()
+        return self.batches.pop(0)
+
+    async def send_message(self, payload: SendMessagePayload) -> int:
+        gate = self.gates.get(payload.chat_id)
+        if gate is not None:
+            await gate.wait()
+        return await super().send_message(payload)
+
+
+async def wait_until(condition: Callable[[], bool]):
+    async def poll():
+        while not condition():
+            await asyncio.sleep(0.001)
+
+    await asyncio.wait_for(poll(), 1)
+
+
+def start_client_mode(client: PollingClient, storage: RecordingStorage):
+    bot = Bot(client, BotStateFactory(client, storage), storage)  # type: ignore
+    conf = ClientConfig(workers=4, poll_backoff=RetryPolicy(base_delay=0.01))
+    return asyncio.create_task(bot.run_client_mode(conf))
+
+
+@pytest.mark.asyncio
+async def test_offset_is_not_committed_past_running_update():
+    client = PollingClient([[make_update(1, 10), make_update(2, 20)]])
+    client.gates[20] = asyncio.Event()
+    storage = RecordingStorage()
+    run = start_client_mode(client, storage)
+
+    await wait_until(lambda: any(m.chat_id == 10 for m in client.sent_messages))
+    await asyncio.sleep(0.01)
+    assert not client.commits
+    assert not storage.writes
+
+    client.gates[20].set()
+    await wait_until(lambda: bool(client.commits))
+    assert client.commits == [3]
+    # The chats of the batch are written at once before the commit.
+    assert [sorted(write) for write in storage.writes] == [[10, 20]]
+    run.cancel()
+    await asyncio.gather(run, return_exceptions=True)
+
+
+@pytest.mark.asyncio
+async def test_offset_is_not_committed_past_unwritten_update():
+    client = PollingClient([[make_update(1, 10)]])
+    storage = RecordingStorage()
+    storage.fail_writes = True
+    run = start_client_mode(client, storage)
+
+    await wait_until(lambda: len(storage.writes) >= 2)
+    assert not client.commits
+
+    storage.fail_writes = False
+    await wait_until(lambda: bool(client.commits))
+    assert client.commits == [2]
+    assert await storage.get_chat_handler(10) is not None
+    run.cancel()
+    await asyncio.gather(run, return_exceptions=True)
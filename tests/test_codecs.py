@@ -5,9 +5,16 @@ from typing import Callable, Coroutine
 import pytest
 from tutils import QUESTIONS, FakeTelegramClient
 
-from bot_state import BotStateFactory
+from bot_state import BotStateFactory, GameState, IdleState, ProtoGameState
 from chat_handler import ChatHandler
-from custom_codecs import ChatHandlerDecoder, ChatHandlerEncoder
+from custom_codecs import (
+    BINARY_SNAPSHOT_MAGIC,
+    IDLE_SNAPSHOT,
+    BinarySnapshotCodec,
+    ChatHandlerDecoder,
+    ChatHandlerEncoder,
+    JsonSnapshotCodec,
+)
 from storage import InMemoryStorage
 
 
@@ -45,3 +52,128 @@ async def test_right_game_state_handler():
     asyncio.create_task(
         check_chat_handler_codecs(lambda factory: factory.make_game_state())
     )
+
+
+async def make_codec_handlers(make_codec):
+    client = FakeTelegramClient()
+    state_factory = BotStateFactory(client, InMemoryStorage(QUESTIONS))
+    handlers = [
+        await ChatHandler.create(await state_factory.make_greeting_state(), 111),
+        await ChatHandler.create(await state_factory.make_idle_state(), 222),
+        await ChatHandler.create(await state_factory.make_game_state(), -333),
+    ]
+    return make_codec(client, state_factory), handlers
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "make_codec",
+    [
+        JsonSnapshotCodec,
+        BinarySnapshotCodec,
+        lambda c, f: BinarySnapshotCodec(c, f, compress_min_size=0),
+        lambda c, f: BinarySnapshotCodec(c, f, compress_min_size=None),
+    ],
+)
+async def test_snapshot_codec_round_trip(make_codec):
+    codec, handlers = await make_codec_handlers(make_codec)
+    for handler in handlers:
+        assert codec.decode(codec.encode(handler)) == handler
+
+
+@pytest.mark.asyncio
+async def test_binary_codec_reads_legacy_json():
+    codec, handlers = await make_codec_handlers(BinarySnapshotCodec)
+    for handler in handlers:
+        legacy = json.dumps(handler, cls=ChatHandlerEncoder).encode()
+        assert codec.decode(legacy) == handler
+
+
+@pytest.mark.asyncio
+async def test_binary_snapshot_is_smaller():
+    codec, handlers = await make_codec_handlers(BinarySnapshotCodec)
+    client = FakeTelegramClient()
+    json_codec = JsonSnapshotCodec(
+        client, BotStateFactory(client, InMemoryStorage(QUESTIONS))
+    )
+    for handler in handlers:
+        snapshot = codec.encode(handler)
+        assert snapshot.startswith(BINARY_SNAPSHOT_MAGIC)
+        assert len(snapshot) < len(json_codec.encode(handler)) / 2
+
+
+@pytest.mark.asyncio
+async def test_unknown_binary_version():
+    codec, handlers = await make_codec_handlers(BinarySnapshotCodec)
+    snapshot = bytearray(codec.encode(handlers[0]))
+    snapshot[2] = 99
+    with pytest.raises(TypeError):
+        codec.decode(bytes(snapshot))
+
+
+@pytest.mark.asyncio
+async def test_game_snapshot_refers_to_questions():
+    codec, handlers = await make_codec_handlers(BinarySnapshotCodec)
+    snapshot = codec.encode(handlers[2])
+    assert len(snapshot) < 64
+    for question in QUESTIONS:
+        assert question.text.encode() not in snapshot
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("make_codec", [JsonSnapshotCodec, BinarySnapshotCodec])
+async def test_inline_questions_round_trip(make_codec):
+    client = FakeTelegramClient()
+    state_factory = BotStateFactory(client, InMemoryStorage(QUESTIONS))
+    handler = ChatHandler(
+        GameState(client, state_factory, ProtoGameState([], 1, 1, 5, QUESTIONS), True),
+        111,
+    )
+    codec = make_codec(client, state_factory)
+    assert codec.decode(codec.encode(handler)) == handler
+
+
+@pytest.mark.asyncio
+async def test_legacy_json_game():
+    client = FakeTelegramClient()
+    state_factory = BotStateFactory(client, InMemoryStorage(QUESTIONS))
+    legacy = {
+        "chat_id": 111,
+        "state": {
+            "state_name": "GameState",
+            "is_on_enter_called": True,
+            "game_params": {
+                "questions": [
+                    {"text": q.text, "answers": q.answers, "correct_answer": a}
+                    for q, a in zip(QUESTIONS, [1, 2, 3])
+                ],
+                "current_question": 1,
+                "score": 1,
+                "last_question_msg_id": 5,
+            },
+        },
+    }
+    handler = BinarySnapshotCodec(client, state_factory).decode(
+        json.dumps(legacy).encode()
+    )
+    assert isinstance(handler.state, GameState)
+    assert handler.state.game_params == ProtoGameState([], 1, 1, 5, QUESTIONS)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("make_codec", [JsonSnapshotCodec, BinarySnapshotCodec])
+async def test_sparse_idle(make_codec):
+    client = FakeTelegramClient()
+    state_factory = BotStateFactory(client, InMemoryStorage(QUESTIONS))
+    codec = make_codec(client, state_factory, sparse_idle=True)
+    idle = ChatHandler(IdleState(client, state_factory, True), 222)
+    assert codec.encode(idle) == IDLE_SNAPSHOT
+    assert codec.decode(IDLE_SNAPSHOT, 222) == idle
+    with pytest.raises(ValueError):
+        codec.decode(IDLE_SNAPSHOT)
+
+    _, handlers = await make_codec_handlers(make_codec)
+    for handler in (handlers[0], handlers[2]):
+        snapshot = codec.encode(handler)
+        assert snapshot != IDLE_SNAPSHOT
+        assert codec.decode(snapshot, handler.chat_id) == handler
@@ -0,0 +1,72 @@
+import json
+
+import jsons
+import pytest
+
+from telegram_client import GetUpdatesResponse, SendMessageResponse, Update, load_object
+from utils import transform_keywords
+
+PAYLOADS = [
+    (
+        Update,
+        {
+            "update_id": 1,
+            "message": {
+                "message_id": 3,
+                "date": 1650000000,
+                "chat": {"id": 111, "type": "private", "first_name": "Ann"},
+                "text": "/startGame",
+            },
+        },
+    ),
+    (
+        Update,
+        {
+            "update_id": "2",
+            "callback_query": {
+                "id": "77",
+                "from": {"id": 111, "is_bot": False},
+                "data": "b",
+            },
+        },
+    ),
+    (
+        Update,
+        {
+            "update_id": 3,
+            "my_chat_member": {
+                "chat": {"id": 111},
+                "new_chat_member": {"status": "kicked", "user": {"id": 1}},
+            },
+        },
+    ),
+    (Update, {"update_id": 4, "channel_post": {"chat": {"id": -5}, "text": 42}}),
+    (Update, {"update_id": 5, "message": None}),
+    (
+        GetUpdatesResponse,
+        {"ok": True, "result": [{"update_id": 6}, {"update_id": 7}]},
+    ),
+    (SendMessageResponse, {"ok": True, "result": {"message_id": 8, "date": 1}}),
+]
+
+MALFORMED = [
+    (Update, {}),
+    (Update, []),
+    (Update, {"update_id": 1, "message": {"chat": {"id": 5}}}),
+    (Update, {"update_id": 1, "message": "text"}),
+    (SendMessageResponse, {"ok": False}),
+]
+
+
+@pytest.mark.parametrize("cls, payload", PAYLOADS)
+def test_same_result_as_jsons(cls, payload):
+    expected = jsons.load(payload, cls=cls, key_transformer=transform_keywords)
+    assert load_object(json.dumps(payload).encode(), cls) == expected
+
+
+@pytest.mark.parametrize("cls, payload", MALFORMED)
+def test_same_error_as_jsons(cls, payload):
+    with pytest.raises(jsons.DeserializationError):
+        jsons.load(payload, cls=cls, key_transformer=transform_keywords)
+    with pytest.raises(jsons.DeserializationError):
+        load_object(json.dumps(payload), cls)
@@ -0,0 +1,77 @@
+import asyncio
+from typing import Dict, List
+
+import pytest
+from tutils import make_update
+
+from dispatcher import DispatcherFullException, UpdateDispatcher
+from telegram_client import Update
+
+
+class BlockingHandler:
+    def __init__(self):
+        self.handled: List[int] = []
+        self.gates: Dict[int, asyncio.Event] = {}
+
+    def gate(self, chat_id: int) -> asyncio.Event:
+        return self.gates.setdefault(chat_id, asyncio.Event())
+
+    async def __call__(self, update: Update):
+        await self.gate(update.chat_id).wait()
+        self.handled.append(update.update_id)
+
+
+@pytest.mark.asyncio
+async def test_chats_are_handled_concurrently_and_in_order():
+    handler = BlockingHandler()
+    async with UpdateDispatcher(handler, workers=4) as dispatcher:
+        for update_id, chat_id in [(1, 10), (2, 20), (3, 10), (4, 20)]:
+            await dispatcher.submit(make_update(update_id, chat_id))
+        handler.gate(20).set()
+        await asyncio.sleep(0.01)
+        assert handler.handled == [2, 4]
+
+        handler.gate(10).set()
+        await dispatcher.join()
+        assert handler.handled == [2, 4, 1, 3]
+
+
+@pytest.mark.asyncio
+async def test_offset_is_committed_only_past_handled_updates():
+    handler = BlockingHandler()
+    commits: List[int] = []
+    async with UpdateDispatcher(handler, on_commit=commits.append) as dispatcher:
+        for update_id, chat_id in [(1, 10), (2, 20), (3, 30)]:
+            await dispatcher.submit(make_update(update_id, chat_id))
+        handler.gate(20).set()
+        handler.gate(30).set()
+        await asyncio.sleep(0.01)
+        assert dispatcher.committed_offset == 1
+
+        handler.gate(10).set()
+        await dispatcher.join()
+        assert dispatcher.committed_offset == 4
+        assert commits == [1, 4]
+
+
+@pytest.mark.asyncio
+async def test_full_dispatcher_rejects_updates():
+    handler = BlockingHandler()
+    async with UpdateDispatcher(handler, max_pending=1) as dispatcher:
+        dispatcher.submit_nowait(make_update(1, 10))
+        with pytest.raises(DispatcherFullException):
+            dispatcher.submit_nowait(make_update(2, 20))
+
+
+@pytest.mark.asyncio
+async def test_duplicate_update_is_handled_once():
+    handler = BlockingHandler()
+    async with UpdateDispatcher(handler) as dispatcher:
+        dispatcher.submit_nowait(make_update(1, 10))
+        dispatcher.submit_nowait(make_update(1, 10))
+        assert dispatcher.pending == 1
+        handler.gate(10).set()
+        await dispatcher.join()
+        dispatcher.submit_nowait(make_update(2, 10))
+        await dispatcher.join()
+        assert handler.handled == [1, 2]
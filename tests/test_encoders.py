@@ -0,0 +1,45 @@
+import json
+
+import jsons
+import pytest
+from tutils import QUESTIONS
+
+import format as fmt
+from telegram_client import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    MessageEdit,
+    SendMessagePayload,
+    encode_message_edit,
+    encode_send_message,
+)
+
+PAYLOADS = [
+    SendMessagePayload(111, "Starting game!"),
+    SendMessagePayload(
+        -111, fmt.make_question(QUESTIONS[1]), fmt.make_keyboard(QUESTIONS[1])
+    ),
+    SendMessagePayload(
+        111,
+        'Quotes " and \\ and\nnew lines, ✅',
+        InlineKeyboardMarkup(((InlineKeyboardButton('"x"', "ü"),),)),
+    ),
+]
+
+
+@pytest.mark.parametrize("payload", PAYLOADS)
+def test_send_message_is_encoded_as_jsons_does(payload):
+    expected = jsons.dump(payload, strip_nulls=True)
+    assert json.loads(encode_send_message(payload)) == expected
+    # The second time the keyboard comes from the cache.
+    assert json.loads(encode_send_message(payload)) == expected
+
+
+def test_message_edit_is_encoded_as_jsons_does():
+    payload = MessageEdit(111, 5, fmt.make_answered_question(1, QUESTIONS[0]))
+    expected = jsons.dump(payload, strip_nulls=True)
+    assert json.loads(encode_message_edit(payload)) == expected
+
+
+def test_keyboards_are_shared():
+    assert fmt.make_keyboard(QUESTIONS[1]) is fmt.make_keyboard(QUESTIONS[2])
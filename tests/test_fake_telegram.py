@@ -0,0 +1,89 @@
+import asyncio
+import random
+import socket
+
+import pytest
+from tutils import QUESTIONS
+
+from bot_state import BotStateFactory
+from main import Bot
+from resilience import RetryPolicy
+from scripts.fake_telegram import FakeTelegramConfig, serve
+from storage import InMemoryStorage
+from telegram_client import (
+    HttpSessionConfig,
+    LiveTelegramClient,
+    ResilienceConfig,
+    TelegramException,
+)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+async def play(api_url: str):
+    """Plays with the simulated users like the client mode does."""
+
+    async with LiveTelegramClient(
+        "token",
+        HttpSessionConfig(api_url=api_url),
+        resilience=ResilienceConfig(RetryPolicy(2, base_delay=0.01)),
+    ) as client:
+        storage = InMemoryStorage(QUESTIONS)
+        bot = Bot(client, BotStateFactory(client, storage), storage)
+        offset = 0
+        while True:
+            try:
+                updates = await client.get_updates(offset, timeout=1)
+            except TelegramException:
+                await asyncio.sleep(0.01)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                try:
+                    await bot.handle_update(update)
+                except TelegramException:
+                    pass
+
+
+async def run(conf: FakeTelegramConfig, chats: int, deadline: float):
+    random.seed(1)
+    port = free_port()
+    bot = asyncio.create_task(play(f"http://localhost:{port}"))
+    try:
+        return await serve(conf, chats, 2, "localhost", port, deadline)
+    finally:
+        bot.cancel()
+
+
+@pytest.mark.asyncio
+async def test_users_finish_games():
+    summary = await run(FakeTelegramConfig(), 5, deadline=30)
+    assert summary["unfinished"] == 0
+    assert summary["abandoned"] == 0
+    assert summary["sent"] > 0
+
+
+@pytest.mark.asyncio
+async def test_lost_replies_are_resent():
+    conf = FakeTelegramConfig(error_rate=0.2, reply_timeout=0.2)
+    summary = await run(conf, 5, deadline=30)
+    assert summary["resent"] > 0
+    assert summary["unfinished"] == 0
+
+
+@pytest.mark.asyncio
+async def test_users_give_up_without_replies():
+    conf = FakeTelegramConfig(error_rate=1.0, reply_timeout=0.05)
+    summary = await run(conf, 5, deadline=30)
+    assert summary["abandoned"] == 5
+    assert summary["resent"] == 5 * conf.max_resends
+
+
+@pytest.mark.asyncio
+async def test_run_stops_at_deadline():
+    summary = await run(FakeTelegramConfig(error_rate=1.0), 5, deadline=0.5)
+    assert summary["unfinished"] == 5
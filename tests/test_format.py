@@ -12,13 +12,13 @@ from telegram_client import InlineKeyboardButton, InlineKeyboardMarkup
 
 def test_keyboard():
     expected_keyboard = InlineKeyboardMarkup(
-        inline_keyboard=[
-            [
+        inline_keyboard=(
+            (
                 InlineKeyboardButton(text="a", callback_data="a"),
                 InlineKeyboardButton(text="b", callback_data="b"),
                 InlineKeyboardButton(text="c", callback_data="c"),
-            ]
-        ]
+            ),
+        )
     )
 
     formed_keyboard = make_keyboard(
@@ -12,10 +12,22 @@ from tutils import (
 )
 
 import format as fmt
-from bot_state import BotStateFactory, GameState, ProtoGameState
+from bot_state import (
+    BotStateFactory,
+    GameState,
+    ProtoGameState,
+    QuestionNotFoundException,
+)
 from chat_handler import ChatHandler
 from storage import InMemoryStorage
-from telegram_client import CallbackQuery, MessageEdit, SendMessagePayload, Update, User
+from telegram_client import (
+    CallbackQuery,
+    MessageEdit,
+    SendMessagePayload,
+    UnexpectedStatusCodeException,
+    Update,
+    User,
+)
 
 
 async def make_conv_conf(game_params: Optional[ProtoGameState] = None):
@@ -142,7 +154,7 @@ async def test_game_score_for_deserialized_state():
     cur_score = 1
     prev_message_id = 0
     await check_conversation(
-        await make_conv_conf(ProtoGameState(QUESTIONS, 2, cur_score, prev_message_id)),
+        await make_conv_conf(ProtoGameState([1, 2, 3], 2, cur_score, prev_message_id)),
         [
             user("d"),  # correct answer for question 2 (0-based)
             bot_edit(fmt.make_answered_question(3, QUESTIONS[2])),
@@ -152,3 +164,49 @@ async def test_game_score_for_deserialized_state():
             ),
         ],
     )
+
+
+@pytest.mark.asyncio
+async def test_game_with_inline_questions():
+    await check_conversation(
+        await make_conv_conf(ProtoGameState([], 1, 0, 0, questions=QUESTIONS)),
+        [
+            user("c"),
+            bot_edit(fmt.make_answered_question(2, QUESTIONS[1])),
+            bot_msg(fmt.make_question(QUESTIONS[2]), fmt.make_keyboard(QUESTIONS[2])),
+        ],
+    )
+
+
+@pytest.mark.asyncio
+async def test_missing_question():
+    conf = await make_conv_conf(ProtoGameState([1, 42], 0, 0, 0))
+    with pytest.raises(QuestionNotFoundException):
+        await conf.chat_handler.process(
+            Update(0, None, CallbackQuery(User(conf.chat_id), "a"))
+        )
+    assert not conf.client.sent_messages
+
+
+class FailingEditClient(FakeTelegramClient):
+    async def edit_message_text(self, payload: MessageEdit) -> None:
+        raise UnexpectedStatusCodeException(400, "message is not modified")
+
+
+@pytest.mark.asyncio
+async def test_failed_edit_does_not_fail_answer():
+    client = FailingEditClient()
+    state_factory = BotStateFactory(client, InMemoryStorage(QUESTIONS))
+    state = GameState(client, state_factory, ProtoGameState([1, 2, 3], 0, 0, 7), True)
+    state.clear_changed()
+
+    new_state = await state.process(Update(0, None, CallbackQuery(User(111), "b")))
+
+    assert new_state is state and state.changed
+    assert state.game_params.current_question == 1
+    assert state.game_params.score == 1
+    assert client.sent_messages == [
+        SendMessagePayload(
+            111, fmt.make_question(QUESTIONS[1]), fmt.make_keyboard(QUESTIONS[1])
+        )
+    ]
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+from tutils import RecordingStorage
+
+from group_commit import GroupCommitStorage
+
+
+@pytest.mark.asyncio
+async def test_concurrent_writes_are_grouped():
+    storage = RecordingStorage(write_delay=0.01)
+    group_commit = GroupCommitStorage(storage, window=0.01)
+    await asyncio.gather(
+        *(group_commit.set_chat_handler(i, bytes([i])) for i in range(10))
+    )
+    assert storage.writes == [{i: bytes([i]) for i in range(10)}]
+    assert await storage.get_chat_handler(3) == b"\x03"
+
+
+@pytest.mark.asyncio
+async def test_writes_during_write_go_to_next_batch():
+    storage = RecordingStorage(write_delay=0.01)
+    group_commit = GroupCommitStorage(storage, window=0)
+    first = asyncio.create_task(group_commit.set_chat_handler(1, b"a"))
+    await asyncio.sleep(0.005)
+    await asyncio.gather(
+        group_commit.set_chat_handler(2, b"b"),
+        group_commit.set_chat_handler(3, b"c"),
+        first,
+    )
+    assert storage.writes == [{1: b"a"}, {2: b"b", 3: b"c"}]
+
+
+@pytest.mark.asyncio
+async def test_max_batch():
+    storage = RecordingStorage(write_delay=0.01)
+    group_commit = GroupCommitStorage(storage, window=10, max_batch=2)
+    await asyncio.wait_for(
+        asyncio.gather(
+            *(group_commit.set_chat_handler(i, b"x") for i in range(3)),
+            group_commit.close(),
+        ),
+        1,
+    )
+    assert [len(w) for w in storage.writes] == [2, 1]
+
+
+@pytest.mark.asyncio
+async def test_failed_write_is_reported_to_every_caller():
+    storage = RecordingStorage(write_delay=0.01)
+    storage.fail_writes = True
+    group_commit = GroupCommitStorage(storage)
+    results = await asyncio.gather(
+        group_commit.set_chat_handler(1, b"a"),
+        group_commit.set_chat_handler(2, b"b"),
+        return_exceptions=True,
+    )
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert group_commit.pending_count == 0
+
+
+@pytest.mark.asyncio
+async def test_delete_drops_pending_write():
+    storage = RecordingStorage(write_delay=0.01)
+    group_commit = GroupCommitStorage(storage, window=0.01)
+    write = asyncio.create_task(group_commit.set_chat_handler(1, b"a"))
+    await asyncio.sleep(0)
+    await group_commit.del_chat_handler(1)
+    await write
+    await group_commit.close()
+    assert not storage.writes
+    assert await storage.get_chat_handler(1) is None
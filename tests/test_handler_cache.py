@@ -0,0 +1,253 @@
+from typing import Tuple
+
+import pytest
+from tutils import FakeTelegramClient, RecordingStorage, make_update
+
+from bot_state import BotStateFactory, GreetingState, IdleState
+from chat_handler import ChatHandler
+from custom_codecs import BinarySnapshotCodec
+from handler_cache import ChatHandlerCache, Durability, HandlerCacheConfig
+
+
+def make_cache(
+    storage: RecordingStorage, **kwargs
+) -> Tuple[ChatHandlerCache, BotStateFactory]:
+    client = FakeTelegramClient()
+    state_factory = BotStateFactory(client, storage)
+    cache = ChatHandlerCache(
+        storage,
+        BinarySnapshotCodec(client, state_factory),
+        HandlerCacheConfig(**kwargs),
+    )
+    return cache, state_factory
+
+
+async def store(
+    storage: RecordingStorage, state_factory: BotStateFactory, handler: ChatHandler
+):
+    codec = BinarySnapshotCodec(state_factory.client, state_factory)
+    await storage.set_chat_handler(handler.chat_id, codec.encode(handler))
+    storage.calls.clear()
+
+
+@pytest.mark.asyncio
+async def test_cached_handler_is_not_reloaded():
+    storage = RecordingStorage()
+    cache, state_factory = make_cache(storage)
+    await store(
+        storage,
+        state_factory,
+        ChatHandler(GreetingState(FakeTelegramClient(), state_factory, True), 1),
+    )
+
+    handler = await cache.get(1)
+    assert handler is not None
+    await handler.process(make_update(0, 1, "hi"))
+    assert isinstance(handler.state, IdleState)
+    await cache.put(1, handler)
+    assert await cache.get(1) is handler
+    await cache.put(1, handler)
+    assert storage.calls == [("get", 1)]
+
+    await cache.flush()
+    assert storage.calls == [("get", 1), ("set", 1)]
+    assert cache.dirty_count == 0
+
+
+@pytest.mark.asyncio
+async def test_unchanged_handler_is_not_written():
+    storage = RecordingStorage()
+    cache, state_factory = make_cache(storage)
+    await store(
+        storage,
+        state_factory,
+        ChatHandler(IdleState(FakeTelegramClient(), state_factory, True), 1),
+    )
+
+    handler = await cache.get(1)
+    assert handler is not None
+    await handler.process(make_update(0, 1, "hi"))
+    await cache.put(1, handler)
+    await cache.close()
+    assert storage.calls == [("get", 1)]
+
+
+@pytest.mark.asyncio
+async def test_missing_handler():
+    storage = RecordingStorage()
+    cache, state_factory = make_cache(storage)
+    assert await cache.get(1) is None
+    await cache.put(
+        1, await ChatHandler.create(await state_factory.make_idle_state(), 1)
+    )
+    await cache.close()
+    assert await storage.get_chat_handler(1) is not None
+
+
+@pytest.mark.asyncio
+async def test_write_through():
+    storage = RecordingStorage()
+    cache, state_factory = make_cache(storage, durability=Durability.WRITE_THROUGH)
+    await cache.get(1)
+    await cache.put(
+        1, await ChatHandler.create(await state_factory.make_idle_state(), 1)
+    )
+    assert storage.calls == [("get", 1), ("set", 1)]
+    assert cache.dirty_count == 0
+
+
+@pytest.mark.asyncio
+async def test_eviction_writes_changes_first():
+    storage = RecordingStorage()
+    cache, state_factory = make_cache(storage, capacity=1)
+    for chat_id in (1, 2):
+        await cache.get(chat_id)
+        await cache.put(
+            chat_id,
+            await ChatHandler.create(await state_factory.make_idle_state(), chat_id),
+        )
+    # Both handlers are changed, so none can be evicted yet.
+    assert len(cache) == 2
+
+    await cache.flush()
+    assert len(cache) == 1
+    assert await storage.get_chat_handler(1) is not None
+    storage.calls.clear()
+    assert await cache.get(2) is not None
+    assert not storage.calls
+
+
+@pytest.mark.asyncio
+async def test_handler_in_use_is_not_written():
+    storage = RecordingStorage()
+    cache, state_factory = make_cache(storage)
+    await cache.get(1)
+    handler = await ChatHandler.create(await state_factory.make_idle_state(), 1)
+    await cache.put(1, handler)
+    assert await cache.get(1) is handler
+    await cache.flush()
+    assert ("set", 1) not in storage.calls
+
+    await cache.put(1, handler)
+    await cache.flush()
+    assert ("set", 1) in storage.calls
+
+
+@pytest.mark.asyncio
+async def test_discard_reloads_written_handler():
+    storage = RecordingStorage()
+    cache, state_factory = make_cache(storage)
+    await store(
+        storage,
+        state_factory,
+        await ChatHandler.create(await state_factory.make_idle_state(), 1),
+    )
+
+    handler = await cache.get(1)
+    assert handler is not None
+    await handler.process(make_update(0, 1, "/startGame"))
+    cache.discard(1)
+    assert len(cache) == 0
+
+    reloaded = await cache.get(1)
+    assert reloaded is not None
+    assert isinstance(reloaded.state, IdleState)
+    assert storage.calls == [("get", 1), ("get", 1)]
+
+
+@pytest.mark.asyncio
+async def test_discard_restores_unwritten_changes():
+    storage = RecordingStorage()
+    cache, state_factory = make_cache(storage)
+    await store(
+        storage,
+        state_factory,
+        ChatHandler(await state_factory.make_greeting_state(), 1),
+    )
+
+    await cache.get(1)
+    handler = await ChatHandler.create(await state_factory.make_idle_state(), 1)
+    await cache.put(1, handler)
+    assert await cache.get(1) is handler
+    await handler.process(make_update(0, 1, "/startGame"))
+    assert not isinstance(handler.state, IdleState)
+    cache.discard(1)
+    assert cache.dirty_count == 1
+
+    restored = await cache.get(1)
+    assert restored is not None
+    assert restored is not handler
+    assert isinstance(restored.state, IdleState)
+    cache.discard(1)
+    await cache.flush()
+    assert storage.calls == [("get", 1), ("set", 1)]
+    snapshot = await storage.get_chat_handler(1)
+    assert snapshot is not None
+    codec = BinarySnapshotCodec(state_factory.client, state_factory)
+    assert isinstance(codec.decode(snapshot, 1).state, IdleState)
+
+
+@pytest.mark.asyncio
+async def test_delete():
+    storage = RecordingStorage()
+    cache, state_factory = make_cache(storage)
+    await cache.get(1)
+    await cache.put(
+        1, await ChatHandler.create(await state_factory.make_idle_state(), 1)
+    )
+    await cache.delete(1)
+    await cache.close()
+    assert len(cache) == 0
+    assert await storage.get_chat_handler(1) is None
+
+
+@pytest.mark.asyncio
+async def test_flush_writes_changes_at_once():
+    storage = RecordingStorage()
+    cache, state_factory = make_cache(storage)
+    for chat_id in (1, 2, 3):
+        await cache.get(chat_id)
+        await cache.put(
+            chat_id,
+            await ChatHandler.create(await state_factory.make_idle_state(), chat_id),
+        )
+    await cache.flush()
+    assert [sorted(write) for write in storage.writes] == [[1, 2, 3]]
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_changes():
+    storage = RecordingStorage()
+    cache, state_factory = make_cache(storage)
+    for chat_id in (1, 2):
+        await cache.get(chat_id)
+        await cache.put(
+            chat_id,
+            await ChatHandler.create(await state_factory.make_idle_state(), chat_id),
+        )
+    storage.fail_writes = True
+    await cache.flush()
+    assert cache.dirty_count == 2
+
+    storage.fail_writes = False
+    await cache.flush()
+    assert cache.dirty_count == 0
+    assert await storage.get_chat_handler(2) is not None
+
+
+@pytest.mark.asyncio
+async def test_unchanged_handlers_are_evicted():
+    storage = RecordingStorage()
+    cache, state_factory = make_cache(
+        storage, capacity=1, durability=Durability.WRITE_THROUGH
+    )
+    for chat_id in (1, 2, 3):
+        await store(
+            storage,
+            state_factory,
+            ChatHandler(await state_factory.make_idle_state(), chat_id),
+        )
+        handler = await cache.get(chat_id)
+        assert handler is not None
+        await cache.put(chat_id, handler)
+    assert len(cache) == 1
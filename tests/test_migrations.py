@@ -0,0 +1,103 @@
+from contextlib import asynccontextmanager, contextmanager
+from typing import List, Optional, Tuple
+
+import pytest
+
+from migrations import MIGRATIONS, migrate_connection, migrate_sync, pending_migrations
+
+
+class RecordingConnection:
+    """Records the executed statements. The schema is at `version`."""
+
+    def __init__(self, version: int):
+        self.version = version
+        self.executed: List[Tuple[str, Optional[tuple]]] = []
+        self.transactions = 0
+
+    def record(self, query: str, params: Optional[tuple]) -> tuple:
+        self.executed.append((" ".join(query.split()), params))
+        return (self.version,)
+
+
+class FakeCursor:
+    def __init__(self, row: tuple):
+        self.row = row
+
+    def fetchone(self) -> tuple:
+        return self.row
+
+
+class FakeConnection(RecordingConnection):
+    @contextmanager
+    def transaction(self):
+        self.transactions += 1
+        yield
+
+    def execute(self, query: str, params: Optional[tuple] = None) -> FakeCursor:
+        return FakeCursor(self.record(query, params))
+
+
+class AsyncFakeCursor:
+    def __init__(self, row: tuple):
+        self.row = row
+
+    async def fetchone(self) -> tuple:
+        return self.row
+
+
+class AsyncFakeConnection(RecordingConnection):
+    @asynccontextmanager
+    async def transaction(self):
+        self.transactions += 1
+        yield
+
+    async def execute(
+        self, query: str, params: Optional[tuple] = None
+    ) -> AsyncFakeCursor:
+        return AsyncFakeCursor(self.record(query, params))
+
+
+def expected_statements(version: int) -> List[Tuple[str, Optional[tuple]]]:
+    statements = []
+    for migration in pending_migrations(version):
+        statements += [(" ".join(str(s).split()), None) for s in migration.statements]
+        statements.append(
+            (
+                "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                (migration.version, migration.description),
+            )
+        )
+    return statements
+
+
+def test_versions_are_consecutive():
+    assert [m.version for m in MIGRATIONS] == list(range(1, len(MIGRATIONS) + 1))
+
+
+def test_pending_migrations():
+    assert pending_migrations(0) == MIGRATIONS
+    assert pending_migrations(1) == MIGRATIONS[1:]
+    assert not pending_migrations(len(MIGRATIONS))
+
+
+def test_migrate_applies_pending_migrations_in_order():
+    conn = FakeConnection(1)
+    assert migrate_sync(conn) == len(MIGRATIONS) - 1  # type: ignore
+    assert conn.transactions == 1
+    assert conn.executed[0][0] == "SELECT pg_advisory_xact_lock(4242)"
+    assert conn.executed[2][0].startswith("SELECT coalesce(max(version), 0)")
+    assert conn.executed[3:] == expected_statements(1)
+
+
+def test_migrate_up_to_date_schema():
+    conn = FakeConnection(len(MIGRATIONS))
+    assert migrate_sync(conn) == 0  # type: ignore
+    assert len(conn.executed) == 3
+
+
+@pytest.mark.asyncio
+async def test_migrate_connection():
+    conn = AsyncFakeConnection(0)
+    assert await migrate_connection(conn) == len(MIGRATIONS)  # type: ignore
+    assert conn.transactions == 1
+    assert conn.executed[3:] == expected_statements(0)
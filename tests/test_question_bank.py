@@ -0,0 +1,99 @@
+from typing import AsyncIterator, Hashable, Tuple
+
+import pytest
+from tutils import QUESTIONS
+
+from question_bank import QuestionBankBuilder, QuestionBankStorage
+from storage import InMemoryStorage, Question
+
+
+def make_bank():
+    builder = QuestionBankBuilder()
+    builder.add(3, QUESTIONS[0])
+    builder.add(10, QUESTIONS[1])
+    builder.add(11, QUESTIONS[2])
+    return builder.build()
+
+
+def test_get_question():
+    bank = make_bank()
+    assert len(bank) == 3
+    assert bank.get_question(3) == QUESTIONS[0]
+    assert bank.get_question(11) == QUESTIONS[2]
+    assert bank.get_question(4) is None
+    assert bank.get_question(12) is None
+
+
+def test_get_questions():
+    bank = make_bank()
+    questions = bank.get_questions(2)
+    assert len(questions) == 2
+    assert questions[0] != questions[1]
+    assert all(q in QUESTIONS for q in questions)
+    assert len(bank.get_questions(10)) == 3
+
+
+def test_get_question_ids():
+    bank = make_bank()
+    ids = bank.get_question_ids(2)
+    assert len(set(ids)) == 2
+    assert set(ids) <= {3, 10, 11}
+    assert sorted(bank.get_question_ids(10)) == [3, 10, 11]
+
+
+def test_answers_are_shared():
+    builder = QuestionBankBuilder()
+    builder.add(1, Question("A?", ["True", "False"], 0))
+    builder.add(2, Question("B?", ["True", "False"], 1))
+    bank = builder.build()
+    first, second = bank.get_question(1), bank.get_question(2)
+    assert first is not None and second is not None
+    assert first.answers[0] is second.answers[0]
+
+
+def test_ids_must_ascend():
+    builder = QuestionBankBuilder()
+    builder.add(2, QUESTIONS[0])
+    with pytest.raises(ValueError):
+        builder.add(2, QUESTIONS[1])
+
+
+class VersionedStorage(InMemoryStorage):
+    def __init__(self):
+        super().__init__(QUESTIONS)
+        self.questions = list(QUESTIONS)
+        self.version = 0
+
+    async def get_all_questions(self) -> AsyncIterator[Tuple[int, Question]]:
+        for question_id, question in enumerate(self.questions, 1):
+            yield question_id, question
+
+    async def get_questions_version(self) -> Hashable:
+        return self.version
+
+
+@pytest.mark.asyncio
+async def test_storage_refresh():
+    storage = VersionedStorage()
+    async with QuestionBankStorage(storage) as bank_storage:
+        assert len(bank_storage.bank) == 3
+        assert not await bank_storage.refresh()
+
+        storage.questions.append(Question("New?", ["yes", "no"], 0))
+        storage.version += 1
+        old_bank = bank_storage.bank
+        assert await bank_storage.refresh()
+        assert len(bank_storage.bank) == 4
+        assert len(old_bank) == 3
+        assert bank_storage.bank.get_question(4) == Question("New?", ["yes", "no"], 0)
+
+
+@pytest.mark.asyncio
+async def test_storage_delegates_chat_handlers():
+    storage = VersionedStorage()
+    async with QuestionBankStorage(storage) as bank_storage:
+        await bank_storage.set_chat_handler(1, b"handler")
+        assert await storage.get_chat_handler(1) == b"handler"
+        assert await bank_storage.get_chat_handler(1) == b"handler"
+        await bank_storage.del_chat_handler(1)
+        assert await storage.get_chat_handler(1) is None
@@ -0,0 +1,37 @@
+import pytest
+
+from question_sampler import QuestionSampler
+
+
+def test_dense_ids():
+    sampler = QuestionSampler.from_stats(5, 14, 10)
+    assert len(sampler) == 10
+    ids = sampler.sample(5)
+    assert len(set(ids)) == 5
+    assert all(5 <= i <= 14 for i in ids)
+
+
+def test_sparse_ids_are_rejected():
+    with pytest.raises(ValueError):
+        QuestionSampler.from_stats(1, 20, 10)
+
+
+def test_sparse_ids():
+    sampler = QuestionSampler.from_ids([3, 17, 42, 1000])
+    assert sorted(sampler.sample(10)) == [3, 17, 42, 1000]
+
+
+def test_empty():
+    assert not QuestionSampler.from_stats(0, 0, 0).sample(5)
+
+
+def test_exclude():
+    sampler = QuestionSampler.from_stats(1, 6, 6)
+    for _ in range(20):
+        ids = sampler.sample(3, exclude={1, 2, 3})
+        assert sorted(ids) == [4, 5, 6]
+
+
+def test_staleness():
+    assert QuestionSampler(range(3), max_age=0).stale
+    assert not QuestionSampler(range(3)).stale
@@ -0,0 +1,180 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+import pytest
+from psycopg import OperationalError
+from psycopg_pool import PoolTimeout
+from tutils import QUESTIONS
+
+from storage import PostgresStorage, Question
+
+
+class FakeCursor:
+    def __init__(self, rows: List[tuple]):
+        self.rows = rows
+
+    async def fetchall(self) -> List[tuple]:
+        return self.rows
+
+    async def fetchone(self) -> Optional[tuple]:
+        return self.rows[0] if self.rows else None
+
+
+class FakeConnection:
+    def __init__(self, pool: "FakePool"):
+        self.pool = pool
+
+    @asynccontextmanager
+    async def pipeline(self):
+        yield
+
+    @asynccontextmanager
+    async def transaction(self):
+        yield
+
+    async def execute(self, query: str, params: tuple = (), prepare: bool = False):
+        del prepare
+        return FakeCursor(self.pool.run(query, params))
+
+
+class FakePool:
+    """Answers the question and lag queries of `PostgresStorage`."""
+
+    def __init__(self, questions: List[Question], lag: Optional[float] = 0.0):
+        self.questions = questions
+        self.lag = lag
+        self.error: Optional[Exception] = None
+        self.gate: Optional[asyncio.Event] = None
+        # The question queries that got a connection.
+        self.reads = 0
+        self.waiting = 0
+
+    @asynccontextmanager
+    async def connection(self):
+        if self.error is not None:
+            raise self.error
+        if self.gate is not None:
+            self.waiting += 1
+            await self.gate.wait()
+        yield FakeConnection(self)
+
+    def run(self, query: str, params: tuple) -> List[tuple]:
+        if "pg_last_wal_replay_lsn" in query:
+            return [(self.lag,)]
+        self.reads += 1
+        if "min(id)" in query:
+            return [(1, len(self.questions), len(self.questions))]
+        return [
+            (question_id, question.text, answer, i == question.correct_answer)
+            for question_id in params[0]
+            if question_id <= len(self.questions)
+            for question in [self.questions[question_id - 1]]
+            for i, answer in enumerate(question.answers)
+        ]
+
+
+def make_storage(primary: FakePool, *replicas: FakePool) -> PostgresStorage:
+    return PostgresStorage(
+        primary,  # type: ignore
+        question_cache_size=0,
+        replica_pools=replicas,  # type: ignore
+        replica_check_interval=1000,
+    )
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_replica_is_used_after_check():
+    primary, replica = FakePool(QUESTIONS), FakePool(QUESTIONS)
+    storage = make_storage(primary, replica)
+    assert await storage.get_question(1) == QUESTIONS[0]
+    assert (primary.reads, replica.reads) == (1, 0)
+
+    await settle()
+    assert await storage.get_question(2) == QUESTIONS[1]
+    assert (primary.reads, replica.reads) == (1, 1)
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_lagging_replica_is_skipped():
+    primary, replica = FakePool(QUESTIONS), FakePool(QUESTIONS, lag=60)
+    storage = make_storage(primary, replica)
+    await storage.get_question(1)
+    await settle()
+    await storage.get_question(2)
+    assert (primary.reads, replica.reads) == (2, 0)
+    await storage.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("error", [OperationalError("down"), PoolTimeout("busy")])
+async def test_failed_replica_falls_back_to_primary(error: Exception):
+    primary, replica = FakePool(QUESTIONS), FakePool(QUESTIONS)
+    storage = make_storage(primary, replica)
+    await storage.get_question(1)
+    await settle()
+
+    replica.error = error
+    assert await storage.get_question(2) == QUESTIONS[1]
+    assert primary.reads == 2
+    # The replica isn't used until the next check.
+    replica.error = None
+    await storage.get_question(3)
+    assert (primary.reads, replica.reads) == (3, 0)
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_least_active_replica_is_picked():
+    replicas = [FakePool(QUESTIONS), FakePool(QUESTIONS)]
+    storage = make_storage(FakePool(QUESTIONS), *replicas)
+    await storage.get_question(1)
+    await settle()
+
+    gate = asyncio.Event()
+    for replica in replicas:
+        replica.gate = gate
+    slow = asyncio.create_task(storage.get_question(1))
+    await settle()
+    busy, idle = sorted(replicas, key=lambda replica: -replica.waiting)
+    assert busy.waiting == 1
+    idle.gate = None
+
+    # The rotation alone would send every other query to the busy replica.
+    for question_id in (1, 2, 3, 1):
+        await storage.get_question(question_id)
+    assert (busy.reads, idle.reads) == (0, 4)
+    gate.set()
+    await slow
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_question_missing_on_replica_is_read_on_primary():
+    primary, replica = FakePool(QUESTIONS), FakePool(QUESTIONS[:1])
+    storage = make_storage(primary, replica)
+    await storage.get_question(1)
+    await settle()
+
+    assert await storage.get_question(3) == QUESTIONS[2]
+    assert (primary.reads, replica.reads) == (2, 1)
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_close_cancels_checks():
+    replica = FakePool(QUESTIONS)
+    replica.gate = asyncio.Event()
+    storage = make_storage(FakePool(QUESTIONS), replica)
+    await storage.get_question(1)
+    await settle()
+    assert replica.waiting == 1
+
+    await storage.close()
+    assert asyncio.all_tasks() == {asyncio.current_task()}
@@ -0,0 +1,60 @@
+from contextlib import contextmanager
+from typing import List
+
+from scripts.reshard import group_moved_chats, move_chats
+from sharded_storage import shard_index
+
+
+def test_group_moved_chats():
+    hosts = ["a", "b", "c"]
+    chat_ids = [chat_id for chat_id in range(100) if shard_index(chat_id, 2) == 1]
+    moved = group_moved_chats(chat_ids, "b", hosts)
+    assert list(moved) == ["c"]
+    assert moved["c"] == [
+        chat_id for chat_id in chat_ids if shard_index(chat_id, 3) == 2
+    ]
+
+
+def test_chats_of_reused_host_stay():
+    # The previous shard is the new first one.
+    moved = group_moved_chats(range(100), "a", ["a", "b"])
+    assert list(moved) == ["b"]
+    assert all(shard_index(chat_id, 2) == 1 for chat_id in moved["b"])
+
+
+class FakeConnection:
+    """Records the statements and transactions of a connection to `log`."""
+
+    def __init__(self, name: str, log: List[str], rows: List[tuple]):
+        self.name = name
+        self.log = log
+        self.rows = rows
+
+    @contextmanager
+    def transaction(self):
+        self.log.append(f"{self.name}: BEGIN")
+        yield
+        self.log.append(f"{self.name}: COMMIT")
+
+    def execute(self, query: str, _params: tuple):
+        self.log.append(f"{self.name}: {query.split()[0]}")
+        return self
+
+    def fetchall(self) -> List[tuple]:
+        return self.rows
+
+
+def test_chats_stay_locked_until_copied():
+    log: List[str] = []
+    source = FakeConnection("source", log, [(1, b"x"), (2, b"y")])
+    target = FakeConnection("target", log, [])
+    assert move_chats(source, target, [1, 2, 3]) == 2  # type: ignore
+    assert log == [
+        "source: BEGIN",
+        "source: SELECT",
+        "target: BEGIN",
+        "target: INSERT",
+        "target: COMMIT",
+        "source: DELETE",
+        "source: COMMIT",
+    ]
@@ -0,0 +1,202 @@
+import asyncio
+import time
+from pathlib import Path
+from typing import List, Union
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from resilience import CircuitBreaker, CircuitState, RetryPolicy
+from telegram_client import (
+    CircuitOpenException,
+    HttpSessionConfig,
+    LiveTelegramClient,
+    MessageEdit,
+    NetworkException,
+    ResilienceConfig,
+    SendMessagePayload,
+    UnexpectedStatusCodeException,
+    UnknownErrorException,
+)
+
+
+def test_retry_delay_is_bounded():
+    policy = RetryPolicy(base_delay=1, max_delay=5)
+    assert all(0 <= policy.delay(0) <= 1 for _ in range(100))
+    assert all(0 <= policy.delay(retry) <= 5 for retry in range(2000))
+
+
+def test_circuit_opens_after_failures_and_recovers():
+    transitions: List[CircuitState] = []
+    breaker = CircuitBreaker(
+        "test",
+        2,
+        reset_timeout=0.01,
+        on_state_change=lambda _, s: transitions.append(s),
+    )
+    breaker.record_failure()
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+    assert not breaker.allow_request()
+
+    time.sleep(0.01)
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+    breaker.record_success()
+
+    assert breaker.state == CircuitState.CLOSED
+    assert transitions == [
+        CircuitState.OPEN,
+        CircuitState.HALF_OPEN,
+        CircuitState.CLOSED,
+    ]
+
+
+def test_failed_trial_opens_circuit_again():
+    breaker = CircuitBreaker("test", 1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.01)
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+
+
+class FakeTelegram:
+    """A local Bot API server answering the requests with the given responses:
+    an HTTP status, "reset" to drop the connection once the request is read, or
+    "slow" to answer after a while."""
+
+    def __init__(self, responses: List[Union[int, str]]):
+        self.responses = responses
+        self.requests: List[str] = []
+        self.bodies: List[bytes] = []
+        app = web.Application()
+        app.router.add_route("*", "/{path:.*}", self._handle)
+        self.server = TestServer(app)
+
+    async def __aenter__(self) -> "FakeTelegram":
+        await self.server.start_server()
+        return self
+
+    async def __aexit__(self, *_exc_info) -> None:
+        await self.server.close()
+
+    def client(self, **kwargs) -> LiveTelegramClient:
+        return LiveTelegramClient(
+            "token",
+            HttpSessionConfig(api_url=str(self.server.make_url("/"))),
+            resilience=ResilienceConfig(RetryPolicy(3, base_delay=0.001), **kwargs),
+        )
+
+    async def _handle(self, request: web.Request) -> web.StreamResponse:
+        self.bodies.append(await request.read())
+        self.requests.append(request.path.rsplit("/", 1)[-1])
+        response = self.responses.pop(0) if self.responses else 200
+        if response == "slow":
+            await asyncio.sleep(0.2)
+        if response == "reset":
+            assert request.transport is not None
+            request.transport.close()
+            return web.Response()
+        if response != 200:
+            return web.Response(status=int(response))
+        return web.json_response({"ok": True, "result": {"message_id": 1}})
+
+
+def make_message() -> SendMessagePayload:
+    return SendMessagePayload(111, "Hello")
+
+
+@pytest.mark.asyncio
+async def test_idempotent_request_is_retried():
+    async with FakeTelegram([500, "reset"]) as telegram:
+        async with telegram.client() as client:
+            await client.edit_message_text(MessageEdit(111, 1, "Hello"))
+    assert telegram.requests == ["editMessageText"] * 3
+
+
+@pytest.mark.asyncio
+async def test_non_idempotent_request_is_not_retried_if_maybe_sent():
+    async with FakeTelegram(["reset"]) as telegram:
+        async with telegram.client() as client:
+            with pytest.raises(UnknownErrorException):
+                await client.send_message(make_message())
+    assert telegram.requests == ["sendMessage"]
+
+
+@pytest.mark.asyncio
+async def test_non_idempotent_request_is_retried_if_not_sent():
+    async with FakeTelegram([]) as telegram:
+        # Nothing listens on the port once the server is closed.
+        client = telegram.client()
+    async with client:
+        with pytest.raises(NetworkException):
+            await client.send_message(make_message())
+    assert client.circuit_breaker.failures == 3
+
+
+@pytest.mark.asyncio
+async def test_client_error_is_not_retried():
+    async with FakeTelegram([400]) as telegram:
+        async with telegram.client() as client:
+            with pytest.raises(UnexpectedStatusCodeException):
+                await client.edit_message_text(MessageEdit(111, 1, "Hello"))
+    assert telegram.requests == ["editMessageText"]
+
+
+@pytest.mark.asyncio
+async def test_open_circuit_fails_fast():
+    async with FakeTelegram([500] * 3) as telegram:
+        async with telegram.client(circuit_breaker=CircuitBreaker("test", 3)) as client:
+            for _ in range(3):
+                with pytest.raises(UnexpectedStatusCodeException):
+                    await client.send_message(make_message())
+            with pytest.raises(CircuitOpenException):
+                await client.send_message(make_message())
+    assert telegram.requests == ["sendMessage"] * 3
+
+
+def half_open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker("test", 1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == CircuitState.HALF_OPEN
+    return breaker
+
+
+@pytest.mark.asyncio
+async def test_cancelled_trial_lets_another_request_try():
+    breaker = half_open_breaker()
+    async with FakeTelegram(["slow"]) as telegram:
+        async with telegram.client(circuit_breaker=breaker) as client:
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(
+                    client.edit_message_text(MessageEdit(111, 1, "Hello")), 0.05
+                )
+            await client.edit_message_text(MessageEdit(111, 1, "Hello"))
+    assert breaker.state == CircuitState.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_long_poll_is_not_a_trial_request():
+    breaker = half_open_breaker()
+    async with FakeTelegram(["slow"]) as telegram:
+        async with telegram.client(circuit_breaker=breaker) as client:
+            poll = asyncio.create_task(client.get_updates(timeout=30))
+            while not telegram.requests:
+                await asyncio.sleep(0.01)
+            await asyncio.wait_for(client.send_message(make_message()), 0.1)
+            assert breaker.state == CircuitState.CLOSED
+            poll.cancel()
+
+
+@pytest.mark.asyncio
+async def test_webhook_certificate_is_sent_again_on_retry(tmp_path: Path):
+    cert = tmp_path / "cert.pem"
+    cert.write_bytes(b"certificate")
+    async with FakeTelegram([500]) as telegram:
+        async with telegram.client() as client:
+            await client.set_webhook("https://example.com", str(cert))
+    assert telegram.requests == ["setWebhook"] * 2
+    assert all(b"certificate" in body for body in telegram.bodies)
@@ -0,0 +1,127 @@
+import asyncio
+import time
+from typing import List
+
+import pytest
+
+from send_scheduler import RateLimits, SendScheduler, SendSchedulerClosedException
+from telegram_client import TooManyRequestsException
+
+
+@pytest.mark.asyncio
+async def test_messages_of_chat_are_sent_in_order():
+    scheduler = SendScheduler(RateLimits(chat_rate=1000, chat_burst=1))
+    scheduler.start()
+    sent: List[int] = []
+
+    async def send(i: int):
+        await asyncio.sleep(0.001 * (5 - i))
+        sent.append(i)
+        return i
+
+    results = await asyncio.gather(
+        *(scheduler.submit(111, lambda i=i: send(i)) for i in range(5))
+    )
+    await scheduler.close()
+
+    assert results == list(range(5))
+    assert sent == list(range(5))
+    assert scheduler.stats().sent == 5
+
+
+@pytest.mark.asyncio
+async def test_chat_rate_is_limited():
+    scheduler = SendScheduler(RateLimits(chat_rate=50, chat_burst=1))
+    scheduler.start()
+
+    async def send():
+        return time.monotonic()
+
+    times = await asyncio.gather(*(scheduler.submit(111, send) for _ in range(3)))
+    await scheduler.close()
+
+    assert times[2] - times[0] >= 2 / 50 * 0.9
+    assert scheduler.stats().max_wait > 0
+
+
+@pytest.mark.asyncio
+async def test_chats_take_turns():
+    scheduler = SendScheduler(RateLimits(global_rate=1000, global_burst=1))
+    scheduler.start()
+    sent: List[int] = []
+
+    async def send(chat_id: int):
+        sent.append(chat_id)
+
+    await asyncio.gather(
+        *(scheduler.submit(chat_id, lambda c=chat_id: send(c)) for chat_id in [1, 1, 2])
+    )
+    await scheduler.close()
+
+    assert sent == [1, 2, 1]
+
+
+@pytest.mark.asyncio
+async def test_throttled_message_is_sent_again():
+    scheduler = SendScheduler()
+    scheduler.start()
+    attempts: List[float] = []
+
+    async def send():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise TooManyRequestsException(0.02, "Too Many Requests")
+        return 42
+
+    assert await scheduler.submit(111, send) == 42
+    await scheduler.close()
+
+    assert attempts[1] - attempts[0] >= 0.02 * 0.9
+    assert scheduler.stats().throttled == 1
+
+
+@pytest.mark.asyncio
+async def test_unordered_message_does_not_wait_for_message_in_flight():
+    scheduler = SendScheduler()
+    scheduler.start()
+    sent_gate = asyncio.Event()
+    events: List[str] = []
+
+    async def send():
+        await sent_gate.wait()
+        events.append("send")
+
+    async def edit():
+        events.append("edit")
+        sent_gate.set()
+
+    await asyncio.gather(
+        scheduler.submit(111, send), scheduler.submit(111, edit, ordered=False)
+    )
+    await scheduler.close()
+
+    assert events == ["edit", "send"]
+
+
+@pytest.mark.asyncio
+async def test_close_fails_queued_messages():
+    scheduler = SendScheduler(RateLimits(chat_burst=1))
+    scheduler.start()
+    sent_gate = asyncio.Event()
+
+    async def send():
+        await sent_gate.wait()
+        return "sent"
+
+    in_flight = asyncio.create_task(scheduler.submit(111, send))
+    queued = asyncio.create_task(scheduler.submit(111, send))
+    await asyncio.sleep(0.01)
+    closing = asyncio.create_task(scheduler.close())
+    await asyncio.sleep(0.01)
+    sent_gate.set()
+    await closing
+
+    assert await in_flight == "sent"
+    with pytest.raises(SendSchedulerClosedException):
+        await queued
+    assert scheduler.queue_depth == 0
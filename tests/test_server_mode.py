@@ -0,0 +1,111 @@
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+import pytest
+from tutils import QUESTIONS, FakeTelegramClient, make_update, make_update_body
+
+from bot_state import BotStateFactory
+from dispatcher import UpdateDispatcher
+from main import Bot, drain
+from storage import InMemoryStorage
+from telegram_client import Update
+
+
+def make_bot(client: Optional[FakeTelegramClient] = None) -> Bot:
+    client = client or FakeTelegramClient()
+    storage = InMemoryStorage(QUESTIONS)
+    return Bot(client, BotStateFactory(client, storage), storage)  # type: ignore
+
+
+async def post(app, body: bytes) -> Tuple[int, Dict[str, str]]:
+    """Posts `body` to the webhook through the ASGI interface of `app`."""
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/handleUpdate",
+        "raw_path": b"/handleUpdate",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/json")],
+        "client": ("telegram", 1),
+        "server": ("bot", 80),
+    }
+    requests = [{"type": "http.request", "body": body, "more_body": False}]
+    sent: List[dict] = []
+
+    async def receive():
+        return requests.pop(0) if requests else {"type": "http.disconnect"}
+
+    async def send(message: dict):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    headers = {k.decode(): v.decode() for k, v in sent[0]["headers"]}
+    return sent[0]["status"], headers
+
+
+class GatedHandler:
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.handled: List[int] = []
+
+    async def __call__(self, update: Update):
+        await self.gate.wait()
+        self.handled.append(update.update_id)
+
+
+@pytest.mark.asyncio
+async def test_ack_fast_responds_before_handling():
+    handler = GatedHandler()
+    async with UpdateDispatcher(handler) as dispatcher:
+        app = make_bot().make_app(dispatcher)
+        status, _ = await asyncio.wait_for(post(app, make_update_body(1, 111)), 1)
+        assert status == 200
+        assert not handler.handled
+
+        handler.gate.set()
+        await dispatcher.join()
+        assert handler.handled == [1]
+
+
+@pytest.mark.asyncio
+async def test_ack_fast_asks_to_retry_when_full():
+    handler = GatedHandler()
+    async with UpdateDispatcher(handler, max_pending=1) as dispatcher:
+        app = make_bot().make_app(dispatcher)
+        assert (await post(app, make_update_body(1, 111)))[0] == 200
+        status, headers = await post(app, make_update_body(2, 222))
+        assert status == 503
+        assert headers["retry-after"] == "1"
+        handler.gate.set()
+
+
+@pytest.mark.asyncio
+async def test_inline_handling_responds_after_handling():
+    client = FakeTelegramClient()
+    status, _ = await post(make_bot(client).make_app(), make_update_body(1, 111))
+    assert status == 200
+    assert client.sent_messages
+
+
+@pytest.mark.asyncio
+async def test_drain_waits_for_queued_updates():
+    handler = GatedHandler()
+    async with UpdateDispatcher(handler) as dispatcher:
+        await dispatcher.submit(make_update(1, 111))
+        asyncio.get_running_loop().call_later(0.01, handler.gate.set)
+        await drain(dispatcher, timeout=1)
+        assert handler.handled == [1]
+
+
+@pytest.mark.asyncio
+async def test_drain_gives_up_after_timeout():
+    handler = GatedHandler()
+    async with UpdateDispatcher(handler) as dispatcher:
+        await dispatcher.submit(make_update(1, 111))
+        await drain(dispatcher, timeout=0.01)
+        assert dispatcher.pending == 1
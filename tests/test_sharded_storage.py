@@ -0,0 +1,149 @@
+from collections import Counter
+from typing import Dict, List, Optional
+
+import pytest
+from tutils import QUESTIONS
+
+from sharded_storage import ShardedStorage, shard_index
+from storage import InMemoryStorage
+
+
+def make_shards(count: int) -> List[InMemoryStorage]:
+    return [InMemoryStorage(QUESTIONS) for _ in range(count)]
+
+
+def test_shard_index_is_stable():
+    assert [shard_index(chat_id, 4) for chat_id in (1, 42, -1001234567890)] == [
+        shard_index(chat_id, 4) for chat_id in (1, 42, -1001234567890)
+    ]
+    assert all(shard_index(chat_id, 1) == 0 for chat_id in range(100))
+
+
+def test_shard_index_spreads_chats():
+    counts = Counter(shard_index(chat_id, 4) for chat_id in range(10000))
+    assert sorted(counts) == [0, 1, 2, 3]
+    assert all(2000 < count < 3000 for count in counts.values())
+
+
+def test_new_shard_moves_few_chats():
+    moved = [
+        chat_id
+        for chat_id in range(10000)
+        if shard_index(chat_id, 4) != shard_index(chat_id, 5)
+    ]
+    assert 1500 < len(moved) < 2500
+    assert all(shard_index(chat_id, 5) == 4 for chat_id in moved)
+
+
+@pytest.mark.asyncio
+async def test_chat_handlers_are_routed():
+    shards = make_shards(3)
+    storage = ShardedStorage(shards)
+    for chat_id in range(30):
+        await storage.set_chat_handler(chat_id, bytes([chat_id]))
+    for chat_id in range(30):
+        shard = shards[shard_index(chat_id, 3)]
+        assert await shard.get_chat_handler(chat_id) == bytes([chat_id])
+        assert await storage.get_chat_handler(chat_id) == bytes([chat_id])
+
+    await storage.del_chat_handler(7)
+    assert await storage.get_chat_handler(7) is None
+
+
+@pytest.mark.asyncio
+async def test_bulk_chat_handlers_are_routed():
+    shards = make_shards(3)
+    storage = ShardedStorage(shards)
+    await storage.set_chat_handlers({chat_id: b"x" for chat_id in range(30)})
+    for chat_id in range(30):
+        assert await shards[shard_index(chat_id, 3)].get_chat_handler(chat_id) == b"x"
+    assert await storage.get_chat_handlers([1, 2, 100]) == {1: b"x", 2: b"x"}
+
+
+@pytest.mark.asyncio
+async def test_resharding():
+    old_shards = make_shards(2)
+    old_storage = ShardedStorage(old_shards)
+    await old_storage.set_chat_handlers({chat_id: b"old" for chat_id in range(30)})
+    # Adds a shard, the old ones stay.
+    storage = ShardedStorage(old_shards + make_shards(1), old_shards)
+    moved = [chat_id for chat_id in range(30) if shard_index(chat_id, 3) == 2]
+    assert moved
+
+    assert await storage.get_chat_handler(moved[0]) == b"old"
+    assert await storage.get_chat_handlers(list(range(30))) == {
+        chat_id: b"old" for chat_id in range(30)
+    }
+
+    await storage.set_chat_handler(moved[0], b"new")
+    await storage.set_chat_handlers({moved[1]: b"new"})
+    for chat_id in moved[:2]:
+        assert await old_storage.get_chat_handler(chat_id) is None
+        assert await storage.get_chat_handler(chat_id) == b"new"
+
+    await storage.del_chat_handler(moved[2])
+    assert await storage.get_chat_handler(moved[2]) is None
+
+
+class MovingShard(InMemoryStorage):
+    """An old shard whose chats are moved to `target` by `scripts.reshard` right
+    after they are read."""
+
+    def __init__(self, target: InMemoryStorage):
+        super().__init__(QUESTIONS)
+        self.target = target
+
+    async def get_chat_handler(self, chat_id: int) -> Optional[bytes]:
+        await self.get_chat_handlers([chat_id])
+        return None
+
+    async def get_chat_handlers(self, chat_ids: List[int]) -> Dict[int, bytes]:
+        snapshots = await super().get_chat_handlers(chat_ids)
+        await self.target.set_chat_handlers(snapshots)
+        for chat_id in snapshots:
+            await self.del_chat_handler(chat_id)
+        return {}
+
+
+@pytest.mark.asyncio
+async def test_chat_moved_between_reads_is_found():
+    new_shard = InMemoryStorage(QUESTIONS)
+    old_shard = MovingShard(new_shard)
+    storage = ShardedStorage([old_shard, new_shard], [old_shard])
+    moved = [chat_id for chat_id in range(30) if shard_index(chat_id, 2) == 1]
+    await old_shard.set_chat_handlers({chat_id: b"old" for chat_id in moved[:3]})
+
+    assert await storage.get_chat_handler(moved[0]) == b"old"
+    assert await storage.get_chat_handlers(moved[1:]) == {
+        moved[1]: b"old",
+        moved[2]: b"old",
+    }
+
+
+class DeletionLog(InMemoryStorage):
+    def __init__(self, name: str, log: List[str]):
+        super().__init__(QUESTIONS)
+        self.name = name
+        self.log = log
+
+    async def del_chat_handler(self, chat_id: int):
+        self.log.append(self.name)
+        await super().del_chat_handler(chat_id)
+
+
+@pytest.mark.asyncio
+async def test_deletion_goes_to_old_shard_first():
+    log: List[str] = []
+    old_shard = DeletionLog("old", log)
+    storage = ShardedStorage([old_shard, DeletionLog("new", log)], [old_shard])
+    moved = next(chat_id for chat_id in range(30) if shard_index(chat_id, 2) == 1)
+    await storage.del_chat_handler(moved)
+    # The old shard holds the lock of `scripts.reshard` until the copy is committed.
+    assert log == ["old", "new"]
+
+
+@pytest.mark.asyncio
+async def test_questions_are_read_from_first_shard():
+    storage = ShardedStorage([InMemoryStorage(QUESTIONS), InMemoryStorage([])])
+    assert await storage.get_questions(5) == QUESTIONS
+    assert await storage.get_question(1) == QUESTIONS[0]
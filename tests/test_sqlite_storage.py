@@ -0,0 +1,118 @@
+import sqlite3
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from sqlite_storage import SqliteStorage, connect
+from storage import Question
+
+# The answers are sorted, as the storage returns them in this order.
+QUESTIONS = [
+    Question("What is the color of sky?", ["blue", "green", "orange"], 0),
+    Question("How much is 2 + 5?", ["10", "4", "7", "8"], 2),
+    Question("What date is Christmas?", ["Apr 15", "Dec 24", "Dec 25", "Jan 1"], 2),
+]
+
+
+def populate(path: Path, questions: List[Question], first_id: int = 1):
+    conn = connect(str(path))
+    for question_id, question in enumerate(questions, first_id):
+        conn.execute(
+            "INSERT INTO questions (id, question) VALUES (?, ?)",
+            (question_id, question.text),
+        )
+        conn.executemany(
+            "INSERT INTO answers (question_id, text, is_correct) VALUES (?, ?, ?)",
+            [
+                (question_id, answer, i == question.correct_answer)
+                for i, answer in enumerate(question.answers)
+            ],
+        )
+    conn.close()
+
+
+@pytest.mark.asyncio
+async def test_chat_handlers(tmp_path: Path):
+    async with SqliteStorage(str(tmp_path / "bot.db")) as storage:
+        assert await storage.get_chat_handler(1) is None
+        await storage.set_chat_handler(1, b"a")
+        await storage.set_chat_handler(1, b"b")
+        assert await storage.get_chat_handler(1) == b"b"
+        await storage.del_chat_handler(1)
+        assert await storage.get_chat_handler(1) is None
+
+
+@pytest.mark.asyncio
+async def test_bulk_chat_handlers(tmp_path: Path):
+    async with SqliteStorage(str(tmp_path / "bot.db")) as storage:
+        await storage.set_chat_handlers({1: b"a", 2: b"", 3: b"c"})
+        assert await storage.get_chat_handlers([1, 2, 4]) == {1: b"a", 2: b""}
+        assert await storage.get_chat_handlers([]) == {}
+
+
+@pytest.mark.asyncio
+async def test_chat_handlers_persist(tmp_path: Path):
+    path = str(tmp_path / "bot.db")
+    async with SqliteStorage(path) as storage:
+        await storage.set_chat_handler(1, b"a")
+    async with SqliteStorage(path) as storage:
+        assert await storage.get_chat_handler(1) == b"a"
+
+
+@pytest.mark.asyncio
+async def test_wal_mode(tmp_path: Path):
+    path = str(tmp_path / "bot.db")
+    async with SqliteStorage(path):
+        with sqlite3.connect(path) as conn:
+            assert conn.execute("PRAGMA journal_mode").fetchone() == ("wal",)
+
+
+@pytest.mark.asyncio
+async def test_questions(tmp_path: Path):
+    path = tmp_path / "bot.db"
+    populate(path, QUESTIONS)
+    async with SqliteStorage(str(path)) as storage:
+        ids = await storage.get_question_ids(2)
+        assert len(set(ids)) == 2
+        assert [await storage.get_question(i) for i in ids] == [
+            QUESTIONS[i - 1] for i in ids
+        ]
+        assert sorted(await storage.get_questions(5), key=QUESTIONS.index) == QUESTIONS
+        assert await storage.get_question(4) is None
+        assert [q async for q in storage.get_all_questions()] == list(
+            enumerate(QUESTIONS, 1)
+        )
+
+
+@pytest.mark.asyncio
+async def test_sparse_question_ids(tmp_path: Path):
+    path = tmp_path / "bot.db"
+    populate(path, QUESTIONS[:1])
+    populate(path, QUESTIONS[1:], first_id=10)
+    async with SqliteStorage(str(path)) as storage:
+        assert sorted(await storage.get_question_ids(5)) == [1, 10, 11]
+
+
+@pytest.mark.asyncio
+async def test_questions_version_changes(tmp_path: Path):
+    path = tmp_path / "bot.db"
+    async with SqliteStorage(str(path)) as storage:
+        version = await storage.get_questions_version()
+        assert await storage.get_questions(5) == []
+        populate(path, QUESTIONS)
+        assert await storage.get_questions_version() != version
+
+
+@pytest.mark.asyncio
+async def test_sampled_questions_are_cached(tmp_path: Path):
+    path = tmp_path / "bot.db"
+    populate(path, QUESTIONS)
+    async with SqliteStorage(str(path)) as storage:
+        ids = await storage.get_question_ids(3)
+        with sqlite3.connect(path) as conn:
+            conn.execute("DELETE FROM answers")
+            conn.execute("DELETE FROM questions")
+        assert [await storage.get_question(i) for i in ids] == [
+            QUESTIONS[i - 1] for i in ids
+        ]
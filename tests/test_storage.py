@@ -0,0 +1,206 @@
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+import pytest
+from tutils import QUESTIONS
+
+from storage import (
+    BatchStorage,
+    InMemoryStorage,
+    PostgresQuestionRecord,
+    PostgresStorage,
+    Question,
+    QuestionCache,
+    group_question_records,
+)
+
+
+def test_group_question_records():
+    records = [
+        PostgresQuestionRecord(1, "2 + 2?", "3", False),
+        PostgresQuestionRecord(1, "2 + 2?", "4", True),
+        PostgresQuestionRecord(7, "Sky?", "blue", True),
+        PostgresQuestionRecord(7, "Sky?", "green", False),
+        PostgresQuestionRecord(7, "Sky?", "red", False),
+    ]
+    assert group_question_records(records) == [
+        Question("2 + 2?", ["3", "4"], 1),
+        Question("Sky?", ["blue", "green", "red"], 0),
+    ]
+
+
+def test_group_no_records():
+    assert not group_question_records([])
+
+
+def test_question_cache_evicts_least_recently_used():
+    cache = QuestionCache(capacity=2)
+    cache.put(1, QUESTIONS[0])
+    cache.put(2, QUESTIONS[1])
+    assert cache.get(1) == QUESTIONS[0]
+    cache.put(3, QUESTIONS[2])
+    assert len(cache) == 2
+    assert cache.get(2) is None
+    assert cache.get(1) == QUESTIONS[0]
+    assert cache.get(3) == QUESTIONS[2]
+
+
+@pytest.mark.asyncio
+async def test_in_memory_question_ids():
+    storage = InMemoryStorage(QUESTIONS)
+    ids = await storage.get_question_ids(5)
+    assert ids == [1, 2, 3]
+    assert [await storage.get_question(i) for i in ids] == QUESTIONS
+    assert await storage.get_question(0) is None
+    assert await storage.get_question(4) is None
+
+
+class CountingStorage(InMemoryStorage):
+    def __init__(self):
+        super().__init__(QUESTIONS)
+        self.calls: List[str] = []
+        self.fail_writes = False
+
+    async def get_chat_handler(self, chat_id: int) -> Optional[bytes]:
+        self.calls.append("get")
+        return await super().get_chat_handler(chat_id)
+
+    async def get_chat_handlers(self, chat_ids: List[int]) -> Dict[int, bytes]:
+        self.calls.append("get_many")
+        return await super().get_chat_handlers(chat_ids)
+
+    async def set_chat_handlers(self, chat_handlers: Dict[int, bytes]):
+        self.calls.append("set_many")
+        if self.fail_writes:
+            raise RuntimeError("The database is down")
+        await super().set_chat_handlers(chat_handlers)
+
+
+@pytest.mark.asyncio
+async def test_in_memory_bulk_chat_handlers():
+    storage = InMemoryStorage(QUESTIONS)
+    await storage.set_chat_handlers({1: b"a", 2: b"b"})
+    assert await storage.get_chat_handlers([1, 2, 3]) == {1: b"a", 2: b"b"}
+
+
+@pytest.mark.asyncio
+async def test_batch_storage():
+    storage = CountingStorage()
+    await storage.set_chat_handlers({1: b"a", 2: b"b"})
+    storage.calls.clear()
+    batch = BatchStorage(storage)
+
+    await batch.load([1, 2, 3, 1])
+    assert await batch.get_chat_handler(1) == b"a"
+    assert await batch.get_chat_handler(3) is None
+    await batch.set_chat_handler(1, b"a2")
+    await batch.set_chat_handler(3, b"c")
+    assert await batch.get_chat_handler(1) == b"a2"
+    assert await storage.get_chat_handler(1) == b"a"
+
+    await batch.flush()
+    await batch.flush()
+    assert storage.calls == ["get_many", "get", "set_many"]
+    assert await storage.get_chat_handlers([1, 2, 3]) == {1: b"a2", 2: b"b", 3: b"c"}
+
+
+@pytest.mark.asyncio
+async def test_batch_storage_keeps_unwritten_changes():
+    storage = CountingStorage()
+    batch = BatchStorage(storage)
+    await batch.load([1])
+    await batch.set_chat_handler(1, b"a")
+    storage.fail_writes = True
+    with pytest.raises(RuntimeError):
+        await batch.flush()
+    assert batch.pending_count == 1
+
+    await storage.set_chat_handler(1, b"stale")
+    await batch.load([1, 2])
+    assert await batch.get_chat_handler(1) == b"a"
+    storage.fail_writes = False
+    await batch.flush()
+    assert batch.pending_count == 0
+    assert await storage.get_chat_handler(1) == b"a"
+
+
+@pytest.mark.asyncio
+async def test_batch_storage_delete():
+    storage = CountingStorage()
+    batch = BatchStorage(storage)
+    await batch.load([1])
+    await batch.set_chat_handler(1, b"a")
+    await batch.del_chat_handler(1)
+    assert await batch.get_chat_handler(1) is None
+    await batch.flush()
+    assert await storage.get_chat_handler(1) is None
+
+
+class PipelineCursor:
+    def __init__(self, row: Optional[tuple]):
+        self.row = row
+
+    async def fetchone(self) -> Optional[tuple]:
+        return self.row
+
+
+class PipelineConnection:
+    """Records how the statements are sent."""
+
+    def __init__(self, row: Optional[tuple]):
+        self.row = row
+        self.events: List[Any] = []
+
+    @asynccontextmanager
+    async def pipeline(self):
+        self.events.append("pipeline")
+        yield
+        self.events.append("sync")
+
+    @asynccontextmanager
+    async def transaction(self):
+        self.events.append("begin")
+        yield
+        self.events.append("commit")
+
+    async def execute(self, query: str, params: tuple, prepare: bool = False):
+        self.events.append((query.split()[0], params, prepare))
+        return PipelineCursor(self.row)
+
+
+class PipelinePool:
+    def __init__(self, row: Optional[tuple] = None):
+        self.row = row
+        self.connections: List[PipelineConnection] = []
+
+    @asynccontextmanager
+    async def connection(self):
+        self.connections.append(PipelineConnection(self.row))
+        yield self.connections[-1]
+
+
+@pytest.mark.asyncio
+async def test_postgres_chat_handler_statements_take_one_round_trip():
+    pool = PipelinePool((b"handler",))
+    storage = PostgresStorage(pool)  # type: ignore
+    assert await storage.get_chat_handler(1) == b"handler"
+    await storage.set_chat_handler(1, b"new")
+    await storage.set_chat_handlers({1: b"a", 2: b"b"})
+    await storage.del_chat_handler(1)
+
+    # A statement is prepared and sent with BEGIN and COMMIT at once.
+    assert [conn.events for conn in pool.connections] == [
+        ["pipeline", "begin", (statement, params, True), "commit", "sync"]
+        for statement, params in [
+            ("SELECT", (1,)),
+            ("INSERT", (1, b"new")),
+            ("INSERT", ([1, 2], [b"a", b"b"])),
+            ("DELETE", (1,)),
+        ]
+    ]
+
+
+@pytest.mark.asyncio
+async def test_postgres_missing_chat_handler():
+    storage = PostgresStorage(PipelinePool())  # type: ignore
+    assert await storage.get_chat_handler(1) is None
@@ -0,0 +1,89 @@
+import asyncio
+from typing import List, Optional, Tuple
+
+import pytest
+from tutils import FakeTelegramClient, make_update
+
+from telegram_client import NetworkException, Update
+
+
+class PollingTelegramClient(FakeTelegramClient):
+    def __init__(self, batches: List[Optional[List[Update]]]):
+        super().__init__()
+        self.batches = batches
+        self.requests: List[Tuple[int, int, Optional[int]]] = []
+
+    async def get_updates(
+        self, offset: int = 0, timeout: int = 0, limit: Optional[int] = None
+    ) -> List[Update]:
+        self.requests.append((offset, timeout, limit))
+        if not self.batches:
+            await asyncio.Event().wait()
+        batch = self.batches.pop(0)
+        if batch is None:
+            raise NetworkException("Telegram is down")
+        return batch
+
+
+@pytest.mark.asyncio
+async def test_updates_are_returned_in_order():
+    client = PollingTelegramClient(
+        [[make_update(1), make_update(2)], [], [make_update(3)]]
+    )
+    updates = client.updates(timeout=10, limit=5)
+    received = [(await anext(updates)).update_id for _ in range(3)]
+    await updates.close()
+
+    assert received == [1, 2, 3]
+    assert client.requests[:3] == [(0, 10, 5), (3, 10, 5), (3, 10, 5)]
+
+
+@pytest.mark.asyncio
+async def test_next_batch_is_prefetched():
+    client = PollingTelegramClient([[make_update(1), make_update(2)], [make_update(3)]])
+    updates = client.updates()
+    await anext(updates)
+    await asyncio.sleep(0)
+
+    assert len(client.requests) == 2
+    await updates.close()
+
+
+@pytest.mark.asyncio
+async def test_stream_survives_failed_request():
+    client = PollingTelegramClient([None, [make_update(7)]])
+    updates = client.updates()
+    with pytest.raises(NetworkException):
+        await anext(updates)
+
+    assert (await anext(updates)).update_id == 7
+    await updates.close()
+
+
+@pytest.mark.asyncio
+async def test_unconfirmed_updates_are_skipped_until_commit():
+    client = PollingTelegramClient(
+        [[make_update(1), make_update(2)], [make_update(2), make_update(3)]]
+    )
+    updates = client.updates(auto_commit=False)
+    assert (await anext(updates)).update_id == 1
+    assert (await anext(updates)).update_id == 2
+    assert (await anext(updates)).update_id == 3
+    assert client.requests[1][0] == 0
+
+    updates.commit(2)
+    await asyncio.sleep(0)
+    assert client.requests[2][0] == 2
+    await updates.close()
+
+
+@pytest.mark.asyncio
+async def test_next_batch():
+    client = PollingTelegramClient(
+        [[make_update(1), make_update(2), make_update(3)], [make_update(4)]]
+    )
+    updates = client.updates()
+    assert (await anext(updates)).update_id == 1
+    assert [u.update_id for u in await updates.next_batch()] == [2, 3]
+    assert [u.update_id for u in await updates.next_batch()] == [4]
+    await updates.close()
@@ -0,0 +1,60 @@
+import json
+
+import pytest
+from tutils import QUESTIONS, FakeTelegramClient
+
+import format as fmt
+from bot_state import BotStateFactory
+from chat_handler import ChatHandler
+from storage import InMemoryStorage
+from telegram_client import Chat, Message, SendMessagePayload, Update
+from webhook_reply import WebhookReplyClient
+
+
+async def make_chat_handler():
+    client = FakeTelegramClient()
+    reply_client = WebhookReplyClient(client)
+    state_factory = BotStateFactory(reply_client, InMemoryStorage(QUESTIONS))
+    handler = await ChatHandler.create(await state_factory.make_idle_state(), 111)
+    return handler, reply_client, client
+
+
+@pytest.mark.asyncio
+async def test_last_message_is_returned_inline():
+    handler, reply_client, client = await make_chat_handler()
+    async with reply_client.collect() as reply:
+        await handler.process(Update(1, Message(Chat(111), "hello")))
+
+    assert not client.sent_messages
+    body = reply.to_bytes()
+    assert body is not None
+    assert json.loads(body) == {
+        "method": "sendMessage",
+        "chat_id": 111,
+        "text": "Type /startGame to start a new game.",
+    }
+
+
+@pytest.mark.asyncio
+async def test_held_message_is_sent_before_next_one():
+    handler, reply_client, client = await make_chat_handler()
+    async with reply_client.collect() as reply:
+        await handler.process(Update(1, Message(Chat(111), "/startGame")))
+
+    assert client.sent_messages == [
+        SendMessagePayload(111, "Starting game!"),
+        SendMessagePayload(
+            111, fmt.make_question(QUESTIONS[0]), fmt.make_keyboard(QUESTIONS[0])
+        ),
+    ]
+    assert reply.to_bytes() is None
+
+
+@pytest.mark.asyncio
+async def test_messages_are_sent_outside_of_webhook():
+    handler, _, client = await make_chat_handler()
+    await handler.process(Update(1, Message(Chat(111), "hello")))
+
+    assert client.sent_messages == [
+        SendMessagePayload(111, "Type /startGame to start a new game.")
+    ]
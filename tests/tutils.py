@@ -1,9 +1,11 @@
+import asyncio
+import json
 from dataclasses import dataclass
 from enum import Enum
-from typing import List, Optional
+from typing import Dict, List, Optional, Tuple
 
 from chat_handler import ChatHandler
-from storage import Question
+from storage import InMemoryStorage, Question
 from telegram_client import (
     Chat,
     InlineKeyboardMarkup,
@@ -25,7 +27,9 @@ class FakeTelegramClient(TelegramClient):
     def __init__(self):
         self.sent_messages: List[SendMessagePayload | MessageEdit] = []
 
-    async def get_updates(self, offset: int = 0) -> List[Update]:
+    async def get_updates(
+        self, offset: int = 0, timeout: int = 0, limit: Optional[int] = None
+    ) -> List[Update]:
         raise NotImplementedError()
 
     async def send_message(self, payload: SendMessagePayload) -> int:
@@ -36,6 +40,53 @@ class FakeTelegramClient(TelegramClient):
         self.sent_messages.append(payload)
 
 
+class RecordingStorage(InMemoryStorage):
+    """Records the reads and writes of the chat handlers. `write_delay` makes
+    the writes slow and `fail_writes` makes them fail."""
+
+    def __init__(self, write_delay: float = 0):
+        super().__init__(QUESTIONS)
+        self.calls: List[Tuple[str, int]] = []
+        self.writes: List[Dict[int, bytes]] = []
+        self.write_delay = write_delay
+        self.fail_writes = False
+
+    async def get_chat_handler(self, chat_id: int) -> Optional[bytes]:
+        self.calls.append(("get", chat_id))
+        return await super().get_chat_handler(chat_id)
+
+    async def set_chat_handler(self, chat_id: int, chat_handler: bytes):
+        await self.set_chat_handlers({chat_id: chat_handler})
+
+    async def set_chat_handlers(self, chat_handlers: Dict[int, bytes]):
+        self.calls.extend(("set", chat_id) for chat_id in chat_handlers)
+        await asyncio.sleep(self.write_delay)
+        self.writes.append(dict(chat_handlers))
+        if self.fail_writes:
+            raise RuntimeError("The database is down")
+        await super().set_chat_handlers(chat_handlers)
+
+
+def make_update(update_id: int, chat_id: int = 111, text: str = "/startGame") -> Update:
+    return Update(update_id, Message(Chat(chat_id), text), None)
+
+
+def make_update_body(update_id: int, chat_id: int = 111) -> bytes:
+    """Returns the webhook request body Telegram sends for `make_update`."""
+
+    return json.dumps(
+        {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": 1650000000,
+                "chat": {"id": chat_id, "type": "private"},
+                "text": "/startGame",
+            },
+        }
+    ).encode()
+
+
 class MessageKind(Enum):
     USER = "user_mode"
     BOT_MSG = "bot_msg"